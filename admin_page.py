@@ -1,36 +1,110 @@
+import os
 import streamlit as st
 from phi.assistant import Assistant
-from phi.document.reader.pdf import PDFReader
-from phi.document.reader.website import WebsiteReader
 from phi.utils.log import logger
 from typing import List
-from phi.document import Document
-from db_config import get_connection
-import json
-
-def load_chat_from_db(user_id, run_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT messages FROM user_chat_sessions WHERE user_id = %s AND run_id = %s",
-        (user_id, run_id)
-    )
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return json.loads(result[0]) if result else None
+from db_config import get_pool_stats
+from chat_history import append_messages
+from chat_view import open_window, show_window
+from conversation_export import EXPORT_DIRECTORY, EXPORT_DOWNLOAD_LIMIT, EXPORT_FORMATS, export_conversations, export_filename
+from answer_cache import run_with_answer_cache, invalidate_answer_cache, get_answer_cache_stats
+from embedding_cache import get_embedding_cache_stats
+from streaming import get_streaming_stats, render_stream
+from resilience import LLMUnavailable, get_resilience_stats
+from user_auth import get_auth_stats
+from metrics import METRICS_HOST, METRICS_PORT, get_stage_summary, get_token_summary
+from ingestion_jobs import enqueue_job, list_jobs, retry_job, start_workers
+from assistant import get_auto_rag_assistant, get_vector_db
+from web_crawler import PostgresCrawlStateStore
+from tenants import DEFAULT_TENANT, list_tenants, list_user_tenants, set_user_tenants, validate_tenant
 
 def save_chat_to_db(user_id, run_id, messages):
-    conn = get_connection()
-    cursor = conn.cursor()
-    messages_json = json.dumps(messages)
-    cursor.execute(
-        "INSERT INTO user_chat_sessions (user_id, run_id, messages) VALUES (%s, %s, %s) ON CONFLICT (user_id, run_id) DO UPDATE SET messages = %s",
-        (user_id, run_id, messages_json, messages_json)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    """ Append new messages to the stored conversation """
+    append_messages(user_id, run_id, messages, "document")
+
+def render_chat_message(message):
+    if message["role"] == "system":
+        return
+    with st.chat_message(message["role"]):
+        st.write(message["content"])
+
+def show_ingestion_jobs():
+    """ Status, progress and timing of the most recent ingestion jobs """
+    jobs = list_jobs()
+    if not jobs:
+        st.caption("Belum ada job")
+        return
+    for job in jobs:
+        progress = f"{job['pages_done']}/{job['total_pages']} halaman" if job["total_pages"] else f"{job['pages_done']} halaman"
+        timing = f"tunggu {job['wait_seconds'] or 0:.0f}s, proses {job['run_seconds'] or 0:.0f}s" if job["started_at"] else "menunggu"
+        st.markdown(f"**#{job['id']} {job['source']}** — {job['status']}, {progress}, {job['chunks_done']} chunk, {timing}")
+        if job["stats"]:
+            st.caption(f"{job['stats']['pages_per_second']} halaman/s, {job['stats']['embeddings_per_second']} embedding/s")
+            if "crawl" in job["stats"]:
+                crawl = job["stats"]["crawl"]
+                st.caption(f"Crawl: {crawl['changed']} berubah, {crawl['unchanged'] + crawl['not_modified']} tidak berubah, {crawl['errors']} gagal")
+        if job["error"]:
+            st.caption(f"Error: {job['error']}")
+            if job["status"] == "queued" and job["retry_at"]:
+                st.caption(f"Dicoba lagi setelah {job['retry_at']:%H:%M:%S}")
+        if job["status"] == "failed" and st.button("Ulangi", key=f"retry_ingestion_job_{job['id']}"):
+            retry_job(job["id"])
+            st.rerun()
+
+def show_user_tenants(tenant_options):
+    """ Assign the tenants whose documents each user may search """
+    users = list_user_tenants()
+    if not users:
+        return
+    selected = st.selectbox("Pengguna", options=users, format_func=lambda user: user["username"])
+    options = sorted(set(tenant_options) | set(selected["tenants"]))
+    tenants = st.multiselect("Tenant", options=options, default=selected["tenants"] or [DEFAULT_TENANT],
+                             key=f"user_tenants_{selected['user_id']}")
+    if st.button("Simpan akses"):
+        set_user_tenants(selected["user_id"], tenants)
+        st.success("Akses tenant disimpan")
+
+def show_conversation_export():
+    """ Export stored conversations across users, dates and chat types for audit trails """
+    users = list_user_tenants()
+    selected_users = st.multiselect("Pengguna", options=users, format_func=lambda user: user["username"],
+                                    key="export_users", help="Kosongkan untuk semua pengguna")
+    period = st.date_input("Periode", value=[], key="export_period", help="Kosongkan untuk semua tanggal")
+    chat_types = st.multiselect("Jenis chat", options=["document", "database"], key="export_chat_types")
+    export_format = st.selectbox("Format", options=EXPORT_FORMATS, key="export_format")
+    if st.button("Ekspor"):
+        since, until = (list(period) + [None, None])[:2]
+        os.makedirs(EXPORT_DIRECTORY, exist_ok=True)
+        progress = st.empty()
+        st.session_state["last_export"] = export_conversations(
+            os.path.join(EXPORT_DIRECTORY, export_filename(export_format)), export_format,
+            user_ids=[user["user_id"] for user in selected_users], since=since, until=until or since, chat_types=chat_types,
+            progress=lambda written: progress.caption(f"{written} pesan diekspor..."),
+        )
+        progress.empty()
+
+    export = st.session_state.get("last_export")
+    if export:
+        st.caption(f"{export['messages']} pesan, {export['bytes'] / 1024 / 1024:.1f} MB, {export['seconds']} detik")
+        if export["bytes"] <= EXPORT_DOWNLOAD_LIMIT:
+            with open(export["path"], "rb") as f:
+                st.download_button("Unduh ekspor", f, file_name=os.path.basename(export["path"]))
+        else:
+            st.info(f"File terlalu besar untuk diunduh lewat browser, ambil dari server: {export['path']}")
+
+def show_performance():
+    """ Latency per stage of a request and tokens per user and model, since this server process started """
+    stages = get_stage_summary()
+    if stages:
+        st.dataframe(stages, hide_index=True, use_container_width=True)
+    else:
+        st.caption("Belum ada data")
+    tokens = get_token_summary()
+    if tokens:
+        st.dataframe(tokens, hide_index=True, use_container_width=True)
+    if METRICS_PORT:
+        st.caption(f"Format Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    st.button("Muat ulang", key="refresh_performance")
 
 def restart_assistant():
     logger.debug("---*--- Restarting Assistant ---*---")
@@ -46,16 +120,32 @@ def show_admin_page():
     st.header("Halaman Admin")
     st.subheader("Manage Document dan AI Model")
     llm_model = st.sidebar.selectbox("Pilih model", options=["gpt-4-turbo", "gpt-3.5-turbo"])
+    use_answer_cache = st.sidebar.toggle("Gunakan cache jawaban", value=False, help="Jawab pertanyaan yang mirip dengan jawaban sebelumnya")
     if "llm_model" not in st.session_state:
         st.session_state["llm_model"] = llm_model
     elif st.session_state["llm_model"] != llm_model:
         st.session_state["llm_model"] = llm_model
         restart_assistant()
 
+    # Uploads, clearing and the admin chat all work on one tenant's knowledge base
+    new_tenant = st.sidebar.text_input("Tenant baru", help="Huruf kecil, angka dan garis bawah")
+    tenant_options = list_tenants()
+    if new_tenant and new_tenant not in tenant_options:
+        try:
+            tenant_options.append(validate_tenant(new_tenant))
+        except ValueError as e:
+            st.sidebar.error(str(e))
+    tenant = st.sidebar.selectbox("Tenant knowledge base", options=tenant_options)
+    if "knowledge_tenant" not in st.session_state:
+        st.session_state["knowledge_tenant"] = tenant
+    elif st.session_state["knowledge_tenant"] != tenant:
+        st.session_state["knowledge_tenant"] = tenant
+        restart_assistant()
+
     auto_rag_assistant: Assistant
     if "auto_rag_assistant" not in st.session_state or st.session_state["auto_rag_assistant"] is None:
         logger.info(f"---*--- Creating {llm_model} Assistant ---*---")
-        auto_rag_assistant = get_auto_rag_assistant(llm_model=llm_model)
+        auto_rag_assistant = get_auto_rag_assistant(llm_model=llm_model, tenants=[tenant])
         st.session_state["auto_rag_assistant"] = auto_rag_assistant
     else:
         auto_rag_assistant = st.session_state["auto_rag_assistant"]
@@ -68,56 +158,67 @@ def show_admin_page():
 
     user_id = st.session_state["user_id"]
     run_id = st.session_state["auto_rag_assistant_run_id"]
-    assistant_chat_history = load_chat_from_db(user_id, run_id)
-    if assistant_chat_history:
-        logger.debug("Loading chat history from database")
-        st.session_state["messages"] = assistant_chat_history
-    else:
-        logger.debug("No chat history found")
-        st.session_state["messages"] = [{"role": "assistant", "content": "Halo, ada yang bisa saya bantu?"}]
+    # The last messages are loaded once per conversation; later reruns keep appending to st.session_state["messages"]
+    assistant_chat_history = open_window("admin_chat_window", user_id, run_id)
+    if assistant_chat_history is not None:
+        if assistant_chat_history:
+            logger.debug("Loading chat history from database")
+            st.session_state["messages"] = assistant_chat_history
+        else:
+            logger.debug("No chat history found")
+            st.session_state["messages"] = [{"role": "assistant", "content": "Halo, ada yang bisa saya bantu?"}]
+        st.session_state["messages_stored"] = bool(assistant_chat_history)
 
     if prompt := st.chat_input():
-        st.session_state["messages"].append({"role": "user", "content": prompt})
-        save_chat_to_db(user_id, run_id, st.session_state["messages"])
+        user_message = {"role": "user", "content": prompt}
+        st.session_state["messages"].append(user_message)
+        # A new conversation also persists its greeting so reloads render the same history
+        new_messages = [user_message] if st.session_state["messages_stored"] else st.session_state["messages"]
+        save_chat_to_db(user_id, run_id, new_messages)
+        st.session_state["messages_stored"] = True
 
-    for message in st.session_state["messages"]:
-        if message["role"] == "system":
-            continue
-        with st.chat_message(message["role"]):
-            st.write(message["content"])
+    show_window("admin_chat_window", st.session_state["messages"], render_chat_message)
 
     last_message = st.session_state["messages"][-1]
     if last_message.get("role") == "user":
         question = last_message["content"]
         with st.chat_message("assistant"):
-            resp_container = st.empty()
-            response = ""
-            for delta in auto_rag_assistant.run(question):
-                response += delta
-                resp_container.markdown(response)
-            st.session_state["messages"].append({"role": "assistant", "content": response})
-            save_chat_to_db(user_id, run_id, st.session_state["messages"])
+            answer_stream = (
+                run_with_answer_cache(auto_rag_assistant, question) if use_answer_cache else auto_rag_assistant.run(question)
+            )
+            placeholder = st.empty()
+            try:
+                response, _ = render_stream(answer_stream, placeholder)
+            except LLMUnavailable as e:
+                # Deadline exceeded, circuit breaker open or the answer broke off; the question is answered on the next attempt
+                placeholder.error(f"Layanan AI sedang tidak tersedia, silakan coba lagi nanti. ({e})")
+                response = None
+        if response is not None:
+            assistant_message = {"role": "assistant", "content": response}
+            st.session_state["messages"].append(assistant_message)
+            save_chat_to_db(user_id, run_id, [assistant_message])
 
     if auto_rag_assistant.knowledge_base:
+        # Ingestion runs in background workers, so it survives reruns and closed tabs
+        start_workers()
         if "url_scrape_key" not in st.session_state:
             st.session_state["url_scrape_key"] = 0
 
         input_url = st.sidebar.text_input(
             "Tambah URL ke Knowledge Base", type="default", key=st.session_state["url_scrape_key"]
         )
+        crawl_depth = st.sidebar.number_input("Kedalaman crawl", min_value=1, max_value=5, value=2)
+        crawl_links = st.sidebar.number_input("Maks halaman crawl", min_value=1, max_value=1000, value=20)
         add_url_button = st.sidebar.button("Tambah URL")
         if add_url_button:
-            if input_url is not None:
-                alert = st.sidebar.info("Memroses URLs...", icon="ℹ️")
-                if f"{input_url}_scraped" not in st.session_state:
-                    scraper = WebsiteReader(max_links=2, max_depth=1)
-                    web_documents: List[Document] = scraper.read(input_url)
-                    if web_documents:
-                        auto_rag_assistant.knowledge_base.load_documents(web_documents, upsert=True)
-                    else:
-                        st.sidebar.error("Tidak dapat membaca website")
-                    st.session_state[f"{input_url}_uploaded"] = True
-                alert.empty()
+            if input_url:
+                if f"{tenant}:{input_url}_scraped" not in st.session_state:
+                    job_id = enqueue_job(
+                        "url", input_url, user_id=user_id,
+                        options={"max_depth": int(crawl_depth), "max_links": int(crawl_links), "tenant": tenant},
+                    )
+                    st.sidebar.info(f"URL masuk antrean (job #{job_id})", icon="ℹ️")
+                    st.session_state[f"{tenant}:{input_url}_scraped"] = True
 
         if "file_uploader_key" not in st.session_state:
             st.session_state["file_uploader_key"] = 100
@@ -126,21 +227,26 @@ def show_admin_page():
             "Tambah a PDF :page_facing_up:", type="pdf", key=st.session_state["file_uploader_key"]
         )
         if uploaded_file is not None:
-            alert = st.sidebar.info("Memroses PDF...", icon="🧠")
             auto_rag_name = uploaded_file.name.split(".")[0]
-            if f"{auto_rag_name}_uploaded" not in st.session_state:
-                reader = PDFReader()
-                auto_rag_documents: List[Document] = reader.read(uploaded_file)
-                if auto_rag_documents:
-                    auto_rag_assistant.knowledge_base.load_documents(auto_rag_documents, upsert=True)
-                else:
-                    st.sidebar.error("Tidak dapat membaca PDF")
-                st.session_state[f"{auto_rag_name}_uploaded"] = True
-            alert.empty()
-
-    if auto_rag_assistant.knowledge_base and auto_rag_assistant.knowledge_base.vector_db:
+            if f"{tenant}:{auto_rag_name}_uploaded" not in st.session_state:
+                job_id = enqueue_job(
+                    "pdf", auto_rag_name, payload=uploaded_file.getvalue(), user_id=user_id, options={"tenant": tenant}
+                )
+                st.sidebar.info(f"PDF masuk antrean (job #{job_id})", icon="🧠")
+                st.session_state[f"{tenant}:{auto_rag_name}_uploaded"] = True
+
+        with st.sidebar.expander("Antrean ingestion", expanded=True):
+            st.button("Muat ulang status", key="refresh_ingestion_jobs")
+            show_ingestion_jobs()
+
+    # Clearing and index maintenance act on the selected tenant's collection, not on the assistant's search view
+    tenant_vector_db = get_vector_db(tenant)
+    if auto_rag_assistant.knowledge_base:
         if st.sidebar.button("Bersihkan Knowledge Base"):
-            auto_rag_assistant.knowledge_base.vector_db.clear()
+            tenant_vector_db.clear()
+            # Without the crawl validators the tenant's sites are fetched and ingested again when re-added
+            PostgresCrawlStateStore(namespace=tenant).clear()
+            invalidate_answer_cache()
             st.sidebar.success("Knowledge base Terhapus")
 
     if auto_rag_assistant.storage:
@@ -149,13 +255,54 @@ def show_admin_page():
         if st.session_state["auto_rag_assistant_run_id"] != new_auto_rag_assistant_run_id:
             logger.info(f"---*--- Loading {llm_model} run: {new_auto_rag_assistant_run_id} ---*---")
             st.session_state["auto_rag_assistant"] = get_auto_rag_assistant(
-                llm_model=llm_model, run_id=new_auto_rag_assistant_run_id
+                llm_model=llm_model, run_id=new_auto_rag_assistant_run_id, tenants=[tenant]
             )
             st.rerun()
 
     if st.sidebar.button("Chat baru"):
         restart_assistant()
 
+    with st.sidebar.expander("Akses tenant pengguna"):
+        show_user_tenants(tenant_options)
+
+    with st.sidebar.expander("Ekspor percakapan"):
+        show_conversation_export()
+
+    with st.sidebar.expander("Database pool"):
+        st.json(get_pool_stats())
+
+    with st.sidebar.expander("Answer cache"):
+        st.json(get_answer_cache_stats())
+
+    with st.sidebar.expander("Embedding cache"):
+        st.json(get_embedding_cache_stats())
+
+    with st.sidebar.expander("Streaming"):
+        st.json(get_streaming_stats())
+
+    with st.sidebar.expander("LLM resilience"):
+        st.json(get_resilience_stats())
+
+    with st.sidebar.expander("Login & sesi"):
+        st.json(get_auth_stats())
+
+    with st.sidebar.expander("Performa per tahap"):
+        show_performance()
+
+    vector_db = tenant_vector_db
+    if vector_db.index is not None:
+        with st.sidebar.expander("Vector index"):
+            st.json({
+                "rows": vector_db.get_count(),
+                "index": vector_db.get_index_info(),
+                "retrieval": vector_db.retrieval,
+                "fulltext_config": vector_db.fulltext_config,
+            })
+            if st.button("Bangun ulang index"):
+                with st.spinner("Membangun index..."):
+                    vector_db.optimize(force=True)
+                st.rerun()
+
     if "embeddings_model_updated" in st.session_state:
         st.sidebar.info("Harap tambahkan dokumen lagi karena model penyematan telah berubah.")
         st.session_state["embeddings_model_updated"] = False
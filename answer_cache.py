@@ -0,0 +1,207 @@
+import collections
+import threading
+import time
+from typing import Iterator, Optional
+
+from phi.assistant import Assistant
+from phi.llm.message import Message
+from phi.utils.log import logger
+
+from db_config import db_connection
+
+# Minimum cosine similarity between two questions for the cached answer to be reused
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TABLE = "ai.auto_rag_answer_cache"
+# Seconds a knowledge-base version lookup is reused before asking Postgres again
+KB_VERSION_CHECK_INTERVAL = 5
+
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+_table_ready = False
+_kb_versions = {}
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _vector_literal(embedding) -> str:
+    return "[" + ",".join(repr(float(value)) for value in embedding) + "]"
+
+
+def _ensure_table(cursor) -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    cursor.execute("CREATE SCHEMA IF NOT EXISTS ai")
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {ANSWER_CACHE_TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            llm_model TEXT NOT NULL,
+            embedder TEXT NOT NULL,
+            kb_version TEXT NOT NULL,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            tokens INT NOT NULL DEFAULT 0,
+            embedding vector NOT NULL,
+            hits INT NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ DEFAULT now()
+        )
+        """
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS auto_rag_answer_cache_lookup_idx ON {ANSWER_CACHE_TABLE} (llm_model, embedder, kb_version)"
+    )
+    _table_ready = True
+
+
+def get_kb_version(cursor, knowledge_table: str) -> str:
+    """Change marker of the knowledge-base table: its relfilenode plus its insert/update/delete counters"""
+    cached = _kb_versions.get(knowledge_table)
+    if cached is not None and time.monotonic() - cached[1] < KB_VERSION_CHECK_INTERVAL:
+        return cached[0]
+    cursor.execute(
+        """
+        SELECT c.relfilenode, COALESCE(s.n_tup_ins + s.n_tup_upd + s.n_tup_del, 0)
+        FROM pg_catalog.pg_class c
+        LEFT JOIN pg_catalog.pg_stat_user_tables s ON s.relid = c.oid
+        WHERE c.oid = to_regclass(%s)
+        """,
+        (knowledge_table,),
+    )
+    row = cursor.fetchone()
+    version = f"{row[0]}:{row[1]}" if row else "missing"
+    _kb_versions[knowledge_table] = (version, time.monotonic())
+    return version
+
+
+def invalidate_answer_cache() -> None:
+    """Drop every cached answer, e.g. after documents were added to or removed from the knowledge base"""
+    _kb_versions.clear()
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            _ensure_table(cursor)
+            cursor.execute(f"TRUNCATE {ANSWER_CACHE_TABLE}")
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        logger.warning(f"Could not clear the answer cache: {e}")
+
+
+def _lookup(assistant: Assistant, embedding, kb_version: str, cursor) -> Optional[tuple]:
+    embedder = assistant.knowledge_base.vector_db.embedder
+    cursor.execute(
+        f"""
+        SELECT id, answer, tokens, 1 - (embedding <=> %s::vector) AS similarity
+        FROM {ANSWER_CACHE_TABLE}
+        WHERE llm_model = %s AND embedder = %s AND kb_version = %s
+        ORDER BY embedding <=> %s::vector
+        LIMIT 1
+        """,
+        (embedding, assistant.llm.model, f"{embedder.model}:{embedder.dimensions}", kb_version, embedding),
+    )
+    row = cursor.fetchone()
+    if row is None or row[3] < ANSWER_CACHE_THRESHOLD:
+        return None
+    cursor.execute(f"UPDATE {ANSWER_CACHE_TABLE} SET hits = hits + 1 WHERE id = %s", (row[0],))
+    return row
+
+
+def _remember(assistant: Assistant, question: str, answer: str) -> None:
+    """Record a cached answer in the run, as assistant.run records its answers, so follow-ups see it"""
+    messages = [Message(role="user", content=question), Message(role="assistant", content=answer)]
+    assistant.memory.add_chat_messages(messages)
+    assistant.memory.add_llm_messages(messages)
+    assistant.output = answer
+    try:
+        assistant.write_to_storage()
+    except Exception as e:
+        logger.warning(f"Could not store the cached answer in the assistant run: {e}")
+
+
+def run_with_answer_cache(assistant: Assistant, question: str) -> Iterator[str]:
+    """Stream an answer for `question`, reusing the answer to a sufficiently similar earlier question.
+
+    Only answers produced against the current knowledge-base version are reused, and only for the first question
+    of a run: a follow-up depends on the conversation before it, which the cache key does not cover. Any cache
+    error falls back to a normal `assistant.run`.
+    """
+    knowledge_base = assistant.knowledge_base
+    if knowledge_base is None or knowledge_base.vector_db is None:
+        yield from assistant.run(question)
+        return
+
+    try:
+        # Loads the run's chat history, as assistant.run would
+        assistant.read_from_storage()
+    except Exception as e:
+        logger.warning(f"Could not read the assistant run: {e}")
+    if any(message.role == "user" for message in assistant.memory.chat_history):
+        _count("skipped_follow_ups")
+        yield from assistant.run(question)
+        return
+
+    vector_db = knowledge_base.vector_db
+    embedder = vector_db.embedder
+    # A routed knowledge base spans several tenant tables; the relfilenodes in the version identify the set
+    knowledge_tables = getattr(vector_db, "qualified_tables", None) or [
+        f"{vector_db.schema}.{vector_db.collection}" if vector_db.schema else vector_db.collection
+    ]
+    try:
+        embedding = _vector_literal(embedder.get_embedding(question))
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            _ensure_table(cursor)
+            kb_version = ",".join(get_kb_version(cursor, table) for table in knowledge_tables)
+            hit = _lookup(assistant, embedding, kb_version, cursor)
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        logger.warning(f"Answer cache unavailable: {e}")
+        _count("errors")
+        yield from assistant.run(question)
+        return
+
+    if hit is not None:
+        _count("hits")
+        _count("saved_tokens", hit[2])
+        _remember(assistant, question, hit[1])
+        yield hit[1]
+        return
+
+    _count("misses")
+    tokens_before = assistant.llm.metrics.get("total_tokens", 0) if assistant.llm else 0
+    answer = ""
+    for delta in assistant.run(question):
+        answer += delta
+        yield delta
+    tokens = (assistant.llm.metrics.get("total_tokens", 0) if assistant.llm else 0) - tokens_before
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                INSERT INTO {ANSWER_CACHE_TABLE} (llm_model, embedder, kb_version, question, answer, tokens, embedding)
+                VALUES (%s, %s, %s, %s, %s, %s, %s::vector)
+                """,
+                (assistant.llm.model, f"{embedder.model}:{embedder.dimensions}", kb_version, question, answer,
+                 max(tokens, len(answer) // 4), embedding),
+            )
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        logger.warning(f"Could not store answer in cache: {e}")
+        _count("errors")
+
+
+def get_answer_cache_stats() -> dict:
+    """Hit rate and estimated tokens saved by the answer cache in this process"""
+    with _stats_lock:
+        stats = {key: _stats[key] for key in ("hits", "misses", "skipped_follow_ups", "saved_tokens", "errors")}
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
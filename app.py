@@ -1,10 +1,8 @@
 import nest_asyncio
 import streamlit as st
-from phi.utils.log import logger
-from assistant import get_auto_rag_assistant  # type: ignore
-from user_auth import login, logout, is_authenticated, is_admin
-from user_page import show_user_page
-from admin_page import show_admin_page
+from db_config import ensure_db
+from metrics import set_user, start_metrics_server
+from user_auth import LoginBusy, login, logout, resume_from_cookie, sync_session_cookie, is_authenticated, is_admin
 
 nest_asyncio.apply()
 st.set_page_config(
@@ -14,13 +12,30 @@ st.set_page_config(
 st.image("images/logo.png", use_column_width=True)
 
 def main() -> None:
+    # Prometheus text endpoint (METRICS_PORT), started once per server process
+    start_metrics_server()
+    # Creates tables missing from older databases (e.g. user_chat_messages), once per server process
+    ensure_db()
+
+    # A refresh starts a new Streamlit session; the session cookie logs the browser back in
+    if not is_authenticated():
+        resume_from_cookie()
+    sync_session_cookie()
+
+    # Tokens used during this rerun are counted for the logged-in user
+    set_user(st.session_state.get("username"))
+
     if not is_authenticated():
         # Login form
         st.sidebar.header("Login")
         username = st.sidebar.text_input("Username")
         password = st.sidebar.text_input("Password", type="password")
         if st.sidebar.button("Login"):
-            user_id = login(username, password)
+            try:
+                user_id = login(username, password)
+            except LoginBusy:
+                st.sidebar.error("Server sedang sibuk, silakan coba login lagi sebentar lagi")
+                return
             if user_id:
                 st.session_state["user_id"] = user_id
                 st.sidebar.success("Login successful")
@@ -28,19 +43,18 @@ def main() -> None:
             else:
                 st.sidebar.error("Invalid credentials")
     else:
-        # Initialize auto_rag_assistant if not already set
-        if "auto_rag_assistant" not in st.session_state:
-            st.session_state["auto_rag_assistant"] = get_auto_rag_assistant(llm_model="gpt-4-turbo")
-
         # Logout button
         if st.sidebar.button("Logout"):
             logout()
             st.experimental_rerun()
 
-        # Role-based navigation
+        # Role-based navigation; each page is imported only when shown.
+        # The admin page creates its own assistant on first render.
         if is_admin():
+            from admin_page import show_admin_page
             show_admin_page()
         else:
+            from user_page import show_user_page
             show_user_page()
 
 main()
@@ -0,0 +1,148 @@
+""" ANN index benchmark: recall@5 and search latency of HNSW / IVFFlat against exact search.
+
+Loads synthetic clustered, normalized vectors into scratch tables ai.ann_bench_<rows>, computes exact
+top-5 neighbours with a sequential scan, then builds each index through ManagedPgVector and measures
+recall@5 and p50/p95 latency per search setting. Needs the database with the pgvector extension.
+
+    python benchmarks/ann_index.py --sizes 10000 100000
+    python benchmarks/ann_index.py --sizes 1000000 --queries 50 --ef-search 40 100 200
+
+1M x 1536 vectors take about 6 GB of table space and a long index build; drop the tables with --drop.
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from phi.embedder.base import Embedder  # noqa: E402
+from phi.vectordb.pgvector.index import HNSW, Ivfflat  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from db_config import get_connection, get_engine  # noqa: E402
+from vector_store import INDEX_MAINTENANCE_WORK_MEM, ManagedPgVector, ivfflat_lists  # noqa: E402
+
+TOP_K = 5
+LOAD_BATCH = 10_000
+
+def vector_literal(vector):
+    return "[" + ",".join(f"{value:.6f}" for value in vector) + "]"
+
+def synthetic_vectors(rng, centers, count):
+    """ Points around random cluster centers, normalized like OpenAI embeddings """
+    points = centers[rng.integers(0, len(centers), count)] + rng.normal(scale=0.5, size=(count, centers.shape[1]))
+    return (points / np.linalg.norm(points, axis=1, keepdims=True)).astype(np.float32)
+
+def load_table(vector_db, rows, rng, centers):
+    vector_db.create()
+    if vector_db.get_count() >= rows:
+        return
+    vector_db.clear()
+    conn = get_connection()
+    cursor = conn.cursor()
+    for start in range(0, rows, LOAD_BATCH):
+        batch = synthetic_vectors(rng, centers, min(LOAD_BATCH, rows - start))
+        buffer = io.StringIO("".join(f"{start + i}\t{start + i}\t{vector_literal(vector)}\n" for i, vector in enumerate(batch)))
+        cursor.copy_expert(f"COPY {vector_db.qualified_table} (id, name, embedding) FROM STDIN", buffer)
+        conn.commit()
+    cursor.execute(f"ANALYZE {vector_db.qualified_table}")
+    conn.commit()
+    conn.close()
+
+def search(cursor, table, query, settings):
+    cursor.execute("BEGIN")
+    for key, value in settings.items():
+        cursor.execute(f"SET LOCAL {key} = {value}")
+    started = time.perf_counter()
+    cursor.execute(f"SELECT id FROM {table} ORDER BY embedding <=> %s::vector LIMIT {TOP_K}", (query,))
+    ids = [row[0] for row in cursor.fetchall()]
+    elapsed = time.perf_counter() - started
+    cursor.execute("COMMIT")
+    return ids, elapsed
+
+def run_queries(table, queries, settings):
+    conn = get_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    results, latencies = [], []
+    for query in queries:
+        ids, elapsed = search(cursor, table, query, settings)
+        results.append(ids)
+        latencies.append(elapsed * 1000)
+    conn.close()
+    return results, latencies
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def report(label, build_seconds, index_bytes, results, truth, latencies):
+    recall = statistics.mean(len(set(found) & set(expected)) / TOP_K for found, expected in zip(results, truth))
+    build = f"{build_seconds:9.1f}" if build_seconds is not None else f"{'-':>9}"
+    size = f"{index_bytes / 2**20:10.1f}" if index_bytes is not None else f"{'-':>10}"
+    print(f"  {label:34} {build} {size} {recall:9.3f} {percentile(latencies, 0.5):8.2f} {percentile(latencies, 0.95):8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--index", nargs="+", choices=["hnsw", "ivfflat"], default=["hnsw", "ivfflat"])
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 40, 100])
+    parser.add_argument("--lists", type=int, default=0, help="IVFFlat lists; 0 uses the same rule as the app")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 10, 20])
+    parser.add_argument("--drop", action="store_true", help="drop the scratch tables afterwards")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    embedder = Embedder(dimensions=args.dimensions)
+    configuration = {"maintenance_work_mem": INDEX_MAINTENANCE_WORK_MEM}
+    for rows in args.sizes:
+        rng = np.random.default_rng(args.seed)
+        centers = rng.normal(size=(args.clusters, args.dimensions))
+        vector_db = ManagedPgVector(collection=f"ann_bench_{rows}", db_engine=get_engine(), embedder=embedder, index=None)
+        started = time.perf_counter()
+        load_table(vector_db, rows, rng, centers)
+        print(f"\n{rows} vectors x {args.dimensions} dims (loaded in {time.perf_counter() - started:.1f}s)")
+        print(f"  {'search':34} {'build (s)':>9} {'index (MB)':>10} {'recall@5':>9} {'p50 (ms)':>8} {'p95 (ms)':>8}")
+
+        queries = [vector_literal(vector) for vector in synthetic_vectors(rng, centers, args.queries)]
+        truth, latencies = run_queries(vector_db.qualified_table, queries, {"enable_indexscan": "off"})
+        report("exact (sequential scan)", None, None, truth, truth, latencies)
+
+        for kind in args.index:
+            if kind == "hnsw":
+                vector_db.index = HNSW(m=args.m, ef_construction=args.ef_construction, configuration=configuration)
+                settings = [("hnsw.ef_search", value) for value in args.ef_search]
+            else:
+                vector_db.index = Ivfflat(lists=args.lists or 100, dynamic_lists=args.lists == 0, configuration=configuration)
+                settings = [("ivfflat.probes", value) for value in args.probes]
+            started = time.perf_counter()
+            vector_db.optimize(force=True)
+            build_seconds = time.perf_counter() - started
+            info = vector_db.get_index_info()
+            if info is None:
+                print(f"  {kind}: no index built on {rows} rows")
+                continue
+            params = (f"m={args.m}, ef_construction={args.ef_construction}" if kind == "hnsw"
+                      else f"lists={args.lists or ivfflat_lists(rows)}")
+            print(f"  {kind} ({params})")
+            for key, value in settings:
+                results, latencies = run_queries(vector_db.qualified_table, queries, {key: value})
+                report(f"{key}={value}", build_seconds, info["size_bytes"], results, truth, latencies)
+            with vector_db.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(f"DROP INDEX IF EXISTS {vector_db._qualify(info['name'])}"))
+
+        if args.drop:
+            vector_db.delete()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+""" Chat history render benchmark: rerun time of a chat page at 10/100/1000 messages, full vs. windowed.
+
+Runs a page that renders a conversation like the chat pages do, through Streamlit's AppTest, which executes
+the script and builds every element the browser would receive. "full" renders every message, as the pages did
+on each rerun; "windowed" renders through chat_view.show_window. The history is kept in session state, as it is
+after chat_view.open_window loaded it once, so the numbers are render cost only. No database or OpenAI key needed.
+
+    python benchmarks/chat_window.py --sizes 10 100 1000 --reruns 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+
+def chat_page(message_count, windowed, window):
+    import streamlit as st
+
+    if "history" not in st.session_state:
+        st.session_state["history"] = [
+            {"role": "user" if i % 2 == 0 else "assistant",
+             "content": f"Pesan {i}: berapa jumlah transaksi akun 5.1.02.01 pada periode ini? " * 3}
+            for i in range(message_count)
+        ]
+
+    def render_message(message):
+        with st.chat_message(message["role"]):
+            st.write(message["content"])
+
+    if windowed:
+        from chat_view import show_window
+
+        show_window("benchmark_window", st.session_state["history"], render_message, window=window)
+    else:
+        for message in st.session_state["history"]:
+            render_message(message)
+    st.chat_input()
+
+
+def rerun_ms(message_count, windowed, window, reruns):
+    app = AppTest.from_function(chat_page, args=(message_count, windowed, window), default_timeout=120)
+    app.run()
+    timings = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        timings.append((time.perf_counter() - started) * 1000)
+    assert not app.exception, app.exception
+    return statistics.median(timings), len(app.chat_message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--window", type=int, default=30)
+    parser.add_argument("--reruns", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'messages':>8} {'full (ms)':>10} {'rendered':>8} {'windowed (ms)':>13} {'rendered':>8}")
+    for size in args.sizes:
+        full_ms, full_rendered = rerun_ms(size, False, args.window, args.reruns)
+        windowed_ms, windowed_rendered = rerun_ms(size, True, args.window, args.reruns)
+        print(f"{size:8} {full_ms:10.1f} {full_rendered:8} {windowed_ms:13.1f} {windowed_rendered:8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+""" Conversation export benchmark: messages/s, output size and peak memory per export format.
+
+Feeds synthetic message rows, in the batches the server-side cursor of conversation_export returns, through
+its writers. This measures the serialization and compression side of an export; with a database the fetch
+runs concurrently on the server. Peak memory is Python allocations (tracemalloc, in a second untimed pass) and
+should stay flat as --messages grows. No database needed.
+
+    python benchmarks/conversation_export.py --messages 1000000
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_export import EXPORT_FETCH_SIZE, EXPORT_FORMATS, write_messages  # noqa: E402
+
+SENTENCES = (
+    "Berapa jumlah transaksi akun 5.1.02.01 selama periode yang diminta?",
+    "Berdasarkan hasil query, terdapat 42 transaksi pada akun tersebut.",
+    "Nilai terbesar berasal dari belanja modal peralatan, sesuai PMK-190/PMK.05/2012.",
+    "Tampilkan temuan pemeriksaan dengan risiko tinggi di unit kerja ini.",
+)
+
+
+def build_batches(fetch_size, seed, distinct_batches=20):
+    """ A few batches of synthetic rows, cycled through by message_batches so building rows is not timed """
+    rng = np.random.default_rng(seed)
+    started_at = datetime.datetime(2024, 1, 1)
+    rows = []
+    for message_id in range(fetch_size * distinct_batches):
+        user_id = int(rng.integers(1, 500))
+        content = " ".join(SENTENCES[i] for i in rng.integers(0, len(SENTENCES), size=int(rng.integers(1, 6))))
+        rows.append((
+            message_id + 1, user_id, f"auditor{user_id}", f"run-{message_id // 20}", "document",
+            message_id % 20 + 1, "user" if message_id % 2 == 0 else "assistant", content,
+            started_at + datetime.timedelta(seconds=message_id * 7),
+        ))
+    return [rows[i:i + fetch_size] for i in range(0, len(rows), fetch_size)]
+
+
+def message_batches(batches, messages):
+    remaining = messages
+    while remaining > 0:
+        for batch in batches:
+            if remaining <= 0:
+                break
+            yield batch[:remaining]
+            remaining -= len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--fetch-size", type=int, default=EXPORT_FETCH_SIZE)
+    parser.add_argument("--formats", nargs="+", choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS))
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    batches = build_batches(args.fetch_size, args.seed)
+    print(f"{args.messages} messages in batches of {args.fetch_size}")
+    print(f"{'format':8} {'messages/s':>11} {'size (MB)':>10} {'peak memory (MB)':>17}")
+    with tempfile.TemporaryDirectory() as directory:
+        for export_format in args.formats:
+            path = os.path.join(directory, f"export.{export_format}")
+            started = time.perf_counter()
+            with open(path, "wb") as out:
+                written = write_messages(message_batches(batches, args.messages), out, export_format)
+            seconds = time.perf_counter() - started
+            # tracemalloc slows allocations down several times, so memory is measured in a second, untimed pass
+            tracemalloc.start()
+            with open(path, "wb") as out:
+                write_messages(message_batches(batches, args.messages), out, export_format)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert written == args.messages
+            print(f"{export_format:8} {written / seconds:11.0f} {os.path.getsize(path) / 1024 / 1024:10.1f} "
+                  f"{peak / 1024 / 1024:17.1f}")
+
+
+if __name__ == "__main__":
+    main()
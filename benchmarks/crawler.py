@@ -0,0 +1,122 @@
+""" Crawler benchmark against a local fixture site: throughput, dedupe and conditional re-fetch.
+
+Starts an HTTP server on 127.0.0.1 serving a generated site whose pages link to each other (with
+duplicate spellings of the same URLs) and answer If-None-Match / If-Modified-Since with 304. The site
+is crawled three times: cold, unchanged, and after editing some pages. Needs no database.
+
+    python benchmarks/crawler.py
+    python benchmarks/crawler.py --pages 500 --latency-ms 50 --max-per-host 8
+"""
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_crawler import AsyncWebsiteReader, CrawlStateStore  # noqa: E402
+
+class FixtureSite:
+    """ Pages /page/0 .. /page/N-1, each linking to the next few pages """
+
+    def __init__(self, pages, links_per_page):
+        self.pages = pages
+        self.links_per_page = links_per_page
+        self.revisions = [0] * pages
+        self.modified = [time.time()] * pages
+        self.requests = 0
+        self.not_modified = 0
+        self.lock = threading.Lock()
+
+    def body(self, number):
+        links = []
+        for offset in range(1, self.links_per_page + 1):
+            target = (number + offset) % self.pages
+            # Same targets spelled differently, to exercise URL normalization
+            links.append(f'<a href="/page/{target}">next</a>')
+            links.append(f'<a href="/page/./{target}?utm_source=bench#top">again</a>')
+        text = f"Peraturan nomor {number} revisi {self.revisions[number]}. " * 50
+        return f"<html><body><article>{text}</article>{''.join(links)}</body></html>".encode()
+
+    def edit(self, count):
+        for number in range(count):
+            self.revisions[number] += 1
+            self.modified[number] = time.time() + 1
+
+def make_handler(site, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with site.lock:
+                site.requests += 1
+            time.sleep(latency)
+            try:
+                number = int(self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1])
+                assert 0 <= number < site.pages
+            except (ValueError, AssertionError):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = site.body(number)
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                with site.lock:
+                    site.not_modified += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", formatdate(site.modified[number], usegmt=True))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--links-per-page", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=20, help="server-side delay per request")
+    parser.add_argument("--edit", type=int, default=10, help="pages changed before the third crawl")
+    parser.add_argument("--max-connections", type=int, default=20)
+    parser.add_argument("--max-per-host", type=int, default=8)
+    args = parser.parse_args()
+
+    site = FixtureSite(args.pages, args.links_per_page)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(site, args.latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    start_url = f"http://127.0.0.1:{server.server_port}/page/0"
+
+    reader = AsyncWebsiteReader(
+        max_depth=args.pages, max_links=args.pages, max_connections=args.max_connections,
+        max_per_host=args.max_per_host, state_store=CrawlStateStore(),
+    )
+    print(f"{'crawl':12} {'pages/s':>9} {'requests':>9} {'changed':>8} {'unchanged':>10} {'304':>5} {'errors':>7}")
+    for label in ("cold", "unchanged", "edited"):
+        if label == "edited":
+            site.edit(args.edit)
+        requests_before, not_modified_before = site.requests, site.not_modified
+        changed = reader.crawl(start_url)
+        reader.save_states()
+        stats = reader.last_stats
+        assert len(changed) == stats["changed"]
+        print(f"{label:12} {stats['fetched'] / stats['seconds']:9.1f} {site.requests - requests_before:9} "
+              f"{stats['changed']:8} {stats['unchanged']:10} {site.not_modified - not_modified_before:5} {stats['errors']:7}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+""" Hybrid retrieval benchmark: hit rate and latency of vector-only vs. full-text + vector (RRF) search.
+
+Loads a fixture corpus into the scratch collection ai.hybrid_bench: chunks about a handful of audit topics,
+each citing its own regulation number and account code, spread over --files source files and a year of upload
+dates. Embeddings come from a local hashing embedder that, like real embedding models, barely distinguishes
+numbers, so no API key is needed. Runs three query sets through ManagedPgVector.search in both modes:
+
+    exact     "peraturan PMK-..." / "akun 5.x.xx.xxxx"; hit@5 = the citing chunk is returned
+    topical   a paraphrase of a topic; precision@5 = share of results about that topic
+    filtered  exact queries restricted to the chunk's source file, or to its upload month
+
+Needs the database with pgvector.
+
+    python benchmarks/hybrid.py --rows 20000
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import percentile  # noqa: E402
+from phi.document import Document  # noqa: E402
+from phi.embedder.base import Embedder  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from db_config import get_engine  # noqa: E402
+from ingestion import bulk_upsert  # noqa: E402
+from vector_store import ManagedPgVector, get_index_config  # noqa: E402
+
+TOP_K = 5
+LOAD_BATCH = 1000
+TOPICS = [
+    ("belanja modal", "pengadaan aset tetap gedung peralatan mesin kapitalisasi belanja modal"),
+    ("persediaan", "persediaan barang habis pakai gudang stok opname pencatatan persediaan"),
+    ("piutang", "piutang pajak penyisihan piutang tidak tertagih umur piutang penagihan"),
+    ("kas", "kas bendahara pengeluaran setoran sisa uang persediaan rekening kas"),
+    ("pendapatan", "pendapatan negara bukan pajak penerimaan setoran retribusi tarif layanan"),
+    ("hibah", "hibah langsung uang barang pengesahan hibah pencatatan penerimaan hibah"),
+    ("utang", "utang jangka pendek belanja yang masih harus dibayar kewajiban pihak ketiga"),
+    ("perjalanan dinas", "perjalanan dinas uang harian transport penginapan pertanggungjawaban biaya"),
+]
+PARAPHRASES = {
+    "belanja modal": "bagaimana mencatat pembelian gedung dan peralatan sebagai aset",
+    "persediaan": "cara melakukan stok opname barang di gudang",
+    "piutang": "penyisihan atas tagihan pajak yang sulit ditagih",
+    "kas": "setoran sisa uang bendahara ke rekening kas",
+    "pendapatan": "penerimaan negara dari tarif layanan dan retribusi",
+    "hibah": "pengesahan hibah berupa uang atau barang",
+    "utang": "kewajiban kepada pihak ketiga yang belum dibayar",
+    "perjalanan dinas": "pertanggungjawaban uang harian dan biaya penginapan",
+}
+
+class HashingEmbedder(Embedder):
+    """ Bag of alphabetic words hashed into `dimensions` buckets; numbers and codes are ignored """
+
+    dimensions: int = 256
+
+    def get_embedding(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions)
+        for word in re.findall(r"[a-z]{3,}", text.lower()):
+            digest = hashlib.md5(word.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimensions] += 1 if digest[4] & 1 else -1
+        norm = np.linalg.norm(vector)
+        return list(vector / norm) if norm else list(vector)
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[dict]]:
+        return self.get_embedding(text), None
+
+def fixture(rows, files, rng):
+    """ (document, topic, regulation, account code) per chunk """
+    corpus = []
+    for i in range(rows):
+        topic, words = TOPICS[i % len(TOPICS)]
+        words = words.split()
+        sentence = " ".join(rng.choice(words, size=len(words), replace=False))
+        regulation = f"PMK-{100 + i}/PMK.05/{2010 + i % 14}"
+        code = f"5.{1 + i % 3}.{i % 100:02d}.{i:05d}"
+        document = Document(
+            id=f"doc_{i}",
+            name=f"laporan_{i % files}.pdf",
+            meta_data={"page": i // files, "topic": topic},
+            content=f"{sentence.capitalize()}. Sesuai {regulation}, transaksi dicatat pada akun {code}.",
+        )
+        corpus.append((document, topic, regulation, code))
+    return corpus
+
+def load(vector_db, corpus):
+    vector_db.delete()
+    vector_db.create()
+    for start in range(0, len(corpus), LOAD_BATCH):
+        documents = [document for document, _, _, _ in corpus[start:start + LOAD_BATCH]]
+        for document in documents:
+            document.embedding = vector_db.embedder.get_embedding(document.content)
+        bulk_upsert(vector_db, documents)
+    with vector_db.Session() as sess, sess.begin():
+        # Upload dates spread over the past year
+        sess.execute(text(f"UPDATE {vector_db.qualified_table} SET created_at = now() - (abs(hashtext(id)) % 365) * interval '1 day'"))
+        sess.execute(text(f"ANALYZE {vector_db.qualified_table}"))
+        uploaded = dict(sess.execute(text(f"SELECT id, created_at FROM {vector_db.qualified_table}")).fetchall())
+    vector_db.optimize()
+    return uploaded
+
+def run(vector_db, queries):
+    """ p50 / p95 latency in ms and the mean score of (query, filters, score function) triples """
+    latencies, scores = [], []
+    for query, filters, score in queries:
+        started = time.perf_counter()
+        documents = vector_db.search(query, TOP_K, filters)
+        latencies.append((time.perf_counter() - started) * 1000)
+        scores.append(score(documents))
+    return percentile(latencies, 0.5), percentile(latencies, 0.95), np.mean(scores)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--drop", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vector_db = ManagedPgVector(
+        collection="hybrid_bench", db_engine=get_engine(), embedder=HashingEmbedder(), index=get_index_config("hnsw")
+    )
+    corpus = fixture(args.rows, args.files, rng)
+    started = time.perf_counter()
+    uploaded = load(vector_db, corpus)
+    print(f"{args.rows} chunks in {args.files} files (loaded in {time.perf_counter() - started:.1f}s)")
+
+    sample = [corpus[i] for i in rng.choice(len(corpus), size=args.queries, replace=False)]
+
+    def hit(document_id):
+        return lambda documents: float(any(document.id == document_id for document in documents))
+
+    def on_topic(topic):
+        return lambda documents: np.mean([document.meta_data["topic"] == topic for document in documents]) if documents else 0.0
+
+    def month_of(document_id):
+        day = uploaded[document_id].date().replace(day=1)
+        next_month = day.replace(year=day.year + day.month // 12, month=day.month % 12 + 1)
+        return {"uploaded_after": day.isoformat(), "uploaded_before": next_month.isoformat()}
+
+    query_sets = {
+        "exact": [
+            (f"peraturan {regulation}" if n % 2 else f"akun {code}", None, hit(document.id))
+            for n, (document, _, regulation, code) in enumerate(sample)
+        ],
+        "topical": [(PARAPHRASES[topic], None, on_topic(topic)) for _, topic, _, _ in sample],
+        "filtered (file)": [
+            (f"akun {code}", {"name": document.name}, hit(document.id)) for document, _, _, code in sample
+        ],
+        "filtered (month)": [
+            (f"peraturan {regulation}", month_of(document.id), hit(document.id)) for document, _, regulation, _ in sample
+        ],
+    }
+    print(f"{'queries':18} {'retrieval':9} {'score':>7} {'p50 (ms)':>8} {'p95 (ms)':>8}")
+    for label, queries in query_sets.items():
+        for retrieval in ("vector", "hybrid"):
+            vector_db.retrieval = retrieval
+            p50, p95, score = run(vector_db, queries)
+            print(f"{label:18} {retrieval:9} {score:7.3f} {p50:8.2f} {p95:8.2f}")
+
+    if args.drop:
+        vector_db.delete()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+""" Local OpenAI-compatible mock server for the client benchmarks.
+
+Serves POST /v1/chat/completions (plain and `stream: true` server-sent events) and POST /v1/embeddings with
+configurable latency, over HTTP/1.1 keep-alive. Answers are canned. A request with `functions` and no function
+result yet is answered with a call of the first function with a fixed SQL query (server.function_query); one
+with `tools` and no tool result yet with a call of search_knowledge_base (or the first tool).
+
+    python benchmarks/mock_openai.py --port 8900 --first-token-ms 200 --tokens-per-second 80
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ("Berdasarkan hasil query, terdapat 42 transaksi pada akun 5.1.02.01 selama periode yang diminta. "
+          "Nilai terbesar berasal dari belanja modal peralatan, sesuai PMK-190/PMK.05/2012. ") * 3
+FUNCTION_QUERY = "SELECT count(*) FROM public.transaksi"
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockOpenAI/1.0"
+    # Send headers and body in one segment and without Nagle delays, like a real API front end
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.requests += 1
+        if self.path.endswith("/embeddings"):
+            return self._embeddings(request)
+        if not self.path.endswith("/chat/completions"):
+            return self._send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+        time.sleep(self.server.first_token_seconds)
+
+        messages = request.get("messages") or [{}]
+        roles = {message.get("role") for message in messages}
+        function_call = tool_call = None
+        if request.get("functions") and "function" not in roles:
+            function_call = {"name": request["functions"][0]["name"],
+                             "arguments": json.dumps({"query": self.server.function_query})}
+        elif request.get("tools") and "tool" not in roles:
+            names = [tool["function"]["name"] for tool in request["tools"]]
+            name = "search_knowledge_base" if "search_knowledge_base" in names else names[0]
+            question = next((message.get("content") for message in reversed(messages) if message.get("role") == "user"), "")
+            tool_call = {"id": "call_mock", "type": "function",
+                         "function": {"name": name, "arguments": json.dumps({"query": str(question)[:200]})}}
+        model = request.get("model", "gpt-4")
+        if not request.get("stream"):
+            time.sleep(len(ANSWER.split()) / self.server.tokens_per_second if not (function_call or tool_call) else 0)
+            message = {"role": "assistant", "content": None if function_call or tool_call else ANSWER}
+            finish_reason = "stop"
+            if function_call:
+                message["function_call"] = function_call
+                finish_reason = "function_call"
+            elif tool_call:
+                message["tool_calls"] = [tool_call]
+                finish_reason = "tool_calls"
+            return self._send_json({
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": len(ANSWER.split()), "total_tokens": 100 + len(ANSWER.split())},
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if function_call:
+            deltas = [{"role": "assistant", "content": None, "function_call": {"name": function_call["name"], "arguments": ""}},
+                      {"function_call": {"arguments": function_call["arguments"]}}]
+        elif tool_call:
+            deltas = [{"role": "assistant", "content": None,
+                       "tool_calls": [dict(tool_call, index=0, function={"name": tool_call["function"]["name"], "arguments": ""})]},
+                      {"tool_calls": [{"index": 0, "function": {"arguments": tool_call["function"]["arguments"]}}]}]
+        else:
+            deltas = [{"role": "assistant", "content": ""}] + [{"content": f"{word} "} for word in ANSWER.split()]
+        for delta in deltas:
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            if "content" in delta and delta["content"]:
+                time.sleep(1 / self.server.tokens_per_second)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            completion_tokens = sum(1 for delta in deltas if delta.get("content"))
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model, "choices": [],
+                     "usage": {"prompt_tokens": 100, "completion_tokens": completion_tokens, "total_tokens": 100 + completion_tokens}}
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._send_chunk(b"")
+
+    def _embeddings(self, request):
+        inputs = request.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        dimensions = request.get("dimensions") or 1536
+        data = []
+        for i, text in enumerate(inputs):
+            seed = hashlib.sha256(str(text).encode()).digest()
+            vector = [(seed[j % len(seed)] - 127.5) / 127.5 for j in range(dimensions)]
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        time.sleep(self.server.first_token_seconds / 4)
+        self._send_json({"object": "list", "data": data, "model": request.get("model"),
+                         "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}})
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Concurrent benchmark clients connect at once; the default backlog of 5 drops their SYNs
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients closing keep-alive connections are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def start_mock_server(port=0, first_token_ms=200, tokens_per_second=80, function_query=FUNCTION_QUERY):
+    """ Start the mock server in a daemon thread; returns the server, whose base URL is server.base_url """
+    server = MockOpenAIServer(("127.0.0.1", port), MockOpenAIHandler)
+    server.first_token_seconds = first_token_ms / 1000
+    server.tokens_per_second = tokens_per_second
+    server.function_query = function_query
+    server.requests = 0
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    args = parser.parse_args()
+    server = start_mock_server(args.port, args.first_token_ms, args.tokens_per_second)
+    print(f"Mock OpenAI API on {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
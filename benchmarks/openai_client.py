@@ -0,0 +1,92 @@
+""" db_chat OpenAI client benchmark against the local mock server (benchmarks/mock_openai.py).
+
+Compares, for the same completions:
+    requests.post per call     a new connection per request, as send_api_request_to_openai_api did
+    pooled session             db_chat.utils.openai_client keep-alive session
+    streamed                   time to first token vs. full completion time
+    async                      --calls completions at once through the per-loop AsyncClient
+
+The mock serves plain HTTP, so the per-call cost shown is TCP setup only; against api.openai.com each new
+connection also pays a TLS handshake. No OpenAI key needed.
+
+    python benchmarks/openai_client.py --calls 50 --first-token-ms 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_openai import start_mock_server  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Berapa jumlah transaksi akun 5.1.02.01?"}]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def report(label, latencies, extra=""):
+    print(f"{label:26} {percentile(latencies, 0.5):9.1f} {percentile(latencies, 0.95):9.1f} {extra}")
+
+def timed(call, calls):
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--first-token-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-second", type=float, default=400)
+    args = parser.parse_args()
+
+    server = start_mock_server(first_token_ms=args.first_token_ms, tokens_per_second=args.tokens_per_second)
+    # The client reads its endpoint when imported
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    from db_chat.utils import openai_client
+
+    url = f"{server.base_url}/chat/completions"
+    payload = openai_client.chat_completion_payload(MESSAGES)
+    headers = {"Authorization": "Bearer mock"}
+    print(f"mock server {server.base_url}, first token after {args.first_token_ms:g} ms, {args.tokens_per_second:g} tokens/s")
+    print(f"{'client':26} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+
+    report("requests.post per call", timed(lambda: requests.post(url, json=payload, headers=headers).json(), args.calls))
+    report("pooled session", timed(lambda: openai_client.post_chat_completion(MESSAGES).json(), args.calls))
+
+    def streamed():
+        started = time.perf_counter()
+        first_token = None
+        for _ in openai_client.stream_chat_completion(MESSAGES):
+            if first_token is None:
+                first_token = (time.perf_counter() - started) * 1000
+        return first_token, (time.perf_counter() - started) * 1000
+
+    first_tokens, latencies = zip(*(streamed() for _ in range(args.calls)))
+    report("streamed (first token)", first_tokens)
+    report("streamed (complete)", latencies)
+
+    async def concurrent():
+        client = openai_client.get_async_client()
+        started = time.perf_counter()
+        await asyncio.gather(*(openai_client.acreate_chat_completion(MESSAGES, client=client) for _ in range(args.calls)))
+        elapsed = time.perf_counter() - started
+        await client.aclose()
+        return elapsed
+
+    elapsed = asyncio.run(concurrent())
+    print(f"async, {args.calls} calls at once: {elapsed * 1000:.0f} ms total "
+          f"(pool of {openai_client.OPENAI_POOL_SIZE} connections)")
+    print(f"{server.requests} requests served")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+""" Cold-start benchmark: import time per module and first render time of the Streamlit app.
+
+Each import is measured in a fresh interpreter so modules do not share warm caches.
+Run from the repository root:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --render-as user --user-id 1   # needs the database
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "db_config",
+    "user_auth",
+    "chat_history",
+    "user_page",
+    "admin_page",
+    "assistant",
+    "db_chat.utils.database_functions",
+    "db_chat.utils.function_calling_spec",
+    "db_chat.utils.chat_functions",
+    "db_chat.utils.api_functions",
+]
+
+IMPORT_SNIPPET = """
+import sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(elapsed)
+"""
+
+RENDER_SNIPPET = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+started = time.perf_counter()
+app = AppTest.from_file("app.py", default_timeout=120)
+for key, value in json.loads(sys.argv[1]).items():
+    app.session_state[key] = value
+app.run()
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "exceptions": [str(e.value) for e in app.exception]}))
+"""
+
+def measure_import(module, repeat):
+    """ Returns the best-of-`repeat` cold import time of `module` in seconds, or the error output """
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+            cwd=ROOT, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(timings), None
+
+def measure_first_render(session_state):
+    result = subprocess.run(
+        [sys.executable, "-c", RENDER_SNIPPET, json.dumps(session_state)],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return json.loads(result.stdout.strip().splitlines()[-1]), None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="cold imports per module; the best run is reported")
+    parser.add_argument("--render-as", choices=["anonymous", "user", "admin"], default="anonymous")
+    parser.add_argument("--user-id", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'module':45} {'import (ms)':>12}")
+    for module in MODULES:
+        seconds, error = measure_import(module, args.repeat)
+        if error:
+            print(f"{module:45} {'error':>12}  {error}")
+        else:
+            print(f"{module:45} {seconds * 1000:12.1f}")
+
+    session_state = {}
+    if args.render_as != "anonymous":
+        session_state = {"logged_in": True, "role": args.render_as, "user_id": args.user_id, "username": args.render_as}
+    render, error = measure_first_render(session_state)
+    if error:
+        print(f"\nfirst render of app.py as {args.render_as}: error  {error}")
+    else:
+        print(f"\nfirst render of app.py as {args.render_as}: {render['seconds'] * 1000:.1f} ms")
+        for exception in render["exceptions"]:
+            print(f"  app raised: {exception}")
+
+if __name__ == "__main__":
+    main()
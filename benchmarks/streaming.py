@@ -0,0 +1,93 @@
+""" Streaming render benchmark: messages, bytes and render time per answer for each way of showing tokens.
+
+Replays a synthetic answer as a token stream at --tokens-per-second and renders it the way the chat pages did
+before (st.write per token: a new element each time; a placeholder updated per token) and through
+streaming.render_stream. Every update is serialized as the ForwardMsg Streamlit would send over the websocket,
+so bytes are what the browser receives; render time is the server-side cost of producing those messages.
+No Streamlit server or OpenAI key needed.
+
+    python benchmarks/streaming.py --tokens 800 --tokens-per-second 60 --fps 10
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg  # noqa: E402
+
+from streaming import StreamStats, render_stream  # noqa: E402
+
+WORDS = ("auditor", "transaksi", "akun", "peraturan", "laporan", "keuangan", "pemeriksaan", "risiko", "aset", "kas",
+         "**temuan**", "1.", "2.", "-", "Pasal", "5.1.02.01", "PMK-190/PMK.05/2012", "\n\n", "sesuai", "dengan")
+
+class ForwardMsgSink:
+    """ Stand-in for st.empty() / st.write that serializes each update like Streamlit does """
+
+    def __init__(self, new_element_per_update=False):
+        self.new_element_per_update = new_element_per_update
+        self.messages = 0
+        self.bytes = 0
+        self.elements = 0
+
+    def markdown(self, body):
+        if self.new_element_per_update or self.elements == 0:
+            self.elements += 1
+        message = ForwardMsg()
+        message.metadata.delta_path[:] = [0, 3, self.elements - 1]
+        message.delta.new_element.markdown.body = body
+        self.bytes += len(message.SerializeToString())
+        self.messages += 1
+
+def token_stream(tokens, rate):
+    interval = 1.0 / rate if rate else 0.0
+    for token in tokens:
+        if interval:
+            time.sleep(interval)
+        yield token
+
+def per_token(deltas, sink):
+    """ What the chat pages did: re-render the whole answer after every token """
+    stats = StreamStats()
+    started = time.perf_counter()
+    response = ""
+    for delta in deltas:
+        response += delta
+        render_started = time.perf_counter()
+        sink.markdown(response)
+        stats.render_seconds += time.perf_counter() - render_started
+        stats.renders += 1
+        stats.deltas += 1
+    stats.total_seconds = time.perf_counter() - started
+    return response, stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=800)
+    parser.add_argument("--tokens-per-second", type=float, default=60, help="0 replays the stream without delays")
+    parser.add_argument("--fps", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    tokens = [word if word.startswith("\n") else " " + word for word in rng.choice(WORDS, size=args.tokens)]
+
+    strategies = [
+        ("st.write per token", lambda deltas, sink: per_token(deltas, sink), True),
+        ("placeholder per token", lambda deltas, sink: per_token(deltas, sink), False),
+        (f"render_stream {args.fps:g} fps", lambda deltas, sink: render_stream(deltas, sink, fps=args.fps), False),
+    ]
+    print(f"{args.tokens} tokens at {args.tokens_per_second:g} tokens/s")
+    print(f"{'strategy':24} {'elements':>8} {'messages':>8} {'sent (KB)':>10} {'render (ms)':>11} {'total (s)':>9}")
+    for label, strategy, new_element_per_update in strategies:
+        sink = ForwardMsgSink(new_element_per_update)
+        response, stats = strategy(token_stream(tokens, args.tokens_per_second), sink)
+        assert response == "".join(tokens)
+        print(f"{label:24} {sink.elements:8} {sink.messages:8} {sink.bytes / 1024:10.1f} "
+              f"{stats.render_seconds * 1000:11.1f} {stats.total_seconds:9.2f}")
+
+if __name__ == "__main__":
+    main()
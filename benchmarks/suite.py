@@ -0,0 +1,342 @@
+""" End-to-end benchmark suite: latency percentiles and throughput of the chat paths, checked against a baseline.
+
+Runs the app's own code against the local mock OpenAI server (benchmarks/mock_openai.py: deterministic
+embeddings and canned completions with --first-token-ms / --tokens-per-second latency) and the configured
+Postgres with pgvector, so no OpenAI key is needed and every run sees the same answers:
+
+    history_save            chat_history.append_messages of a user/assistant pair
+    history_load            chat_history.load_message_page of a --history message conversation
+    ask_postgres_database   an aggregate over the benchmark.transaksi fixture, on a pooled query connection
+    knowledge_search        ManagedPgVector.search of the "benchmark" tenant's fixture collection
+    get_auto_rag_assistant  building the assistant of a run
+    assistant_turn          one answer of the assistant: a knowledge-base tool call, then the final answer
+    run_chat_sequence       one database chat turn: function call, SQL, then the explanation
+
+Fixtures (the benchmark user, its conversation, the transaksi table and the vector collection) are created on
+the first run and reused while their sizes match. The chat functions need the same DB_* variables as the app:
+app tables live in the database of db_config.py, the transaksi fixture in the one db_chat queries. The fixtures
+are written into those databases, so --database must name them; run the suite against a scratch database,
+never production. A "benchmark" user the suite did not create is never taken over.
+
+Operations run --iterations times on --concurrency threads. run_chat_sequence keeps its state in
+st.session_state, a single shared dict outside `streamlit run`, so it always runs on one thread.
+
+--save-baseline writes the results to --baseline; later runs exit with status 1 if an operation's p50 or p95
+is more than --tolerance (plus --slack-ms, for operations of a few milliseconds) above it. Baselines are only
+comparable on the same machine, database and settings.
+
+    python benchmarks/suite.py --database Testing --save-baseline
+    python benchmarks/suite.py --database Testing --iterations 50 --concurrency 4
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import percentile  # noqa: E402
+from mock_openai import start_mock_server  # noqa: E402
+
+BENCHMARK_USER = "benchmark"
+# Marks the benchmark user as created by the suite
+BENCHMARK_EMAIL = "benchmark@benchmark.invalid"
+BENCHMARK_TENANT = "benchmark"
+BENCHMARK_SCHEMA = "benchmark"
+HISTORY_RUN_ID = "benchmark-history"
+FUNCTION_QUERY = f"SELECT akun, count(*), sum(nilai) FROM {BENCHMARK_SCHEMA}.transaksi GROUP BY akun ORDER BY akun"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+OPERATIONS = ("history_save", "history_load", "ask_postgres_database", "knowledge_search",
+              "get_auto_rag_assistant", "assistant_turn", "run_chat_sequence")
+QUESTIONS = (
+    "Berapa jumlah transaksi akun 5.1.02.01 selama periode ini?",
+    "Bagaimana mencatat pembelian gedung dan peralatan sebagai aset?",
+    "Apa dasar hukum penyisihan piutang tidak tertagih?",
+    "Tampilkan temuan pemeriksaan dengan risiko tinggi.",
+)
+TOPICS = (
+    "belanja modal pengadaan aset tetap gedung peralatan mesin kapitalisasi",
+    "persediaan barang habis pakai gudang stok opname pencatatan",
+    "piutang pajak penyisihan piutang tidak tertagih umur piutang",
+    "kas bendahara pengeluaran setoran sisa uang persediaan rekening",
+    "pendapatan negara bukan pajak penerimaan setoran retribusi tarif",
+)
+
+
+def question(i):
+    # The iteration number keeps embeddings from being served by the embedding cache every time
+    return f"{QUESTIONS[i % len(QUESTIONS)]} ({i})"
+
+
+def prepare_user(history):
+    """ The benchmark user, entitled to the benchmark tenant, with a conversation of `history` messages """
+    from chat_history import append_messages
+    from db_config import db_connection, init_db
+    from tenants import set_user_tenants
+
+    init_db()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        # Nobody logs in as this user; a cheap hash keeps fixture setup fast
+        cursor.execute(
+            """
+            INSERT INTO users (username, password_hash, email) VALUES (%s, %s, %s)
+            ON CONFLICT (username) DO NOTHING
+            """,
+            (BENCHMARK_USER, bcrypt.hashpw(os.urandom(16), bcrypt.gensalt(rounds=4)).decode(), BENCHMARK_EMAIL)
+        )
+        cursor.execute("SELECT id, email FROM users WHERE username = %s", (BENCHMARK_USER,))
+        user_id, email = cursor.fetchone()
+        if email != BENCHMARK_EMAIL:
+            conn.rollback()
+            sys.exit(f"User {BENCHMARK_USER!r} already exists and was not created by the suite; "
+                     f"run the suite against a scratch database")
+        cursor.execute(
+            "SELECT count(*) FROM user_chat_messages WHERE user_id = %s AND run_id = %s AND chat_type = 'document'",
+            (user_id, HISTORY_RUN_ID)
+        )
+        stored = cursor.fetchone()[0]
+        if stored != history:
+            cursor.execute("DELETE FROM user_chat_messages WHERE user_id = %s AND run_id = %s", (user_id, HISTORY_RUN_ID))
+        conn.commit()
+        cursor.close()
+    set_user_tenants(user_id, [BENCHMARK_TENANT])
+    if stored != history:
+        messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{QUESTIONS[i % len(QUESTIONS)]} {TOPICS[i % len(TOPICS)]}"}
+                    for i in range(history)]
+        for start in range(0, history, 1000):
+            append_messages(user_id, HISTORY_RUN_ID, messages[start:start + 1000])
+    return user_id
+
+
+def prepare_transaksi(rows):
+    """ benchmark.transaksi with `rows` rows, in the database db_chat queries """
+    from db_chat.utils.database_functions import query_connection
+
+    with query_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {BENCHMARK_SCHEMA}")
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {BENCHMARK_SCHEMA}.transaksi (
+            id SERIAL PRIMARY KEY,
+            akun TEXT NOT NULL,
+            nilai NUMERIC(18, 2) NOT NULL,
+            tanggal DATE NOT NULL
+        )
+        """)
+        cursor.execute(f"SELECT count(*) FROM {BENCHMARK_SCHEMA}.transaksi")
+        if cursor.fetchone()[0] != rows:
+            cursor.execute(f"TRUNCATE {BENCHMARK_SCHEMA}.transaksi")
+            cursor.execute(
+                f"""
+                INSERT INTO {BENCHMARK_SCHEMA}.transaksi (akun, nilai, tanggal)
+                SELECT '5.1.02.' || lpad((i % 40)::text, 2, '0'), (i * 7919 % 100000) / 100.0,
+                       DATE '2024-01-01' + (i % 366)
+                FROM generate_series(1, %s) AS i
+                """,
+                (rows,)
+            )
+            cursor.execute(f"ANALYZE {BENCHMARK_SCHEMA}.transaksi")
+        conn.commit()
+        cursor.close()
+
+
+def prepare_documents(documents):
+    """ The benchmark tenant's collection with `documents` chunks, embedded by the mock server """
+    from phi.document import Document
+
+    from assistant import get_vector_db
+    from ingestion import bulk_upsert
+
+    vector_db = get_vector_db(BENCHMARK_TENANT)
+    vector_db.create()
+    if vector_db.get_count() == documents:
+        return vector_db
+    vector_db.delete()
+    vector_db.create()
+    for start in range(0, documents, 500):
+        batch = [Document(id=f"benchmark-{i}", name=f"fixture_{i % 20}.pdf",
+                          content=f"{TOPICS[i % len(TOPICS)]}. Akun 5.1.02.{i % 40:02d}, halaman {i}.")
+                 for i in range(start, min(start + 500, documents))]
+        embeddings = vector_db.embedder.get_embeddings([document.content for document in batch])
+        for document, embedding in zip(batch, embeddings):
+            document.embedding = embedding
+        bulk_upsert(vector_db, batch)
+    vector_db.optimize()
+    return vector_db
+
+
+def build_operations(user_id, vector_db, history):
+    """ name -> (call taking the iteration number, whether it must run on one thread) """
+    import streamlit as st
+
+    from assistant import get_auto_rag_assistant
+    from chat_history import append_messages, load_message_page
+    from db_chat.utils.chat_functions import run_chat_sequence
+    from db_chat.utils.database_functions import ask_postgres_database, query_connection
+    from db_chat.utils.function_calling_spec import get_functions
+
+    functions = get_functions()
+
+    def history_save(i):
+        append_messages(user_id, f"benchmark-save-{i % 100}",
+                        [{"role": "user", "content": question(i)}, {"role": "assistant", "content": TOPICS[i % len(TOPICS)]}])
+
+    def history_load(i):
+        messages, _, _ = load_message_page(user_id, HISTORY_RUN_ID, limit=min(history, 30))
+        assert len(messages) == min(history, 30)
+
+    def ask_postgres(i):
+        with query_connection() as connection:
+            result = ask_postgres_database(connection, FUNCTION_QUERY)
+        assert not result.startswith("Query failed"), result
+
+    def knowledge_search(i):
+        assert vector_db.search(question(i), limit=5)
+
+    def build_assistant(i):
+        get_auto_rag_assistant(llm_model="gpt-4-turbo", user_id=str(user_id), run_id=f"benchmark-build-{i}", debug_mode=False)
+
+    def assistant_turn(i):
+        assistant = get_auto_rag_assistant(llm_model="gpt-4-turbo", user_id=str(user_id),
+                                           run_id=f"benchmark-turn-{i}", debug_mode=False)
+        assert assistant.run(question(i), stream=False)
+
+    def chat_sequence(i):
+        # A fresh conversation per turn, so the payload does not grow with the iteration count
+        st.session_state.pop("live_chat_history", None)
+        messages = [{"role": "user", "content": question(i)}]
+        answer = run_chat_sequence(messages, functions, ["transaksi"], BENCHMARK_SCHEMA)
+        assert answer["content"], answer
+
+    return {
+        "history_save": (history_save, False),
+        "history_load": (history_load, False),
+        "ask_postgres_database": (ask_postgres, False),
+        "knowledge_search": (knowledge_search, False),
+        "get_auto_rag_assistant": (build_assistant, False),
+        "assistant_turn": (assistant_turn, False),
+        "run_chat_sequence": (chat_sequence, True),
+    }
+
+
+def measure(call, iterations, concurrency, warmup):
+    """ Latencies in ms of `iterations` calls on `concurrency` threads, and the calls per second overall """
+    for i in range(warmup):
+        call(-1 - i)
+
+    def timed_call(i):
+        started = time.perf_counter()
+        call(i)
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed_call, range(iterations)))
+    return latencies, iterations / (time.perf_counter() - started)
+
+
+def summarize(latencies, throughput):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.5), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "ops_per_second": round(throughput, 2),
+    }
+
+
+def regressions(results, baseline, tolerance, slack_ms):
+    """ Messages for every operation whose p50 or p95 exceeds its baseline by more than the allowed margin """
+    found = []
+    for name, result in results.items():
+        previous = baseline.get("operations", {}).get(name)
+        if previous is None:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            limit = previous[key] * (1 + tolerance) + slack_ms
+            if result[key] > limit:
+                found.append(f"{name}: {key} {result[key]:.1f} > {limit:.1f} (baseline {previous[key]:.1f})")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--first-token-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-second", type=float, default=1000)
+    parser.add_argument("--history", type=int, default=1000, help="messages in the fixture conversation")
+    parser.add_argument("--rows", type=int, default=100_000, help="rows in the transaksi fixture")
+    parser.add_argument("--documents", type=int, default=2000, help="chunks in the fixture collection")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown of p50 and p95")
+    parser.add_argument("--slack-ms", type=float, default=5, help="allowed absolute slowdown on top of --tolerance")
+    parser.add_argument("--database", required=True,
+                        help="name of the database the fixtures are written to, as a check that it is a scratch one")
+    args = parser.parse_args()
+
+    # Outside `streamlit run` every session state access logs a warning
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    server = start_mock_server(first_token_ms=0, tokens_per_second=args.tokens_per_second, function_query=FUNCTION_QUERY)
+    # Read by the OpenAI clients of the app modules, so it is set before they are imported
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+    from db_chat.utils.config import db_credentials
+    from db_config import DB_NAME
+
+    targets = {DB_NAME, db_credentials["dbname"]}
+    if targets != {args.database}:
+        parser.error(f"the fixtures would be written to {', '.join(sorted(map(str, targets)))}, not --database {args.database}")
+
+    user_id = prepare_user(args.history)
+    prepare_transaksi(args.rows)
+    vector_db = prepare_documents(args.documents)
+    operations = build_operations(user_id, vector_db, args.history)
+    server.first_token_seconds = args.first_token_ms / 1000
+
+    settings = {key: getattr(args, key) for key in ("iterations", "concurrency", "first_token_ms", "tokens_per_second",
+                                                      "history", "rows", "documents")}
+    print(f"{args.iterations} iterations on {args.concurrency} threads, mock first token {args.first_token_ms:g} ms, "
+          f"{args.tokens_per_second:g} tokens/s")
+    print(f"{'operation':24} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'mean (ms)':>9} {'ops/s':>8}")
+    results = {}
+    for name in args.operations:
+        call, serial = operations[name]
+        latencies, throughput = measure(call, args.iterations, 1 if serial else args.concurrency, args.warmup)
+        result = results[name] = summarize(latencies, throughput)
+        print(f"{name:24} {result['p50_ms']:9.1f} {result['p95_ms']:9.1f} {result['p99_ms']:9.1f} "
+              f"{result['mean_ms']:9.1f} {result['ops_per_second']:8.1f}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"settings": settings, "operations": results}, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != settings:
+        print(f"Warning: baseline recorded with different settings: {baseline.get('settings')}")
+    found = regressions(results, baseline, args.tolerance, args.slack_ms)
+    for message in found:
+        print(f"REGRESSION {message}")
+    if found:
+        sys.exit(1)
+    print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%} + {args.slack_ms:g} ms)")
+
+
+if __name__ == "__main__":
+    main()
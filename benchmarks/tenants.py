@@ -0,0 +1,108 @@
+""" Tenant partitioning benchmark: search latency of one tenant's user as tenants are added.
+
+For each tenant count, every tenant gets --rows synthetic vectors in its own collection with its own
+HNSW index (how tenants.py / RoutedVectorDb store them). The same rows also go into one shared table,
+searched with a tenant filter, which is how the single auto_rag_documents_openai table would have to
+serve them. Reports p50/p95 latency and the average number of results returned (a filtered HNSW scan
+can return fewer than 5). Needs the database with pgvector.
+
+    python benchmarks/tenants.py --tenants 1 2 4 8 16 --rows 10000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import percentile, synthetic_vectors, vector_literal  # noqa: E402
+from phi.embedder.base import Embedder  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from db_config import get_connection, get_engine  # noqa: E402
+from vector_store import ManagedPgVector, RoutedVectorDb, get_index_config  # noqa: E402
+
+TOP_K = 5
+
+def copy_rows(vector_db, name, vectors, id_prefix):
+    conn = get_connection()
+    cursor = conn.cursor()
+    buffer = io.StringIO("".join(f"{id_prefix}{i}\t{name}\t{vector_literal(vector)}\n" for i, vector in enumerate(vectors)))
+    cursor.copy_expert(f"COPY {vector_db.qualified_table} (id, name, embedding) FROM STDIN", buffer)
+    cursor.execute(f"ANALYZE {vector_db.qualified_table}")
+    conn.commit()
+    conn.close()
+
+def drop_index(vector_db):
+    """ Bulk loads go faster without the index; it is rebuilt after each load """
+    info = vector_db.get_index_info()
+    if info is not None:
+        with vector_db.db_engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX {vector_db._qualify(info['name'])}"))
+
+def measure(search, queries):
+    latencies, returned = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results = search(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+        returned.append(len(results))
+    return percentile(latencies, 0.5), percentile(latencies, 0.95), np.mean(returned)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--rows", type=int, default=10_000, help="vectors per tenant")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--drop", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    embedder = Embedder(dimensions=args.dimensions)
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(50, args.dimensions))
+
+    def collection(name):
+        return ManagedPgVector(collection=name, db_engine=get_engine(), embedder=embedder, index=None)
+
+    shared = collection("tenant_bench_shared")
+    shared.delete()
+    shared.create()
+    shared.index = get_index_config("hnsw")
+    tenant_dbs = []
+    embeddings = [list(map(float, vector)) for vector in synthetic_vectors(rng, centers, args.queries)]
+
+    print(f"{args.rows} vectors per tenant, searching as a user of tenant t0")
+    print(f"{'tenants':>7} {'rows':>9} | {'partitioned p50':>15} {'p95':>7} {'results':>7} | {'shared p50':>10} {'p95':>7} {'results':>7}")
+    for count in sorted(args.tenants):
+        drop_index(shared)
+        while len(tenant_dbs) < count:
+            name = f"t{len(tenant_dbs)}"
+            vectors = synthetic_vectors(rng, centers, args.rows)
+            tenant_db = collection(f"tenant_bench_{name}")
+            tenant_db.delete()
+            tenant_db.create()
+            copy_rows(tenant_db, name, vectors, "")
+            tenant_db.index = get_index_config("hnsw")
+            tenant_db.optimize()
+            tenant_dbs.append(tenant_db)
+            copy_rows(shared, name, vectors, f"{name}_")
+        shared.optimize()
+
+        routed = RoutedVectorDb(tenant_dbs[:1])
+        partitioned = measure(lambda embedding: routed.vector_dbs[0].search_by_embedding(embedding, TOP_K), embeddings)
+        filtered = measure(lambda embedding: shared.search_by_embedding(embedding, TOP_K, filters={"name": "t0"}), embeddings)
+        print(f"{count:7} {count * args.rows:9} | {partitioned[0]:15.2f} {partitioned[1]:7.2f} {partitioned[2]:7.1f} "
+              f"| {filtered[0]:10.2f} {filtered[1]:7.2f} {filtered[2]:7.1f}")
+
+    if args.drop:
+        shared.delete()
+        for tenant_db in tenant_dbs:
+            tenant_db.delete()
+
+if __name__ == "__main__":
+    main()
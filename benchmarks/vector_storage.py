@@ -0,0 +1,106 @@
+""" Vector storage benchmark: table size, index size, search latency and recall@5 per storage mode.
+
+Loads the same synthetic vectors into one scratch table per mode (ai.storage_bench_<mode>_<dims>) through
+ManagedPgVector, builds the configured HNSW index and runs the app's own search SQL. Recall is measured
+against exact float32 neighbours computed with numpy. Needs the database with pgvector >= 0.7.
+
+    python benchmarks/vector_storage.py --rows 100000
+    python benchmarks/vector_storage.py --modes vector:1536 halfvec:1536 binary:1536 vector:512
+
+Synthetic vectors do not concentrate information in their leading dimensions like text-embedding-3
+embeddings do, so recall of shortened modes here is a lower bound.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import percentile, synthetic_vectors, vector_literal  # noqa: E402
+from phi.embedder.base import Embedder  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from db_config import get_connection, get_engine  # noqa: E402
+from vector_store import ManagedPgVector, get_index_config  # noqa: E402
+
+TOP_K = 5
+LOAD_BATCH = 10_000
+
+def shorten(vectors, dimensions):
+    shortened = vectors[:, :dimensions]
+    return shortened / np.linalg.norm(shortened, axis=1, keepdims=True)
+
+def load(vector_db, vectors):
+    vector_db.delete()
+    vector_db.create()
+    conn = get_connection()
+    cursor = conn.cursor()
+    for start in range(0, len(vectors), LOAD_BATCH):
+        batch = vectors[start:start + LOAD_BATCH]
+        buffer = io.StringIO("".join(f"{start + i}\t{start + i}\t{vector_literal(vector)}\n" for i, vector in enumerate(batch)))
+        cursor.copy_expert(f"COPY {vector_db.qualified_table} (id, name, embedding) FROM STDIN", buffer)
+        conn.commit()
+    cursor.execute(f"ANALYZE {vector_db.qualified_table}")
+    conn.commit()
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--modes", nargs="+", default=["vector:1536", "vector:512", "halfvec:1536", "halfvec:512", "binary:1536"],
+                        help="storage:dimensions pairs")
+    parser.add_argument("--rerank-candidates", type=int, default=40)
+    parser.add_argument("--drop", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    full_dimensions = max(int(mode.split(":")[1]) for mode in args.modes)
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(args.clusters, full_dimensions))
+    vectors = synthetic_vectors(rng, centers, args.rows)
+    queries = synthetic_vectors(rng, centers, args.queries)
+    truth = [set(map(str, np.argsort(-(vectors @ query))[:TOP_K])) for query in queries]
+
+    print(f"{args.rows} rows, {args.queries} queries")
+    print(f"{'mode':16} {'table (MB)':>10} {'index (MB)':>10} {'build (s)':>9} {'recall@5':>9} {'p50 (ms)':>8} {'p95 (ms)':>8}")
+    for mode in args.modes:
+        storage, dimensions = mode.split(":")
+        dimensions = int(dimensions)
+        vector_db = ManagedPgVector(
+            collection=f"storage_bench_{storage}_{dimensions}", db_engine=get_engine(),
+            embedder=Embedder(dimensions=dimensions), storage=storage, index=None,
+            rerank_candidates=args.rerank_candidates,
+        )
+        load(vector_db, shorten(vectors, dimensions))
+        vector_db.index = get_index_config("hnsw")
+        started = time.perf_counter()
+        vector_db.optimize()
+        build_seconds = time.perf_counter() - started
+
+        recalls, latencies = [], []
+        with vector_db.Session() as sess:
+            for query, expected in zip(shorten(queries, dimensions), truth):
+                with sess.begin():
+                    for key, value in vector_db.search_settings(TOP_K).items():
+                        sess.execute(text(f"SET LOCAL {key} = {value}"))
+                    started = time.perf_counter()
+                    rows = sess.execute(text(vector_db.search_sql(TOP_K)), {"query": vector_literal(query)}).fetchall()
+                    latencies.append((time.perf_counter() - started) * 1000)
+                recalls.append(len({row.name for row in rows} & expected) / TOP_K)
+            table_bytes = sess.execute(
+                text("SELECT pg_table_size(CAST(:table AS regclass))"), {"table": vector_db.qualified_table}
+            ).scalar()
+        index_bytes = vector_db.get_index_info()["size_bytes"]
+        print(f"{mode:16} {table_bytes / 2**20:10.1f} {index_bytes / 2**20:10.1f} {build_seconds:9.1f} "
+              f"{np.mean(recalls):9.3f} {percentile(latencies, 0.5):8.2f} {percentile(latencies, 0.95):8.2f}")
+        if args.drop:
+            vector_db.delete()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import json
+
+import psycopg2.extras
+from psycopg2 import errors
+
+from db_config import db_connection, ensure_db
+from metrics import timed
+
+# Number of most recent messages loaded for a conversation by default
+CHAT_HISTORY_LIMIT = 200
+
+# Retries when two writers race for the same sequence number
+_APPEND_RETRIES = 3
+
+@timed("history_save")
+def append_messages(user_id, run_id, messages, chat_type="document"):
+    """ Append messages to a conversation, writing one row per message """
+    if not messages:
+        return
+    roles = [message["role"] for message in messages]
+    contents = [message.get("content") for message in messages]
+    for attempt in range(_APPEND_RETRIES):
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    INSERT INTO user_chat_messages (user_id, run_id, chat_type, seq, role, content)
+                    SELECT %s, %s, %s, last.seq + m.ord, m.role, m.content
+                    FROM (
+                        SELECT COALESCE(MAX(seq), 0) AS seq FROM user_chat_messages
+                        WHERE user_id = %s AND run_id = %s AND chat_type = %s
+                    ) AS last,
+                    unnest(%s::text[], %s::text[]) WITH ORDINALITY AS m(role, content, ord)
+                    """,
+                    (user_id, run_id, chat_type, user_id, run_id, chat_type, roles, contents)
+                )
+                conn.commit()
+                cursor.close()
+            return
+        except errors.UniqueViolation:
+            if attempt == _APPEND_RETRIES - 1:
+                raise
+
+@timed("history_load")
+def _select_messages(user_id, run_id, chat_type, limit, before_seq):
+    """ (seq, role, content) rows of the last `limit` messages older than `before_seq`, newest first """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT seq, role, content FROM user_chat_messages
+            WHERE user_id = %s AND run_id = %s AND chat_type = %s
+              AND (%s::int IS NULL OR seq < %s::int)
+            ORDER BY seq DESC
+            LIMIT %s
+            """,
+            (user_id, run_id, chat_type, before_seq, before_seq, limit)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+def load_messages(user_id, run_id, chat_type="document", limit=CHAT_HISTORY_LIMIT, before_seq=None):
+    """ Returns the last `limit` messages of a conversation (optionally older than `before_seq`), oldest first """
+    rows = _select_messages(user_id, run_id, chat_type, limit, before_seq)
+    return [{"role": role, "content": content} for _, role, content in reversed(rows)]
+
+def load_message_page(user_id, run_id, chat_type="document", limit=CHAT_HISTORY_LIMIT, before_seq=None):
+    """ Like load_messages, but returns (messages, seq of the oldest one, whether older messages exist) for paging back """
+    # One extra row tells whether there is another page, without counting the conversation
+    rows = _select_messages(user_id, run_id, chat_type, limit + 1, before_seq)
+    has_older = len(rows) > limit
+    rows = rows[:limit]
+    oldest_seq = rows[-1][0] if rows else before_seq
+    return [{"role": role, "content": content} for _, role, content in reversed(rows)], oldest_seq, has_older
+
+def migrate_chat_sessions():
+    """ Copy messages from the legacy `user_chat_sessions.messages` JSON blobs into `user_chat_messages` """
+    migrated = 0
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'user_chat_sessions' AND column_name = 'chat_type'
+            """
+        )
+        chat_type_column = "chat_type[1]" if cursor.fetchone() else "NULL"
+        cursor.execute(
+            f"SELECT user_id, run_id, messages, {chat_type_column} FROM user_chat_sessions WHERE messages IS NOT NULL"
+        )
+        sessions = cursor.fetchall()
+        for user_id, run_id, messages_json, chat_type in sessions:
+            try:
+                messages = json.loads(messages_json)
+            except (TypeError, ValueError):
+                continue
+            rows = [
+                (user_id, run_id, chat_type or "document", seq, message["role"], message.get("content"))
+                for seq, message in enumerate(messages, start=1)
+            ]
+            if not rows:
+                continue
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                INSERT INTO user_chat_messages (user_id, run_id, chat_type, seq, role, content)
+                VALUES %s
+                ON CONFLICT (user_id, run_id, chat_type, seq) DO NOTHING
+                """,
+                rows,
+                page_size=len(rows)
+            )
+            migrated += cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return migrated
+
+if __name__ == "__main__":
+    # Databases set up before user_chat_messages existed get the table first
+    ensure_db()
+    print(f"Migrated {migrate_chat_sessions()} messages into user_chat_messages")
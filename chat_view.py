@@ -0,0 +1,72 @@
+import os
+from typing import Callable, List, Optional
+
+import streamlit as st
+
+from chat_history import load_message_page
+
+# Messages rendered per conversation, and loaded per click on "show older"; the rest stays in the database
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "30"))
+
+
+def open_window(key: str, user_id, run_id: str, chat_type: str = "document", window: int = CHAT_WINDOW) -> Optional[List[dict]]:
+    """Load the last `window` messages of a stored conversation into the chat window `key`.
+
+    Returns the messages for the page to keep in its own history, or None when `key` already holds this
+    conversation, so reruns do not query the history again.
+    """
+    state = st.session_state.get(key)
+    if state is not None and (state["user_id"], state["run_id"], state["chat_type"]) == (user_id, run_id, chat_type):
+        return None
+    messages, oldest_seq, has_older = load_message_page(user_id, run_id, chat_type, window)
+    st.session_state[key] = {
+        "user_id": user_id,
+        "run_id": run_id,
+        "chat_type": chat_type,
+        # Older messages fetched on request, oldest first; they are shown but not part of the page's history
+        "older": [],
+        "oldest_seq": oldest_seq,
+        "has_older": has_older,
+        "shown": window,
+    }
+    return messages
+
+
+def show_window(key: str, messages: List[dict], render_message: Callable[[dict], None], window: int = CHAT_WINDOW) -> None:
+    """Render the last `window` messages with `render_message`, below a button that shows `window` older ones.
+
+    `messages` is the history the page keeps; older pages come from memory first, then from the database
+    conversation opened with open_window. Render time depends on the window, not on the conversation length.
+    """
+    state = st.session_state.get(key)
+    if state is None:
+        # A conversation that lives only in session state, e.g. the document chat
+        state = st.session_state[key] = {
+            "user_id": None, "run_id": None, "chat_type": None, "older": [], "oldest_seq": None, "has_older": False,
+            "shown": window,
+        }
+
+    available = len(state["older"]) + len(messages)
+    if available > state["shown"] or state["has_older"]:
+        if st.button("Tampilkan pesan sebelumnya", key=f"{key}_show_older"):
+            state["shown"] += window
+            if state["shown"] > available and state["has_older"]:
+                page, state["oldest_seq"], state["has_older"] = load_message_page(
+                    state["user_id"], state["run_id"], state["chat_type"], window, before_seq=state["oldest_seq"]
+                )
+                state["older"] = page + state["older"]
+
+    shown = state["shown"]
+    if shown <= len(messages):
+        visible = messages[-shown:]
+    else:
+        visible = state["older"][-(shown - len(messages)):] + messages
+    for message in visible:
+        render_message(message)
+
+
+def clear_window(key: str) -> None:
+    """Forget the older messages of window `key`; its conversation is not loaded again on the next rerun"""
+    state = st.session_state.get(key)
+    if state is not None:
+        state.update(older=[], has_older=False, shown=CHAT_WINDOW)
@@ -2,8 +2,8 @@ import streamlit as st
 from utils.config import db_credentials, MAX_TOKENS_ALLOWED, MAX_MESSAGES_TO_OPENAI, TOKEN_BUFFER
 from utils.system_prompts import get_final_system_prompt
 from utils.chat_functions import run_chat_sequence, clear_chat_history, count_tokens, prepare_sidebar_data
-from utils.database_functions import database_schema_dict
-from utils.function_calling_spec import functions
+from utils.database_functions import get_database_schema_dict
+from utils.function_calling_spec import get_functions
 from utils.helper_functions import save_conversation
 from assets.dark_theme import dark
 from assets.light_theme import light
@@ -14,7 +14,7 @@ if __name__ == "__main__":
     ########### A. SIDEBAR ###########
 
     # Prepare data for the sidebar dropdowns
-    sidebar_data = prepare_sidebar_data(database_schema_dict)
+    sidebar_data = prepare_sidebar_data(get_database_schema_dict())
     st.sidebar.markdown("<div class='made_by'>DIV SPI🔋</div>", unsafe_allow_html=True)
 
     ### POSTGRES DB OBJECTS VIEWER ###
@@ -97,7 +97,7 @@ if __name__ == "__main__":
     if st.session_state["api_chat_history"][-1]["role"] != "assistant":
         with st.spinner("⌛Connecting to AI model..."):
             recent_messages = st.session_state["api_chat_history"][-MAX_MESSAGES_TO_OPENAI:]
-            new_message = run_chat_sequence(recent_messages, functions, selected_tables, selected_schema)
+            new_message = run_chat_sequence(recent_messages, get_functions(), selected_tables, selected_schema)
 
             st.session_state["api_chat_history"].append(new_message)
             st.session_state["full_chat_history"].append(new_message)
@@ -1,40 +1,57 @@
 import json
 import requests
+from phi.utils.log import logger
 from db_chat.utils.config import OPENAI_API_KEY, AI_MODEL
-from db_chat.utils.database_functions import ask_postgres_database, postgres_connection
-from tenacity import retry, wait_random_exponential, stop_after_attempt
+from db_chat.utils.database_functions import run_postgres_query, format_query_result, query_connection
+from db_chat.utils.openai_client import post_chat_completion, stream_chat_completion
+from db_chat.utils.query_cache import run_cached
+from metrics import add_tokens, span
+from resilience import LLMUnavailable, get_policy
 
-@retry(wait=wait_random_exponential(min=1, max=40), stop=stop_after_attempt(3))
-def send_api_request_to_openai_api(messages, functions=None, function_call=None, model=AI_MODEL, openai_api_key=OPENAI_API_KEY):
-    """ Send the API request to the OpenAI API via Chat Completions endpoint """
-    try:
-        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {openai_api_key}"}
-        json_data = {"model": model, "messages": messages}
-        if functions: 
-            json_data.update({"functions": functions})
-        if function_call: 
-            json_data.update({"function_call": function_call})
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=json_data)
-        response.raise_for_status()
+def send_api_request_to_openai_api(messages, functions=None, function_call=None, model=AI_MODEL, openai_api_key=OPENAI_API_KEY, stream=False):
+    """ Send the API request to the OpenAI API via Chat Completions endpoint
+
+    Returns the response, or with `stream` a ChatCompletionStream yielding the content as it is generated.
+    Runs under the "db_chat" resilience policy: retries, hedging and the deadline cover the request until the
+    response starts, and the shared OpenAI circuit breaker fails it fast while the API is down.
+    """
+    policy = get_policy("db_chat")
+
+    def request(timeout):
+        if stream:
+            return stream_chat_completion(messages, functions, function_call, model, openai_api_key, timeout=timeout, policy=policy)
+        return post_chat_completion(messages, functions, function_call, model, openai_api_key, timeout=timeout)
 
+    try:
+        with span("llm_call", model=model):
+            response = policy.call(request)
+        if not stream:
+            usage = response.json().get("usage") or {}
+            add_tokens(model, usage.get("prompt_tokens"), usage.get("completion_tokens"))
         return response
-    
-    except requests.RequestException as e:
-        raise ConnectionError(f"Failed to connect to OpenAI API due to: {e}")
+
+    except (requests.RequestException, TimeoutError) as e:
+        raise LLMUnavailable(f"Failed to connect to OpenAI API due to: {e}") from e
 
 def execute_function_call(message, selected_tables, selected_schema):
-    """ Run the function call provided by OpenAI's API response """
+    """ Run the function call provided by OpenAI's API response.
+
+    Returns the compact result text for the model and the full (row-capped) query result for the UI, or None.
+    """
+    query_result = None
     if message["function_call"]["name"] == "ask_postgres_database":
         query = json.loads(message["function_call"]["arguments"])["query"]
-        print(f"SQL query: {query} \n")
+        logger.debug(f"SQL query: {query}")
         
         # Check if the query only uses selected tables
         for table in selected_tables:
             if f"{selected_schema}.{table}" not in query:
-                return f"Error: The query uses tables that were not selected. Please only use the following tables: {', '.join([f'{selected_schema}.{table}' for table in selected_tables])}"
+                return f"Error: The query uses tables that were not selected. Please only use the following tables: {', '.join([f'{selected_schema}.{table}' for table in selected_tables])}", None
         
-        results = ask_postgres_database(postgres_connection, query)
-        print(f"Results A: {results} \n")
+        with query_connection() as connection:
+            query_result = run_cached(connection, query, run_postgres_query)
+        results = format_query_result(query_result)
+        logger.debug(f"Query result: {results}")
     else:
         results = f"Error: function {message['function_call']['name']} does not exist"
-    return results
+    return results, query_result
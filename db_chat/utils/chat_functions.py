@@ -1,9 +1,14 @@
-import tiktoken
+import functools
 import streamlit as st
 from db_chat.utils.config import AI_MODEL
 from db_chat.utils.api_functions import send_api_request_to_openai_api, execute_function_call
 
-def run_chat_sequence(messages, functions, selected_tables, selected_schema):
+def stream_chat_sequence(messages, functions, selected_tables, selected_schema):
+    """ Answer the last user message, yielding the text of the answer as it streams in.
+
+    If the model calls a function, the query runs and the explanation of its result is what streams. The final
+    assistant message is appended to the live chat history.
+    """
     if "live_chat_history" not in st.session_state:
         st.session_state["live_chat_history"] = [{"role": "assistant", "content": "Halo saya Prawata, ada yang bisa dibantu?"}]
 
@@ -13,21 +18,31 @@ def run_chat_sequence(messages, functions, selected_tables, selected_schema):
     tables_info = f"Selected schema: {selected_schema}\nSelected tables: {', '.join(selected_tables)}"
     messages.append({"role": "system", "content": tables_info})
 
-    chat_response = send_api_request_to_openai_api(messages, functions)
-    assistant_message = chat_response.json()["choices"][0]["message"]
-    
+    chat_stream = send_api_request_to_openai_api(messages, functions, stream=True)
+    yield from chat_stream
+    assistant_message = chat_stream.message
+
     if assistant_message["role"] == "assistant":
         internal_chat_history.append(assistant_message)
 
     if assistant_message.get("function_call"):
-        results = execute_function_call(assistant_message, selected_tables, selected_schema)
+        results, query_result = execute_function_call(assistant_message, selected_tables, selected_schema)
+        # Keep the full result for callers that offer functions, so they can show it without re-running the query.
+        # The user page offers none, so nothing reads it there
+        st.session_state["last_query_result"] = query_result
         internal_chat_history.append({"role": "function", "name": assistant_message["function_call"]["name"], "content": results})
         internal_chat_history.append({"role": "user", "content": "Anda adalah analis data - berikan penjelasan yang dipersonalisasi/disesuaikan tentang arti hasil yang diberikan dan kaitkan dengan konteks pertanyaan pengguna menggunakan kata-kata yang jelas dan ringkas dengan cara yang mudah dipahami pengguna. Atau jawab pertanyaan yang diberikan oleh pengguna dengan cara yang membantu - apa pun itu, pastikan respons Anda bersifat manusiawi dan terkait dengan masukan awal pengguna."})
-        chat_response = send_api_request_to_openai_api(internal_chat_history, functions)
-        assistant_message = chat_response.json()["choices"][0]["message"]
-        if assistant_message["role"] == "assistant":
-            st.session_state["live_chat_history"].append(assistant_message)
+        chat_stream = send_api_request_to_openai_api(internal_chat_history, functions, stream=True)
+        yield from chat_stream
+        assistant_message = chat_stream.message
 
+    # Answers without a function call used to be dropped here, returning the greeting instead
+    st.session_state["live_chat_history"].append({"role": "assistant", "content": assistant_message["content"] or ""})
+
+def run_chat_sequence(messages, functions, selected_tables, selected_schema):
+    """ Answer the last user message and return the assistant message once it is complete """
+    for _ in stream_chat_sequence(messages, functions, selected_tables, selected_schema):
+        pass
     return st.session_state["live_chat_history"][-1]
 
 def clear_chat_history():
@@ -36,11 +51,18 @@ def clear_chat_history():
     del st.session_state["full_chat_history"]
     del st.session_state["api_chat_history"]
 
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model):
+    """ Load the tokenizer once, and only when tokens are first counted """
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model)
+
 def count_tokens(text):
     """ Count the total tokens used in a text string """
     if not isinstance(text, str):  
         return 0 
-    encoding = tiktoken.encoding_for_model(AI_MODEL)
+    encoding = _get_encoding(AI_MODEL)
     total_tokens_in_text_string = len(encoding.encode(text))
     
     return total_tokens_in_text_string
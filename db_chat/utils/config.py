@@ -16,6 +16,17 @@ db_credentials = {
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 AI_MODEL = 'gpt-4'
 
+# OpenAI-compatible endpoint; point it at a proxy or a local mock server for testing
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+
+# Seconds to establish a connection, and max seconds between bytes of a response (streamed completions send
+# a chunk per token, so this does not cap the length of an answer)
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+
+# Keep-alive connections kept open to the OpenAI endpoint, shared by all sessions of the app
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "10"))
+
 # Max number of tokens permitted within a conversation exchange via OpenAI API
 MAX_TOKENS_ALLOWED = 3000
 
@@ -24,3 +35,33 @@ MAX_MESSAGES_TO_OPENAI = 5
 
 # An arbitrary number to provide a buffer to avoid reaching exact token limits
 TOKEN_BUFFER = 100
+
+# Seconds between checks of the catalog change signal before reusing the cached schema snapshot
+CATALOG_SIGNAL_INTERVAL = 5
+
+# Max age in seconds of a cached schema snapshot, even if no catalog change was detected
+CATALOG_MAX_AGE = 600
+
+# Generated SQL runs through a server-side cursor; at most this many rows / bytes are kept for the UI
+QUERY_MAX_ROWS = 1000
+QUERY_MAX_BYTES = 5_000_000
+
+# Rows fetched per round trip, and how far past the kept rows to scan when counting the remainder
+QUERY_FETCH_SIZE = 500
+QUERY_MAX_SCAN_ROWS = 100_000
+
+# Limits of the compact result text sent back to OpenAI
+QUERY_LLM_MAX_ROWS = 50
+QUERY_LLM_MAX_CHARS = 8000
+QUERY_LLM_MAX_VALUE_LENGTH = 200
+
+# Result cache for generated SQL, keyed by the normalized statement and per-table change markers.
+# Markers come from pg_stat_user_tables, which other sessions publish within about a second of committing,
+# so QUERY_CACHE_TTL also bounds how long a result can be served after a write.
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_TTL = 300
+QUERY_CACHE_MAX_ENTRIES = 256
+QUERY_CACHE_MAX_BYTES = 64_000_000
+
+# Tables whose results are never cached (comma-separated, e.g. "public.live_transactions,audit_queue")
+QUERY_CACHE_VOLATILE_TABLES = {name.strip() for name in os.getenv("QUERY_CACHE_VOLATILE_TABLES", "").split(",") if name.strip()}
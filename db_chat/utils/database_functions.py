@@ -1,74 +1,284 @@
+import datetime
+import decimal
+import re
+import threading
+import time
+import uuid
 import psycopg2
-from db_chat.utils.config import db_credentials
+from db_config import ConnectionPool
+from metrics import timed
+from db_chat.utils.config import (
+    db_credentials, CATALOG_SIGNAL_INTERVAL, CATALOG_MAX_AGE, QUERY_MAX_ROWS, QUERY_MAX_BYTES, QUERY_MAX_SCAN_ROWS,
+    QUERY_FETCH_SIZE, QUERY_LLM_MAX_ROWS, QUERY_LLM_MAX_CHARS, QUERY_LLM_MAX_VALUE_LENGTH,
+)
+
+_postgres_connection = None
+_query_pool = None
+_connection_lock = threading.Lock()
+
+def get_postgres_connection():
+    """ Returns the shared autocommit connection, connecting on first use and after it was closed """
+    global _postgres_connection
+    with _connection_lock:
+        if _postgres_connection is None or _postgres_connection.closed != 0:
+            # Establish connection with PostgreSQL
+            try:
+                _postgres_connection = psycopg2.connect(**db_credentials)
+                _postgres_connection.set_session(autocommit=True)
+            except Exception as e:
+                raise ConnectionError(f"Unable to connect to the database due to: {e}")
+            print(f"Connected successfully to {db_credentials['dbname']} database\nConnection Details: {_postgres_connection.dsn}")
+        return _postgres_connection
+
+# All user-visible tables, views and their columns in a single pg_catalog round trip
+CATALOG_QUERY = """
+SELECT n.nspname, c.relname, c.relkind, obj_description(c.oid, 'pg_class'),
+       a.attname, format_type(a.atttypid, a.atttypmod), col_description(c.oid, a.attnum)
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+  AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+  AND n.nspname NOT LIKE 'pg\\_toast%'
+  AND n.nspname NOT LIKE 'pg\\_temp\\_%'
+  AND has_table_privilege(c.oid, 'SELECT')
+ORDER BY n.nspname, c.relname, a.attnum;
+"""
+
+# Changes whenever a relation is created, altered or dropped, or a comment is edited.
+# VACUUM/ANALYZE update pg_class in place and therefore do not change xmin.
+CATALOG_SIGNAL_QUERY = """
+SELECT (SELECT count(*) FROM pg_catalog.pg_class),
+       (SELECT sum(xmin::text::bigint) FROM pg_catalog.pg_class),
+       (SELECT sum(xmin::text::bigint) FROM pg_catalog.pg_description);
+"""
+
+_catalog_cache = {}
+_catalog_lock = threading.Lock()
+
+def _load_catalog(connection):
+    """ Returns one dict per table with its columns, types and comments """
+    cursor = connection.cursor()
+    cursor.execute(CATALOG_QUERY)
+    tables = {}
+    for schema_name, table_name, relkind, table_comment, column_name, data_type, column_comment in cursor.fetchall():
+        table = tables.get((schema_name, table_name))
+        if table is None:
+            table = tables[(schema_name, table_name)] = {
+                "schema_name": schema_name,
+                "table_name": table_name,
+                "table_type": "view" if relkind in ("v", "m") else "table",
+                "comment": table_comment,
+                "columns": [],
+                "column_names": [],
+            }
+        if column_name is not None:
+            table["columns"].append({"name": column_name, "data_type": data_type, "comment": column_comment})
+            table["column_names"].append(column_name)
+    cursor.close()
+    return list(tables.values())
 
-# Establish connection with PostgreSQL
-try:
-    postgres_connection = psycopg2.connect(**db_credentials)
-    postgres_connection.set_session(autocommit=True)
-except Exception as e:
-    raise ConnectionError(f"Unable to connect to the database due to: {e}")
+def _catalog_signal(connection):
+    cursor = connection.cursor()
+    cursor.execute(CATALOG_SIGNAL_QUERY)
+    signal = cursor.fetchone()
+    cursor.close()
+    return signal
 
-# Create a database cursor to execute PostgreSQL commands
-cursor = postgres_connection.cursor()
+@timed("schema_introspection")
+def get_catalog_snapshot(connection):
+    """ Returns the cached catalog snapshot for this database, rebuilding it when the catalog changed """
+    key = connection.dsn
+    now = time.monotonic()
+    with _catalog_lock:
+        entry = _catalog_cache.get(key)
+        if entry is not None and now - entry["checked_at"] < CATALOG_SIGNAL_INTERVAL:
+            return entry["tables"]
+    signal = _catalog_signal(connection)
+    with _catalog_lock:
+        entry = _catalog_cache.get(key)
+        if entry is not None and entry["signal"] == signal and now - entry["loaded_at"] < CATALOG_MAX_AGE:
+            entry["checked_at"] = now
+            return entry["tables"]
+    tables = _load_catalog(connection)
+    with _catalog_lock:
+        _catalog_cache[key] = {"tables": tables, "signal": signal, "loaded_at": now, "checked_at": now}
+    return tables
 
-# Validate the PostgreSQL connection status
-if postgres_connection.closed == 0:
-    print(f"Connected successfully to {db_credentials['dbname']} database\nConnection Details: {postgres_connection.dsn}")
-else:
-    raise ConnectionError("Unable to connect to the database")
+def invalidate_catalog_snapshot():
+    """ Drop all cached catalog snapshots so the next lookup reloads them """
+    with _catalog_lock:
+        _catalog_cache.clear()
 
 def get_schema_names(database_connection):
     """ Returns a list of schema names """
-    cursor = database_connection.cursor()
-    cursor.execute("SELECT schema_name FROM information_schema.schemata;")
-    schema_names = [row[0] for row in cursor.fetchall()]
-    cursor.close()
-    return schema_names
+    return sorted({table["schema_name"] for table in get_catalog_snapshot(database_connection)})
 
 def get_table_names(connection, schema_name):
     """ Returns a list of table names """
-    cursor = connection.cursor()
-    cursor.execute(f"SELECT table_name FROM information_schema.tables WHERE table_schema = '{schema_name}';")
-    table_names = [table[0] for table in cursor.fetchall()]
-    cursor.close()
-    return table_names
+    return [table["table_name"] for table in get_catalog_snapshot(connection) if table["schema_name"] == schema_name]
 
 def get_column_names(connection, table_name, schema_name):
     """ Returns a list of column names """
-    cursor = connection.cursor()
-    cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table_name}' AND table_schema = '{schema_name}';")
-    column_names = [col[0] for col in cursor.fetchall()]
-    cursor.close()
-    return column_names
+    for table in get_catalog_snapshot(connection):
+        if table["schema_name"] == schema_name and table["table_name"] == table_name:
+            return list(table["column_names"])
+    return []
 
 def get_database_info(connection, schema_names):
     """ Fetches information about the schemas, tables and columns in the database """
-    table_dicts = []
-    for schema in schema_names:
-        for table_name in get_table_names(connection, schema):
-            column_names = get_column_names(connection, table_name, schema)
-            table_dicts.append({"table_name": table_name, "column_names": column_names, "schema_name": schema})
-    return table_dicts
+    schema_names = set(schema_names)
+    return [table for table in get_catalog_snapshot(connection) if table["schema_name"] in schema_names]
+
+def get_database_schema_string(connection=None, schema_names=None):
+    """ Describes the tables of the given schemas (default: `schemas`) for the function-calling spec """
+    connection = connection or get_postgres_connection()
+    return "\n".join(
+        [
+            f"Schema: {table['schema_name']}\nTable: {table['table_name']}\nColumns: {', '.join(table['column_names'])}"
+            for table in get_database_info(connection, schema_names or schemas)
+        ]
+    )
 
 # To print details to the console:
-# schemas = get_schema_names(postgres_connection)
+# schemas = get_schema_names(get_postgres_connection())
 # here you need to set schema name from postgres by default the schema is public in postgres database. you can see in pgadmin
 schemas = ['public']
-database_schema_dict = get_database_info(postgres_connection, schemas)
-database_schema_string = "\n".join(
-    [
-        f"Schema: {table['schema_name']}\nTable: {table['table_name']}\nColumns: {', '.join(table['column_names'])}"
-        for table in database_schema_dict
-    ]
-)
 
-def ask_postgres_database(connection, query):
-    """ Execute the SQL query provided by OpenAI and return the results """
-    try:
+def get_database_schema_dict():
+    """ Tables and columns of the default schemas, loaded on first use """
+    return get_database_info(get_postgres_connection(), schemas)
+
+def __getattr__(name):
+    # Module attributes kept for existing imports; resolved lazily so importing this module never touches the database
+    if name == "postgres_connection":
+        return get_postgres_connection()
+    if name == "database_schema_dict":
+        return get_database_schema_dict()
+    if name == "database_schema_string":
+        return get_database_schema_string()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_query_pool():
+    """ Pool of transactional connections for running generated SQL, created on first use """
+    global _query_pool
+    with _connection_lock:
+        if _query_pool is None:
+            _query_pool = ConnectionPool(connect=lambda: psycopg2.connect(**db_credentials))
+        return _query_pool
+
+def query_connection():
+    """ Borrow a pooled connection for one query: `with query_connection() as conn: ...` """
+    return get_query_pool().connection()
+
+def _returns_rows(query):
+    """ Whether the statement can run behind a server-side cursor (DECLARE only accepts SELECT/VALUES) """
+    statement = re.sub(r"^(\s*(--[^\n]*\n|/\*.*?\*/))*\s*", "", query, flags=re.S).lower()
+    return statement.startswith(("select", "with", "values", "table"))
+
+def _row_size(row):
+    return sum(len(str(value)) for value in row)
+
+@timed("sql_execution")
+def run_postgres_query(connection, query, max_rows=QUERY_MAX_ROWS, max_bytes=QUERY_MAX_BYTES,
+                       max_scan_rows=QUERY_MAX_SCAN_ROWS, fetch_size=QUERY_FETCH_SIZE):
+    """ Execute a query, streaming rows through a server-side cursor.
+
+    Keeps at most `max_rows` rows / `max_bytes` of values in memory and counts (up to
+    `max_scan_rows`) how many more rows the query would have returned.
+    """
+    result = {"query": query, "columns": [], "rows": [], "more_rows": 0, "more_rows_exact": True, "error": None}
+    named = _returns_rows(query)
+    if named:
+        # WITH HOLD lets the cursor outlive the implicit transaction of an autocommit connection
+        cursor = connection.cursor(name=f"ask_postgres_{uuid.uuid4().hex}", withhold=connection.autocommit)
+    else:
         cursor = connection.cursor()
+    try:
+        if named:
+            cursor.itersize = fetch_size
         cursor.execute(query)
-        results = str(cursor.fetchall())
+        kept_bytes = 0
+        scanned = 0
+        # Once a cap is reached later rows are only counted, so the kept rows are always the first ones
+        capped = False
+        while named or cursor.description is not None:
+            batch = cursor.fetchmany(fetch_size)
+            if not result["columns"] and cursor.description is not None:
+                result["columns"] = [column[0] for column in cursor.description]
+            if not batch:
+                break
+            for row in batch:
+                scanned += 1
+                if not capped:
+                    row_size = _row_size(row)
+                    capped = len(result["rows"]) >= max_rows or kept_bytes + row_size > max_bytes
+                if capped:
+                    result["more_rows"] += 1
+                else:
+                    result["rows"].append(tuple(row))
+                    kept_bytes += row_size
+            if scanned >= max_scan_rows:
+                result["more_rows_exact"] = cursor.fetchone() is None
+                break
         cursor.close()
+        connection.commit()
     except Exception as e:
-        results = f"Query failed with error: {e}"
-    return results
+        try:
+            connection.rollback()
+        except psycopg2.Error:
+            # The connection is broken; the error of the query is the one to report
+            pass
+        result["error"] = str(e)
+    return result
+
+def _format_value(value, max_length=QUERY_LLM_MAX_VALUE_LENGTH):
+    if value is None:
+        return "NULL"
+    text = str(value).replace("\n", " ").replace("|", "\\|")
+    return text if len(text) <= max_length else text[:max_length] + "…"
+
+def summarize_columns(result):
+    """ Per-column summaries (nulls, distinct values, min/max for numbers and dates) over the kept rows """
+    summaries = []
+    for index, name in enumerate(result["columns"]):
+        values = [row[index] for row in result["rows"]]
+        present = [value for value in values if value is not None]
+        summary = f"{name}: {len(values) - len(present)} null, {len({str(value) for value in present})} distinct"
+        comparable = [value for value in present if isinstance(value, (int, float, decimal.Decimal, datetime.date))
+                      and not isinstance(value, bool)]
+        if present and len(comparable) == len(present):
+            summary += f", min {_format_value(min(comparable))}, max {_format_value(max(comparable))}"
+        summaries.append(summary)
+    return summaries
+
+def format_query_result(result, max_rows=QUERY_LLM_MAX_ROWS, max_chars=QUERY_LLM_MAX_CHARS):
+    """ Compact header + rows encoding of a query result for the LLM, truncated with a "N more rows" marker """
+    if result["error"]:
+        return f"Query failed with error: {result['error']}"
+    if not result["columns"]:
+        return "Query executed successfully; it returned no rows."
+    lines = [" | ".join(result["columns"])]
+    used = len(lines[0])
+    shown = 0
+    for row in result["rows"][:max_rows]:
+        line = " | ".join(_format_value(value) for value in row)
+        if used + len(line) > max_chars:
+            break
+        lines.append(line)
+        used += len(line) + 1
+        shown += 1
+    hidden = len(result["rows"]) - shown + result["more_rows"]
+    if hidden:
+        total = len(result["rows"]) + result["more_rows"]
+        approx = "" if result["more_rows_exact"] else "at least "
+        lines.append(f"... {approx}{hidden} more rows (showing {shown} of {approx}{total})")
+        lines.append("Column summary over the first {} rows:".format(len(result["rows"])))
+        lines.extend(f"- {summary}" for summary in summarize_columns(result))
+    elif not result["rows"]:
+        lines.append("(0 rows)")
+    return "\n".join(lines)
+
+def ask_postgres_database(connection, query):
+    """ Execute the SQL query provided by OpenAI and return the results """
+    return format_query_result(run_postgres_query(connection, query))
@@ -1,21 +1,31 @@
-from utils.database_functions import database_schema_string
+from db_chat.utils.database_functions import get_database_schema_string
 
-# Specify function descriptions for OpenAI function calling 
-functions = [
-    {
-        "name": "ask_postgres_database",
-        "description": "Gunakan fungsi ini untuk menjawab pertanyaan pengguna tentang database. Output harus berupa query SQL yang lengkap.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": f""" Kueri SQL yang mengekstrak informasi yang menjawab pertanyaan pengguna dari database Postgres. Tulis SQL dalam struktur skema berikut:
-                            {database_schema_string}. Tuliskan kueri dalam format SQL saja, bukan JSON. Jangan sertakan jeda baris atau karakter apa pun yang tidak dapat dijalankan di Postgres.  
-                            """,
-                }
+def get_functions():
+    """ Function descriptions for OpenAI function calling, built on use from the cached schema catalog """
+    database_schema_string = get_database_schema_string()
+
+    # Specify function descriptions for OpenAI function calling
+    return [
+        {
+            "name": "ask_postgres_database",
+            "description": "Gunakan fungsi ini untuk menjawab pertanyaan pengguna tentang database. Output harus berupa query SQL yang lengkap.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": f""" Kueri SQL yang mengekstrak informasi yang menjawab pertanyaan pengguna dari database Postgres. Tulis SQL dalam struktur skema berikut:
+                                {database_schema_string}. Tuliskan kueri dalam format SQL saja, bukan JSON. Jangan sertakan jeda baris atau karakter apa pun yang tidak dapat dijalankan di Postgres.
+                                """,
+                    }
+                },
+                "required": ["query"],
             },
-            "required": ["query"],
-        },
-    }
-]
+        }
+    ]
+
+def __getattr__(name):
+    # `functions` is kept for existing imports without querying the database at import time
+    if name == "functions":
+        return get_functions()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
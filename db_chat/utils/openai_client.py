@@ -0,0 +1,197 @@
+import asyncio
+import json
+import threading
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import add_tokens
+from db_chat.utils.config import (
+    AI_MODEL, OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT, OPENAI_POOL_SIZE,
+)
+
+CHAT_COMPLETIONS_URL = f"{OPENAI_BASE_URL}/chat/completions"
+
+_session = None
+_session_lock = threading.Lock()
+# One AsyncClient per event loop, since a client's connections belong to the loop that opened them
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_session():
+    """ Process-wide requests session keeping up to OPENAI_POOL_SIZE connections to the endpoint alive """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OPENAI_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def get_async_client():
+    """ AsyncClient of the running event loop, reusing its connection pool across calls on that loop """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=OPENAI_POOL_SIZE, max_keepalive_connections=OPENAI_POOL_SIZE),
+        )
+        _async_clients[loop] = client
+    return client
+
+def _headers(openai_api_key):
+    return {"Content-Type": "application/json", "Authorization": f"Bearer {openai_api_key}"}
+
+def chat_completion_payload(messages, functions=None, function_call=None, model=AI_MODEL, stream=False):
+    json_data = {"model": model, "messages": messages}
+    if functions:
+        json_data["functions"] = functions
+    if function_call:
+        json_data["function_call"] = function_call
+    if stream:
+        json_data["stream"] = True
+        # The last chunk then reports the tokens used, like a non-streamed response does
+        json_data["stream_options"] = {"include_usage": True}
+    return json_data
+
+def _timeouts(timeout=None):
+    """ (connect, read) timeouts, shortened to `timeout` seconds when a deadline leaves less """
+    if timeout is None:
+        return OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT
+    return min(OPENAI_CONNECT_TIMEOUT, timeout), min(OPENAI_READ_TIMEOUT, timeout)
+
+def post_chat_completion(messages, functions=None, function_call=None, model=AI_MODEL, openai_api_key=OPENAI_API_KEY, stream=False, timeout=None):
+    """ POST to the Chat Completions endpoint over the pooled session; raises requests.HTTPError on error statuses """
+    response = get_session().post(
+        CHAT_COMPLETIONS_URL,
+        headers=_headers(openai_api_key),
+        json=chat_completion_payload(messages, functions, function_call, model, stream),
+        timeout=_timeouts(timeout),
+        stream=stream,
+    )
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        # Release the connection back to the pool
+        response.close()
+        raise
+    return response
+
+_DONE = object()
+
+def _parse_sse_line(line):
+    """ JSON payload of a server-sent event `data:` line, _DONE at the end of the stream, None for other lines """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return _DONE
+    return json.loads(data)
+
+class ChatMessageAccumulator:
+    """ Rebuilds the assistant message, including a function call, from streamed chat completion chunks """
+
+    def __init__(self):
+        self.message = {"role": "assistant", "content": None}
+        self.usage = None
+
+    def add(self, chunk):
+        """ Merge one chunk and return the content it added """
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+        choices = chunk.get("choices") or []
+        if not choices:
+            return ""
+        delta = choices[0].get("delta") or {}
+        if delta.get("role"):
+            self.message["role"] = delta["role"]
+        content = delta.get("content") or ""
+        if content:
+            self.message["content"] = (self.message["content"] or "") + content
+        if delta.get("function_call"):
+            function_call = self.message.setdefault("function_call", {"name": "", "arguments": ""})
+            function_call["name"] += delta["function_call"].get("name") or ""
+            function_call["arguments"] += delta["function_call"].get("arguments") or ""
+        return content
+
+class ChatCompletionStream:
+    """ Iterates over the content deltas of a streamed chat completion; `message` is complete once consumed """
+
+    def __init__(self, response, model=AI_MODEL, policy=None):
+        self._response = response
+        self._accumulator = ChatMessageAccumulator()
+        self.model = model
+        # ResiliencePolicy the request ran under; it turns a stream breaking off into LLMUnavailable
+        self.policy = policy
+
+    @property
+    def message(self):
+        return self._accumulator.message
+
+    def close(self):
+        self._response.close()
+
+    def __iter__(self):
+        try:
+            # chunk_size=None hands over each network chunk as it arrives instead of waiting for 512 bytes
+            lines = self._response.iter_lines(chunk_size=None)
+            if self.policy is not None:
+                lines = self.policy.guard_stream(lines)
+            for line in lines:
+                chunk = _parse_sse_line(line)
+                if chunk is _DONE:
+                    break
+                if chunk is not None:
+                    content = self._accumulator.add(chunk)
+                    if content:
+                        yield content
+        finally:
+            self._response.close()
+        usage = self._accumulator.usage
+        if usage:
+            add_tokens(self.model, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+def stream_chat_completion(messages, functions=None, function_call=None, model=AI_MODEL, openai_api_key=OPENAI_API_KEY, timeout=None, policy=None):
+    """ Start a streamed chat completion; iterate over the result for content as it is generated """
+    response = post_chat_completion(messages, functions, function_call, model, openai_api_key, stream=True, timeout=timeout)
+    return ChatCompletionStream(response, model, policy)
+
+async def acreate_chat_completion(messages, functions=None, function_call=None, model=AI_MODEL, openai_api_key=OPENAI_API_KEY, client=None):
+    """ Async Chat Completions request returning the response body """
+    client = client or get_async_client()
+    response = await client.post(
+        CHAT_COMPLETIONS_URL,
+        headers=_headers(openai_api_key),
+        json=chat_completion_payload(messages, functions, function_call, model),
+    )
+    response.raise_for_status()
+    return response.json()
+
+async def astream_chat_completion(messages, functions=None, function_call=None, model=AI_MODEL, openai_api_key=OPENAI_API_KEY, client=None, accumulator=None):
+    """ Async iterator over the content deltas of a streamed chat completion.
+
+    Pass a ChatMessageAccumulator to read the complete message, e.g. a function call, once the stream is consumed.
+    """
+    client = client or get_async_client()
+    accumulator = accumulator or ChatMessageAccumulator()
+    async with client.stream(
+        "POST",
+        CHAT_COMPLETIONS_URL,
+        headers=_headers(openai_api_key),
+        json=chat_completion_payload(messages, functions, function_call, model, stream=True),
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            chunk = _parse_sse_line(line)
+            if chunk is _DONE:
+                break
+            if chunk is not None:
+                content = accumulator.add(chunk)
+                if content:
+                    yield content
@@ -0,0 +1,227 @@
+import collections
+import hashlib
+import re
+import threading
+import time
+from db_chat.utils.config import (
+    db_credentials, QUERY_CACHE_ENABLED, QUERY_CACHE_TTL, QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_MAX_BYTES,
+    QUERY_CACHE_VOLATILE_TABLES,
+)
+
+# Comments, literals and identifiers of a SQL statement, in the order the tokenizer tries them
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>[eE]?'(?:[^']|'')*')
+  | (?P<dollar>\$(?P<tag>\w*)\$.*?\$(?P=tag)\$)
+  | (?P<quoted>"(?:[^"]|"")*")
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<param>\$\d+)
+  | (?P<symbol>::|<=|>=|<>|!=|\|\||.)
+    """,
+    re.S | re.X,
+)
+
+# Statements that write, and functions whose result changes between identical calls, are never cached
+_WRITE_KEYWORDS = {"insert", "update", "delete", "merge", "truncate", "alter", "create", "drop", "grant", "revoke",
+                   "copy", "call", "do", "vacuum", "analyze", "refresh", "lock", "into", "set"}
+_VOLATILE_FUNCTIONS = {"now", "random", "current_date", "current_time", "current_timestamp", "localtime",
+                       "localtimestamp", "clock_timestamp", "statement_timestamp", "transaction_timestamp",
+                       "timeofday", "nextval", "currval", "setval", "gen_random_uuid", "uuid_generate_v4",
+                       "txid_current", "pg_sleep", "current_user", "session_user"}
+
+TABLE_VERSIONS_QUERY = """
+SELECT t.name, c.relkind, c.relfilenode,
+       COALESCE(s.n_tup_ins, 0) + COALESCE(s.n_tup_upd, 0) + COALESCE(s.n_tup_del, 0)
+FROM unnest(%s::text[]) AS t(name)
+LEFT JOIN pg_catalog.pg_class c ON c.oid = to_regclass(t.name)
+LEFT JOIN pg_catalog.pg_stat_user_tables s ON s.relid = c.oid;
+"""
+
+_cache = collections.OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_stats = collections.Counter()
+
+def _tokenize(query):
+    tokens = []
+    for match in _TOKEN_RE.finditer(query):
+        kind = match.lastgroup
+        if kind in ("space", "comment"):
+            continue
+        text = match.group(kind)
+        if kind == "word":
+            text = text.lower()
+        elif kind == "string" and text[0] in "eE":
+            text = "e" + text[1:]
+        elif kind == "dollar":
+            # Re-quote dollar-quoted literals so $a$x$a$ and 'x' normalize the same
+            body = text[len(match.group("tag")) + 2:-(len(match.group("tag")) + 2)]
+            text, kind = "'" + body.replace("'", "''") + "'", "string"
+        elif kind == "number":
+            # Only spellings of the same typed value: 007 -> 7, 1E3 -> 1e3 (10 and 10.0 differ in type)
+            text = str(int(text)) if text.isdigit() else text.lower()
+        tokens.append((kind, text))
+    while tokens and tokens[-1] == ("symbol", ";"):
+        tokens.pop()
+    return tokens
+
+def normalize_sql(query):
+    """ Canonical form of a statement: no comments, single spaces, lower-case keywords and identifiers, canonical numbers """
+    return " ".join(text for _, text in _tokenize(query))
+
+def _read_name(tokens, index):
+    """ Reads a possibly schema-qualified name at `index`; returns (name, next_index) or (None, index) """
+    parts = []
+    while index < len(tokens) and tokens[index][0] in ("word", "quoted"):
+        parts.append(tokens[index][1])
+        index += 1
+        if index < len(tokens) and tokens[index] == ("symbol", ".") and index + 1 < len(tokens):
+            index += 1
+            continue
+        break
+    return (".".join(parts) if parts else None), index
+
+def referenced_tables(tokens):
+    """ Relation names that follow FROM / JOIN (including comma-separated FROM lists), minus CTE names """
+    cte_names = {tokens[i - 1][1] for i in range(1, len(tokens))
+                 if tokens[i] == ("word", "as") and i + 1 < len(tokens) and tokens[i + 1] == ("symbol", "(")
+                 and tokens[i - 1][0] in ("word", "quoted")}
+    tables = set()
+    index = 0
+    while index < len(tokens):
+        if tokens[index] in (("word", "from"), ("word", "join")):
+            in_from_list = tokens[index][1] == "from"
+            index += 1
+            while True:
+                name, index = _read_name(tokens, index)
+                if name and name not in cte_names:
+                    tables.add(name)
+                if not in_from_list:
+                    break
+                # Skip an optional alias, then continue if the FROM list goes on
+                if index < len(tokens) and tokens[index] == ("word", "as"):
+                    index += 1
+                if index < len(tokens) and tokens[index][0] in ("word", "quoted") and tokens[index][1] not in (
+                        "where", "join", "inner", "left", "right", "full", "cross", "natural", "on", "group",
+                        "order", "limit", "having", "union", "except", "intersect", "window", "offset", "fetch"):
+                    index += 1
+                if index < len(tokens) and tokens[index] == ("symbol", ","):
+                    index += 1
+                    continue
+                break
+        else:
+            index += 1
+    return tables
+
+def _is_cacheable(tokens):
+    if not tokens or tokens[0][1] not in ("select", "with", "values", "table"):
+        return False
+    for position, (kind, text) in enumerate(tokens):
+        if kind != "word":
+            continue
+        if text in _WRITE_KEYWORDS:
+            return False
+        followed_by_call = position + 1 < len(tokens) and tokens[position + 1] == ("symbol", "(")
+        if text in _VOLATILE_FUNCTIONS and (followed_by_call or text.startswith(("current_", "local"))):
+            return False
+    return True
+
+def _table_versions(connection, tables):
+    """ Change marker per table, or None if a table is unknown, volatile, or not a plain table """
+    if any(table.split(".")[-1].strip('"') in QUERY_CACHE_VOLATILE_TABLES or table in QUERY_CACHE_VOLATILE_TABLES
+           for table in tables):
+        return None
+    cursor = connection.cursor()
+    cursor.execute(TABLE_VERSIONS_QUERY, (sorted(tables),))
+    rows = cursor.fetchall()
+    cursor.close()
+    # End the snapshot so the next lookup sees fresh statistics
+    connection.rollback()
+    versions = {}
+    for name, relkind, relfilenode, modifications in rows:
+        if relkind in ("r", "p"):
+            versions[name] = [relfilenode, modifications]
+        elif relkind == "m":
+            # REFRESH MATERIALIZED VIEW swaps the relfilenode
+            versions[name] = [relfilenode, 0]
+        else:
+            return None
+    return versions
+
+def _result_size(result):
+    return sum(len(str(value)) for row in result["rows"] for value in row) + len(result["query"])
+
+def _store(key, versions, result):
+    global _cache_bytes
+    size = _result_size(result)
+    if size > QUERY_CACHE_MAX_BYTES:
+        return
+    with _cache_lock:
+        previous = _cache.pop(key, None)
+        if previous is not None:
+            _cache_bytes -= previous["size"]
+        _cache[key] = {"versions": versions, "result": result, "size": size, "expires_at": time.monotonic() + QUERY_CACHE_TTL}
+        _cache_bytes += size
+        while len(_cache) > QUERY_CACHE_MAX_ENTRIES or _cache_bytes > QUERY_CACHE_MAX_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= evicted["size"]
+            _stats["evictions"] += 1
+
+def _lookup(key, versions):
+    global _cache_bytes
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        if entry["expires_at"] < time.monotonic() or entry["versions"] != versions:
+            _stats["expired" if entry["versions"] == versions else "stale"] += 1
+            _stats["misses"] += 1
+            del _cache[key]
+            _cache_bytes -= entry["size"]
+            return None
+        _cache.move_to_end(key)
+        _stats["hits"] += 1
+        return entry["result"]
+
+def run_cached(connection, query, run_query):
+    """ Returns `run_query(connection, query)`, served from the cache when the same normalized
+    statement already ran against unchanged tables within the TTL """
+    if not QUERY_CACHE_ENABLED:
+        return run_query(connection, query)
+    tokens = _tokenize(query)
+    tables = referenced_tables(tokens)
+    versions = _table_versions(connection, tables) if _is_cacheable(tokens) and tables else None
+    if versions is None:
+        with _cache_lock:
+            _stats["bypassed"] += 1
+        return run_query(connection, query)
+
+    normalized = " ".join(text for _, text in tokens)
+    key = hashlib.sha256(f"{db_credentials['dbname']}\0{normalized}".encode()).hexdigest()
+    cached = _lookup(key, versions)
+    if cached is not None:
+        return dict(cached, cached=True)
+    result = run_query(connection, query)
+    if not result["error"]:
+        _store(key, versions, result)
+    return result
+
+def clear_query_cache():
+    global _cache_bytes
+    with _cache_lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+def get_query_cache_stats():
+    """ Hit/miss counters and current size of the query result cache """
+    with _cache_lock:
+        stats = {key: _stats[key] for key in ("hits", "misses", "stale", "expired", "evictions", "bypassed")}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = len(_cache)
+        stats["bytes"] = _cache_bytes
+    return stats
@@ -1,6 +1,6 @@
-import psycopg2
 import streamlit as st
 from utils.config import db_credentials
+from utils.database_functions import get_catalog_snapshot, get_postgres_connection
 
 GENERATE_SQL_PROMPT = """
 Kamu adalah Prawata, seorang spesialis SQL AI PostgreSQL. Misi Anda adalah mengurai kode pertanyaan pengguna, membuat skrip SQL yang tepat, menjalankannya, dan menampilkan hasilnya secara ringkas. Pertahankan persona Andy dalam semua komunikasi.
@@ -26,37 +26,27 @@ Untuk setiap keluaran SQL, sertakan alasan singkat, tampilkan hasilnya, dan beri
 Sebelum menyajikan, konfirmasikan validitas skrip SQL dan kerangka data. Nilai apakah kueri pengguna benar-benar memerlukan respons basis data. Jika tidak, pandu mereka seperlunya.
 """
 
-@st.cache_data(show_spinner=False)
+def _get_catalog(db_credentials: dict):
+    """ Catalog snapshot shared with the sidebar and the function-calling spec """
+    return get_catalog_snapshot(get_postgres_connection())
+
 def get_table_context(schema: str, table: str, db_credentials: dict):
-    conn = psycopg2.connect(**db_credentials)
-    cursor = conn.cursor()
-    cursor.execute(f"""
-    SELECT column_name, data_type FROM information_schema.columns
-    WHERE table_schema = '{schema}' AND table_name = '{table}'
-    """)
-    columns = cursor.fetchall()
+    columns = []
+    for table_info in _get_catalog(db_credentials):
+        if table_info["schema_name"] == schema and table_info["table_name"] == table:
+            columns = table_info["columns"]
+            break
 
-    columns_str = "\n".join([f"- **{col[0]}**: {col[1]}" for col in columns])
+    columns_str = "\n".join([f"- **{col['name']}**: {col['data_type']}" for col in columns])
     context = f"""
     Table: <tableName> {schema}.{table} </tableName>
     Columns for {schema}.{table}:
     <columns>\n\n{columns_str}\n\n</columns>
     """
-    cursor.close()
-    conn.close()
     return context
 
 def get_all_tables_from_db(db_credentials: dict):
-    conn = psycopg2.connect(**db_credentials)
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT table_schema, table_name FROM information_schema.tables
-    WHERE table_schema NOT IN ('pg_catalog', 'information_schema')
-    """)
-    tables = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return tables
+    return [(table["schema_name"], table["table_name"]) for table in _get_catalog(db_credentials)]
 
 def get_all_table_contexts(db_credentials: dict):
     tables = get_all_tables_from_db(db_credentials)
@@ -64,20 +54,10 @@ def get_all_table_contexts(db_credentials: dict):
     return '\n'.join(table_contexts)
 
 def get_data_dictionary(db_credentials: dict):
-    tables = get_all_tables_from_db(db_credentials)
-    data_dict = {}
-    for schema, table in tables:
-        conn = psycopg2.connect(**db_credentials)
-        cursor = conn.cursor()
-        cursor.execute(f"""
-        SELECT column_name, data_type FROM information_schema.columns
-        WHERE table_schema = '{schema}' AND table_name = '{table}'
-        """)
-        columns = cursor.fetchall()
-        data_dict[f"{schema}.{table}"] = {col[0]: col[1] for col in columns}
-        cursor.close()
-        conn.close()
-    return data_dict  
+    return {
+        f"{table['schema_name']}.{table['table_name']}": {col["name"]: col["data_type"] for col in table["columns"]}
+        for table in _get_catalog(db_credentials)
+    }
 
 def get_final_system_prompt(db_credentials: dict, selected_tables: list, selected_schema: str):
     if not selected_tables:
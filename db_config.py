@@ -1,3 +1,7 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
 import psycopg2.extras
 
@@ -7,7 +11,20 @@ DB_PASSWORD = 'postgres'
 DB_HOST = 'localhost'
 DB_PORT = '5432'
 
+# Connection pool sizing, shared by the psycopg2 pool and the SQLAlchemy engine
+DB_POOL_MIN_SIZE = 1
+DB_POOL_MAX_SIZE = 10
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = 10
+# Idle connections older than this many seconds are closed and replaced
+DB_POOL_RECYCLE = 300
+# Idle connections unused for this many seconds are health-checked on checkout
+DB_POOL_PRE_PING_AFTER = 30
+
+db_url = f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
 def get_connection():
+    """ Open a new, unpooled connection; prefer db_connection() for normal use """
     return psycopg2.connect(
         dbname=DB_NAME,
         user=DB_USER,
@@ -16,44 +33,368 @@ def get_connection():
         port=DB_PORT
     )
 
+class PoolTimeout(Exception):
+    """ Raised when no pooled connection became free within the timeout """
+
+class ConnectionPool:
+    """ Thread-safe psycopg2 connection pool with health checks and idle recycling """
+
+    def __init__(self, connect=get_connection, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE, pre_ping_after=DB_POOL_PRE_PING_AFTER):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping_after = pre_ping_after
+        self._lock = threading.Condition()
+        # Idle connections as (connection, last_used_at), most recently used last
+        self._idle = []
+        self._created_at = {}
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_recycled": 0,
+            "health_check_failures": 0,
+        }
+
+    def _open(self):
+        conn = self._connect()
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+            self._stats["connections_created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        """ Close a connection and free its slot; caller must hold the lock """
+        self._created_at.pop(id(conn), None)
+        self._size -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._lock.notify()
+
+    def _is_healthy(self, conn, last_used_at):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used_at < self.pre_ping_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, timeout=None):
+        """ Check a connection out of the pool, waiting up to `timeout` seconds for one to free up """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        waited = False
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                conn = None
+                while self._idle:
+                    candidate, last_used_at = self._idle.pop()
+                    if time.monotonic() - self._created_at.get(id(candidate), 0) > self.recycle:
+                        self._stats["connections_recycled"] += 1
+                        self._discard(candidate)
+                        continue
+                    conn = (candidate, last_used_at)
+                    break
+                if conn is None and self._size < self.max_size:
+                    self._size += 1
+                    conn = (None, None)
+                if conn is None:
+                    remaining = timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No database connection available after {timeout}s")
+                    waited = True
+                    self._lock.wait(remaining)
+                    continue
+                self._record_checkout(started, waited)
+
+            candidate, last_used_at = conn
+            if candidate is None:
+                try:
+                    return self._open()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+            if self._is_healthy(candidate, last_used_at):
+                return candidate
+            with self._lock:
+                self._stats["health_check_failures"] += 1
+                self._discard(candidate)
+                self._size += 1
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                    self._lock.notify()
+                raise
+
+    def _record_checkout(self, started, waited):
+        self._stats["checkouts"] += 1
+        if waited:
+            wait_time = time.monotonic() - started
+            self._stats["waits"] += 1
+            self._stats["wait_time_total"] += wait_time
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+
+    def putconn(self, conn, discard=False):
+        """ Return a connection to the pool, rolling back any open transaction """
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        with self._lock:
+            if discard or conn.closed or self._closed:
+                self._discard(conn)
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """ Context manager that checks a connection out and always returns it """
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        except Exception:
+            self.putconn(conn, discard=conn.closed != 0)
+            raise
+        else:
+            self.putconn(conn)
+
+    def fill(self):
+        """ Open connections until the pool holds at least `min_size` """
+        while True:
+            with self._lock:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+            self.putconn(conn)
+
+    def stats(self):
+        """ Returns pool usage and wait counters """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max_size"] = self.max_size
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+
+_pool = None
+_engine = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """ Returns the process-wide connection pool, creating it on first use """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+                # Opens DB_POOL_MIN_SIZE connections up front; if the database is down this raises, as the
+                # first checkout would, and later checkouts open connections on demand
+                _pool.fill()
+    return _pool
+
+def db_connection(timeout=None):
+    """ Borrow a pooled connection: `with db_connection() as conn: ...` """
+    return get_pool().connection(timeout)
+
+def get_engine():
+    """ Returns the process-wide SQLAlchemy engine for `db_url`, sized like the psycopg2 pool """
+    global _engine
+    if _engine is None:
+        with _pool_lock:
+            if _engine is None:
+                from sqlalchemy import create_engine
+
+                _engine = create_engine(
+                    db_url,
+                    pool_size=DB_POOL_MIN_SIZE,
+                    max_overflow=DB_POOL_MAX_SIZE - DB_POOL_MIN_SIZE,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    pool_pre_ping=True,
+                )
+    return _engine
+
+def get_pool_stats():
+    """ Returns usage counters for the psycopg2 pool and the SQLAlchemy engine pool """
+    stats = {"psycopg2": get_pool().stats()}
+    if _engine is not None:
+        engine_pool = _engine.pool
+        stats["sqlalchemy"] = {
+            "size": engine_pool.size(),
+            "checked_out": engine_pool.checkedout(),
+            "idle": engine_pool.checkedin(),
+            "overflow": engine_pool.overflow(),
+        }
+    return stats
+
 def init_db():
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        username VARCHAR(50) UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        email VARCHAR(100),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS sessions (
-        session_id SERIAL PRIMARY KEY,
-        user_id INT NOT NULL,
-        session_token TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        expires_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP + INTERVAL '1 hour',
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    );
-    """)
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_chat_sessions (
-        id SERIAL PRIMARY KEY,
-        user_id INT NOT NULL,
-        run_id TEXT NOT NULL,
-        messages TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id),
-        UNIQUE (user_id, run_id)
-    );
-    """)
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            email VARCHAR(100),
+            role TEXT NOT NULL DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        # Databases created before the role column; user_auth.login reads it
+        cursor.execute("""
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS role TEXT NOT NULL DEFAULT 'user';
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id SERIAL PRIMARY KEY,
+            user_id INT NOT NULL,
+            session_token TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP + INTERVAL '1 hour',
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+        """)
+        # Session tokens are looked up on every browser refresh and expired ones are swept by expiry, see user_auth.py
+        cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS sessions_token_idx ON sessions (session_token);
+        CREATE INDEX IF NOT EXISTS sessions_expires_at_idx ON sessions (expires_at);
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_chat_sessions (
+            id SERIAL PRIMARY KEY,
+            user_id INT NOT NULL,
+            run_id TEXT NOT NULL,
+            messages TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            UNIQUE (user_id, run_id)
+        );
+        """)
+
+        # One row per chat message, appended in `seq` order per conversation
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_chat_messages (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INT NOT NULL,
+            run_id TEXT NOT NULL,
+            chat_type TEXT NOT NULL DEFAULT 'document',
+            seq INT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            UNIQUE (user_id, run_id, chat_type, seq)
+        );
+        """)
+        # Conversation exports filter by date, see conversation_export.py
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS user_chat_messages_created_at_idx ON user_chat_messages (created_at);
+        """)
+
+        # Knowledge-base tenants (departments) each user may search, see tenants.py
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_tenants (
+            user_id INT NOT NULL,
+            tenant TEXT NOT NULL,
+            PRIMARY KEY (user_id, tenant),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+        """)
+
+        # Knowledge-base ingestion jobs, taken by the workers in ingestion_jobs.py
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INT,
+            kind TEXT NOT NULL,
+            source TEXT NOT NULL,
+            payload BYTEA,
+            options JSONB,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INT NOT NULL DEFAULT 0,
+            chunks_done INT NOT NULL DEFAULT 0,
+            pages_done INT NOT NULL DEFAULT 0,
+            total_pages INT,
+            stats JSONB,
+            error TEXT,
+            worker TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            retry_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        );
+        """)
+        # Databases created before jobs carried options (tenant, crawl budget) or were retried with a backoff,
+        # see ingestion_jobs.py
+        cursor.execute("""
+        ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS options JSONB;
+        """)
+        cursor.execute("""
+        ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS retry_at TIMESTAMP;
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ingestion_jobs_status_idx ON ingestion_jobs (status, id);
+        """)
+
+        conn.commit()
+        cursor.close()
+
+_db_ready = False
+_init_lock = threading.Lock()
 
+def ensure_db():
+    """ Run init_db once per process, so tables added since a database was set up exist before they are used """
+    global _db_ready
+    if _db_ready:
+        return
+    with _init_lock:
+        if not _db_ready:
+            init_db()
+            _db_ready = True
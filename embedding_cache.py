@@ -0,0 +1,169 @@
+import collections
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import psycopg2.extras
+from phi.embedder.openai import OpenAIEmbedder
+from phi.utils.log import logger
+
+from db_config import db_connection
+from metrics import add_tokens, span
+
+EMBEDDING_CACHE_TABLE = "ai.embedding_cache"
+# Single-text (query) embeddings kept in memory, so a question embedded by the answer cache is not embedded
+# again by the knowledge-base search; they are never written to the table, which would grow with chat traffic
+QUERY_CACHE_SIZE = 1024
+
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+_table_ready = False
+# (content hash, model, dimensions) -> embedding, least recently used first
+_query_cache: "collections.OrderedDict[Tuple[str, str, int], List[float]]" = collections.OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def content_hash(text: str) -> str:
+    """Hash of the text exactly as PgVector2 stores it (NUL bytes replaced)"""
+    return hashlib.sha256(text.replace("\x00", "\ufffd").encode()).hexdigest()
+
+
+def _ensure_table(cursor) -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    cursor.execute("CREATE SCHEMA IF NOT EXISTS ai")
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {EMBEDDING_CACHE_TABLE} (
+            content_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            dimensions INT NOT NULL,
+            embedding REAL[] NOT NULL,
+            created_at TIMESTAMPTZ DEFAULT now(),
+            PRIMARY KEY (content_hash, model, dimensions)
+        )
+        """
+    )
+    _table_ready = True
+
+
+class CachedOpenAIEmbedder(OpenAIEmbedder):
+    """OpenAIEmbedder that reuses embeddings of previously seen text, persisted in Postgres.
+
+    Entries are keyed by content hash, model and dimensions, so every admin and session shares them and a
+    re-uploaded or renamed document only calls the API for chunks whose text changed. Only document chunks
+    (`get_embeddings`) are stored; queries are looked up in the table but kept in a bounded in-memory cache.
+    """
+
+    def _read_cached(self, hashes: List[str]) -> Dict[str, List[float]]:
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                _ensure_table(cursor)
+                cursor.execute(
+                    f"""
+                    SELECT content_hash, embedding FROM {EMBEDDING_CACHE_TABLE}
+                    WHERE model = %s AND dimensions = %s AND content_hash = ANY(%s)
+                    """,
+                    (self.model, self.dimensions, hashes),
+                )
+                cached = dict(cursor.fetchall())
+                conn.commit()
+                cursor.close()
+            return cached
+        except Exception as e:
+            logger.warning(f"Embedding cache unavailable: {e}")
+            _count("errors")
+            return {}
+
+    def _write_cached(self, embeddings: Dict[str, List[float]]) -> None:
+        if not embeddings:
+            return
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                _ensure_table(cursor)
+                psycopg2.extras.execute_values(
+                    cursor,
+                    f"""
+                    INSERT INTO {EMBEDDING_CACHE_TABLE} (content_hash, model, dimensions, embedding)
+                    VALUES %s ON CONFLICT DO NOTHING
+                    """,
+                    [(key, self.model, self.dimensions, embedding) for key, embedding in embeddings.items()],
+                    template="(%s, %s, %s, %s::real[])",
+                )
+                conn.commit()
+                cursor.close()
+        except Exception as e:
+            logger.warning(f"Could not store embeddings in cache: {e}")
+            _count("errors")
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embedding_and_usage(text)[0]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        key = content_hash(text)
+        query_key = (key, self.model, self.dimensions)
+        with _query_cache_lock:
+            cached = _query_cache.get(query_key)
+            if cached is not None:
+                _query_cache.move_to_end(query_key)
+        if cached is None:
+            cached = self._read_cached([key]).get(key)
+        if cached is not None:
+            _count("hits")
+            return cached, None
+        _count("misses")
+        with span("embedding", model=self.model):
+            embedding, usage = super().get_embedding_and_usage(text)
+        _count("api_calls")
+        if usage:
+            add_tokens(self.model, usage.get("prompt_tokens"), None)
+        with _query_cache_lock:
+            _query_cache[query_key] = embedding
+            while len(_query_cache) > QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+        return embedding, usage
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embed many texts with one cache lookup and at most one API request for the uncached ones"""
+        if not texts:
+            return []
+        keys = [content_hash(text) for text in texts]
+        cached = self._read_cached(list(set(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        _count("hits", len(texts) - sum(1 for key in keys if key in missing))
+        _count("misses", sum(1 for key in keys if key in missing))
+        if missing:
+            request_params = {"input": list(missing.values()), "model": self.model, "encoding_format": self.encoding_format}
+            if self.user is not None:
+                request_params["user"] = self.user
+            if self.model.startswith("text-embedding-3"):
+                request_params["dimensions"] = self.dimensions
+            if self.request_params:
+                request_params.update(self.request_params)
+            with span("embedding", model=self.model):
+                response = self.client.embeddings.create(**request_params)
+            _count("api_calls")
+            if response.usage is not None:
+                add_tokens(self.model, response.usage.prompt_tokens, None)
+            fresh = {key: item.embedding for key, item in zip(missing, sorted(response.data, key=lambda item: item.index))}
+            self._write_cached(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+
+def get_embedding_cache_stats() -> dict:
+    """Embeddings served from the cache (API calls avoided) versus computed in this process"""
+    with _stats_lock:
+        stats = {key: _stats[key] for key in ("hits", "misses", "api_calls", "errors")}
+    lookups = stats["hits"] + stats["misses"]
+    stats["embeddings_avoided"] = stats["hits"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
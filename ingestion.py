@@ -0,0 +1,272 @@
+import collections
+import io
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, List, Optional
+
+from phi.document import Document
+from phi.document.reader.base import Reader
+from phi.document.reader.pdf import PDFReader
+from phi.utils.log import logger
+from phi.vectordb.pgvector import PgVector2
+
+# Pages handed to a parser process per task
+PAGES_PER_TASK = 8
+# Chunks embedded per API request and written per INSERT statement
+EMBED_BATCH_SIZE = 64
+# Concurrent embedding requests
+EMBED_WORKERS = 4
+# Parser processes; defaults to the CPU count capped at 4
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class IngestionStats:
+    """Counters and per-stage throughput of one ingestion run"""
+
+    def __init__(self, total_pages: Optional[int] = None):
+        self.started_at = time.perf_counter()
+        self.total_pages = total_pages
+        self.pages = 0
+        self.chunks = 0
+        self.embeddings = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.stage_seconds = collections.Counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    @property
+    def progress(self) -> Optional[float]:
+        if not self.total_pages:
+            return None
+        return min(1.0, self.pages / self.total_pages)
+
+    def rate(self, count: int) -> float:
+        return count / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "embeddings": self.embeddings,
+            "inserted": self.inserted,
+            "skipped": self.skipped,
+            "seconds": round(self.elapsed, 2),
+            "pages_per_second": round(self.rate(self.pages), 2),
+            "chunks_per_second": round(self.rate(self.chunks), 2),
+            "embeddings_per_second": round(self.rate(self.embeddings), 2),
+            "stage_seconds": {stage: round(seconds, 2) for stage, seconds in self.stage_seconds.items()},
+        }
+
+    def describe(self) -> str:
+        pages = f"{self.pages}/{self.total_pages}" if self.total_pages else str(self.pages)
+        return (
+            f"{pages} halaman ({self.rate(self.pages):.1f}/s), {self.chunks} chunk ({self.rate(self.chunks):.1f}/s), "
+            f"{self.embeddings} embedding ({self.rate(self.embeddings):.1f}/s)"
+        )
+
+
+# -*- PDF parsing, run in worker processes
+_worker_pdf = None
+
+
+def _init_parser(pdf_bytes: bytes) -> None:
+    """Open the PDF once per worker process instead of shipping it with every task"""
+    global _worker_pdf
+    from pypdf import PdfReader
+
+    _worker_pdf = PdfReader(io.BytesIO(pdf_bytes))
+
+
+def _parse_pages(page_range: range) -> List[tuple]:
+    return [(page_number + 1, _worker_pdf.pages[page_number].extract_text()) for page_number in page_range]
+
+
+def count_pdf_pages(pdf_bytes: bytes) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def iter_pdf_pages(pdf_bytes: bytes, doc_name: str, workers: int = PARSE_WORKERS, start_page: int = 1) -> Iterator[Document]:
+    """Yield one Document per page, in order, parsing pages in a process pool with a bounded number of tasks in flight"""
+    total_pages = count_pdf_pages(pdf_bytes)
+    tasks = [range(start, min(start + PAGES_PER_TASK, total_pages)) for start in range(start_page - 1, total_pages, PAGES_PER_TASK)]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_parser, initargs=(pdf_bytes,)) as pool:
+        in_flight: Deque = collections.deque()
+        task_iter = iter(tasks)
+        for page_range in task_iter:
+            in_flight.append(pool.submit(_parse_pages, page_range))
+            if len(in_flight) >= workers * 2:
+                break
+        while in_flight:
+            pages = in_flight.popleft().result()
+            next_range = next(task_iter, None)
+            if next_range is not None:
+                in_flight.append(pool.submit(_parse_pages, next_range))
+            for page_number, text in pages:
+                # Same names and ids as PDFReader, so re-ingesting a file upserts its existing rows
+                yield Document(name=doc_name, id=f"{doc_name}_{page_number}", meta_data={"page": page_number}, content=text)
+
+
+def iter_chunks(documents: Iterable[Document], reader: Reader, stats: IngestionStats) -> Iterator[Document]:
+    for document in documents:
+        started = time.perf_counter()
+        chunks = reader.chunk_document(document) if reader.chunk else [document]
+        stats.stage_seconds["chunk"] += time.perf_counter() - started
+        stats.pages += 1
+        for chunk in chunks:
+            stats.chunks += 1
+            yield chunk
+
+
+def _batches(documents: Iterable[Document], size: int) -> Iterator[List[Document]]:
+    batch: List[Document] = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _embed_batch(vector_db: PgVector2, batch: List[Document]) -> List[Document]:
+    embedder = vector_db.embedder
+    if hasattr(embedder, "get_embeddings"):
+        embeddings = embedder.get_embeddings([document.content for document in batch])
+        for document, embedding in zip(batch, embeddings):
+            document.embedding = embedding
+    else:
+        for document in batch:
+            document.embed(embedder=embedder)
+    return batch
+
+
+def bulk_upsert(vector_db: PgVector2, documents: List[Document]) -> None:
+    """Upsert already-embedded documents with one multi-row INSERT ... ON CONFLICT, same columns as PgVector2.upsert"""
+    from hashlib import md5
+    from sqlalchemy.dialects import postgresql
+
+    rows = []
+    for document in documents:
+        cleaned_content = document.content.replace("\x00", "�")
+        content_hash = md5(cleaned_content.encode()).hexdigest()
+        rows.append(
+            dict(
+                id=document.id or content_hash,
+                name=document.name,
+                meta_data=document.meta_data,
+                content=cleaned_content,
+                embedding=document.embedding,
+                usage=document.usage,
+                content_hash=content_hash,
+            )
+        )
+    # Later duplicates win, as they would with row-by-row upserts
+    rows = list({row["id"]: row for row in rows}.values())
+    stmt = postgresql.insert(vector_db.table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["id"],
+        set_=dict(
+            name=stmt.excluded.name,
+            meta_data=stmt.excluded.meta_data,
+            content=stmt.excluded.content,
+            embedding=stmt.excluded.embedding,
+            usage=stmt.excluded.usage,
+            content_hash=stmt.excluded.content_hash,
+        ),
+    )
+    with vector_db.Session() as sess, sess.begin():
+        sess.execute(stmt)
+
+
+def embed_and_store(
+    chunks: Iterable[Document],
+    vector_db: PgVector2,
+    stats: IngestionStats,
+    progress: Optional[Callable[[IngestionStats], None]] = None,
+    on_batch: Optional[Callable[[int], None]] = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    embed_workers: int = EMBED_WORKERS,
+) -> IngestionStats:
+    """Embed chunk batches concurrently and bulk-insert them in order, calling `progress` after each insert.
+
+    At most `embed_workers * 2` batches are held in memory at once. `on_batch` receives the number of chunks stored
+    so far, in order, so callers can checkpoint.
+    """
+    vector_db.create()
+    with ThreadPoolExecutor(max_workers=embed_workers) as pool:
+        in_flight: Deque = collections.deque()
+
+        def store_oldest() -> None:
+            future, submitted_at = in_flight.popleft()
+            batch = future.result()
+            stats.stage_seconds["embed"] += time.perf_counter() - submitted_at
+            stats.embeddings += len(batch)
+            started = time.perf_counter()
+            bulk_upsert(vector_db, batch)
+            stats.stage_seconds["insert"] += time.perf_counter() - started
+            stats.inserted += len(batch)
+            if progress is not None:
+                progress(stats)
+            if on_batch is not None:
+                on_batch(stats.inserted)
+
+        for batch in _batches(chunks, batch_size):
+            in_flight.append((pool.submit(_embed_batch, vector_db, batch), time.perf_counter()))
+            if len(in_flight) >= embed_workers * 2:
+                store_oldest()
+        while in_flight:
+            store_oldest()
+    logger.info(f"Ingestion finished: {stats.summary()}")
+    return stats
+
+
+def ingest_pdf(
+    pdf_bytes: bytes,
+    doc_name: str,
+    vector_db: PgVector2,
+    progress: Optional[Callable[[IngestionStats], None]] = None,
+    reader: Optional[Reader] = None,
+    workers: int = PARSE_WORKERS,
+    skip_chunks: int = 0,
+    on_batch: Optional[Callable[[int], None]] = None,
+) -> IngestionStats:
+    """Parse, chunk, embed and store a PDF as a stream, without holding the whole document in memory.
+
+    Chunks come out in a deterministic order, so a run resumed with `skip_chunks` set to an earlier checkpoint
+    only embeds and stores the chunks that were not stored yet.
+    """
+    stats = IngestionStats(total_pages=count_pdf_pages(pdf_bytes))
+    stats.skipped = skip_chunks
+    pages = iter_pdf_pages(pdf_bytes, doc_name, workers=workers)
+    chunks = itertools.islice(iter_chunks(pages, reader or PDFReader(), stats), skip_chunks, None)
+    return embed_and_store(
+        chunks, vector_db, stats, progress=progress,
+        on_batch=None if on_batch is None else lambda inserted: on_batch(skip_chunks + inserted),
+    )
+
+
+def ingest_documents(
+    documents: List[Document],
+    vector_db: PgVector2,
+    progress: Optional[Callable[[IngestionStats], None]] = None,
+    on_batch: Optional[Callable[[int], None]] = None,
+) -> IngestionStats:
+    """Embed and store already-chunked documents (e.g. from WebsiteReader) with batched embedding and inserts"""
+    stats = IngestionStats(total_pages=len(documents))
+
+    def counted(documents: Iterable[Document]) -> Iterator[Document]:
+        for document in documents:
+            stats.pages += 1
+            stats.chunks += 1
+            yield document
+
+    return embed_and_store(counted(documents), vector_db, stats, progress=progress, on_batch=on_batch)
@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import socket
+import threading
+from typing import List, Optional
+
+import psycopg2.extras
+from phi.utils.log import logger
+
+from db_config import db_connection
+
+# Worker threads started per server process
+JOB_WORKERS = int(os.getenv("INGESTION_JOB_WORKERS", "1"))
+# Seconds an idle worker waits before polling the queue again
+JOB_POLL_INTERVAL = 5
+# A running job whose heartbeat is older than this is assumed to belong to a dead worker and is taken over
+JOB_STALE_AFTER = 300
+# Seconds between heartbeats of a running job, sent whether or not a batch was stored (parsing, crawling and
+# embedding can each take longer than JOB_STALE_AFTER)
+JOB_HEARTBEAT_INTERVAL = 30
+# Attempts before a failing job is marked as failed
+JOB_MAX_ATTEMPTS = 3
+# Seconds before a failed job is retried, doubled after every further failed attempt
+JOB_RETRY_BACKOFF = 30
+
+JOB_COLUMNS = """
+id, user_id, kind, source, options, status, attempts, chunks_done, pages_done, total_pages, stats, error, worker,
+created_at, started_at, heartbeat_at, finished_at, retry_at
+"""
+
+_workers: List[threading.Thread] = []
+_workers_lock = threading.Lock()
+_stop = threading.Event()
+_wakeup = threading.Event()
+
+
+def enqueue_job(
+    kind: str, source: str, payload: Optional[bytes] = None, user_id: Optional[int] = None, options: Optional[dict] = None
+) -> int:
+    """Queue a 'pdf' (payload = file bytes, source = document name) or 'url' (source = URL) ingestion job.
+
+    `options` may set the target tenant ("tenant") and, for URL jobs, the crawl budget: max_depth and max_links.
+    """
+    if kind not in ("pdf", "url"):
+        raise ValueError(f"Unknown ingestion job kind: {kind}")
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO ingestion_jobs (user_id, kind, source, payload, options) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+            (user_id, kind, source, psycopg2.Binary(payload) if payload is not None else None,
+             json.dumps(options) if options is not None else None),
+        )
+        job_id = cursor.fetchone()[0]
+        conn.commit()
+        cursor.close()
+    _wakeup.set()
+    return job_id
+
+
+def claim_job(worker: str) -> Optional[dict]:
+    """Take the oldest queued job, or a running job whose worker stopped sending heartbeats"""
+    with db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(
+            f"""
+            UPDATE ingestion_jobs
+            SET status = 'running', worker = %s, attempts = attempts + 1, error = NULL,
+                started_at = COALESCE(started_at, CURRENT_TIMESTAMP), heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM ingestion_jobs
+                WHERE (status = 'queued' AND (retry_at IS NULL OR retry_at <= CURRENT_TIMESTAMP))
+                   OR (status = 'running' AND heartbeat_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {JOB_COLUMNS}, payload
+            """,
+            (worker, JOB_STALE_AFTER),
+        )
+        job = cursor.fetchone()
+        conn.commit()
+        cursor.close()
+    return dict(job) if job else None
+
+
+def _checkpoint(job_id: int, worker: str, chunks_done: int, pages_done: int, total_pages: Optional[int]) -> None:
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE ingestion_jobs
+            SET chunks_done = %s, pages_done = %s, total_pages = %s, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND worker = %s
+            """,
+            (chunks_done, pages_done, total_pages, job_id, worker),
+        )
+        conn.commit()
+        cursor.close()
+
+
+def _heartbeat(job_id: int, worker: str) -> None:
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE ingestion_jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE id = %s AND worker = %s AND status = 'running'",
+            (job_id, worker),
+        )
+        conn.commit()
+        cursor.close()
+
+
+def _send_heartbeats(job_id: int, worker: str, stop: threading.Event) -> None:
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            _heartbeat(job_id, worker)
+        except Exception as e:
+            logger.warning(f"Could not send the heartbeat of ingestion job {job_id}: {e}")
+
+
+def _finish(job_id: int, worker: str, status: str, stats: Optional[dict] = None, error: Optional[str] = None,
+            retry_after: Optional[float] = None) -> None:
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE ingestion_jobs
+            SET status = %s, stats = COALESCE(%s, stats), error = %s, heartbeat_at = CURRENT_TIMESTAMP,
+                finished_at = CASE WHEN %s IN ('done', 'failed') THEN CURRENT_TIMESTAMP END,
+                retry_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                payload = CASE WHEN %s = 'done' THEN NULL ELSE payload END
+            WHERE id = %s AND worker = %s
+            """,
+            (status, json.dumps(stats) if stats is not None else None, error, status, retry_after, status, job_id, worker),
+        )
+        conn.commit()
+        cursor.close()
+
+
+def run_job(job: dict, worker: str) -> None:
+    """Ingest one claimed job, checkpointing after every stored batch of chunks"""
+    from answer_cache import invalidate_answer_cache
+    from assistant import get_vector_db
+    from ingestion import ingest_documents, ingest_pdf
+    from tenants import DEFAULT_TENANT
+
+    job_id = job["id"]
+    logger.info(f"Ingestion job {job_id} ({job['kind']} {job['source']}) started by {worker}, attempt {job['attempts']}")
+    stats = None
+
+    def on_batch(chunks_done: int) -> None:
+        _checkpoint(job_id, worker, chunks_done, stats.pages if stats else 0, stats.total_pages if stats else None)
+
+    def progress(current) -> None:
+        nonlocal stats
+        stats = current
+
+    # Keeps the job from being taken over by another worker while a long phase stores no batch
+    stop_heartbeats = threading.Event()
+    threading.Thread(
+        target=_send_heartbeats, args=(job_id, worker, stop_heartbeats), name=f"ingestion-heartbeat-{job_id}", daemon=True
+    ).start()
+    try:
+        options = dict(job["options"] or {})
+        tenant = options.pop("tenant", DEFAULT_TENANT)
+        vector_db = get_vector_db(tenant)
+        if job["kind"] == "pdf":
+            # Resume after the last stored chunk; pages before it are re-parsed but not re-embedded
+            result = ingest_pdf(
+                bytes(job["payload"]), job["source"], vector_db, progress=progress,
+                skip_chunks=job["chunks_done"], on_batch=on_batch,
+            )
+        else:
+            from web_crawler import AsyncWebsiteReader, PostgresCrawlStateStore
+
+            # A crawl is not guaranteed to return the same chunks twice, so URL jobs restart from the beginning;
+            # conditional re-fetch, the upsert and the embedding cache keep the repeated work cheap
+            reader = AsyncWebsiteReader(**options, state_store=PostgresCrawlStateStore(namespace=tenant))
+            documents = reader.read(job["source"])
+            crawl_stats = reader.last_stats
+            if not documents and crawl_stats["changed"] + crawl_stats["unchanged"] + crawl_stats["not_modified"] == 0:
+                raise ValueError("Tidak dapat membaca website")
+            result = ingest_documents(documents, vector_db, progress=progress, on_batch=on_batch)
+            # Only now are the changed pages stored; a failure above leaves them changed for the retry
+            reader.save_states()
+        _checkpoint(job_id, worker, result.skipped + result.inserted, result.pages, result.total_pages)
+        summary = result.summary()
+        if job["kind"] == "url":
+            summary["crawl"] = crawl_stats
+        try:
+            summary["index_rebuilt"] = vector_db.after_bulk_load()
+        except Exception as e:
+            logger.warning(f"Could not maintain the vector index after job {job_id}: {e}")
+        _finish(job_id, worker, "done", stats=summary)
+        invalidate_answer_cache()
+        logger.info(f"Ingestion job {job_id} finished: {result.summary()}")
+    except Exception as e:
+        logger.warning(f"Ingestion job {job_id} failed: {e}")
+        status = "failed" if job["attempts"] >= JOB_MAX_ATTEMPTS else "queued"
+        retry_after = JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1) if status == "queued" else None
+        try:
+            _finish(job_id, worker, status, error=str(e), retry_after=retry_after)
+        except Exception as finish_error:
+            logger.warning(f"Could not record failure of ingestion job {job_id}: {finish_error}")
+    finally:
+        stop_heartbeats.set()
+
+
+def _worker_loop(worker: str) -> None:
+    while not _stop.is_set():
+        try:
+            job = claim_job(worker)
+        except Exception as e:
+            logger.warning(f"Ingestion worker {worker} could not poll the queue: {e}")
+            job = None
+        if job is None:
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        run_job(job, worker)
+
+
+def start_workers(count: int = JOB_WORKERS) -> None:
+    """Start the ingestion worker threads of this process once; later calls are no-ops"""
+    with _workers_lock:
+        if any(thread.is_alive() for thread in _workers):
+            return
+        _stop.clear()
+        for index in range(count):
+            worker = f"{socket.gethostname()}:{os.getpid()}:{index}"
+            thread = threading.Thread(target=_worker_loop, args=(worker,), name=f"ingestion-worker-{index}", daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+def stop_workers() -> None:
+    _stop.set()
+    _wakeup.set()
+
+
+def list_jobs(limit: int = 20) -> List[dict]:
+    """Most recent jobs with their progress and timing, newest first"""
+    with db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(
+            f"""
+            SELECT {JOB_COLUMNS},
+                   EXTRACT(EPOCH FROM started_at - created_at) AS wait_seconds,
+                   EXTRACT(EPOCH FROM COALESCE(finished_at, heartbeat_at) - started_at) AS run_seconds
+            FROM ingestion_jobs
+            ORDER BY id DESC
+            LIMIT %s
+            """,
+            (limit,),
+        )
+        jobs = [dict(job) for job in cursor.fetchall()]
+        conn.commit()
+        cursor.close()
+    return jobs
+
+
+def retry_job(job_id: int) -> None:
+    """Put a failed job back in the queue, keeping its checkpoint"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE ingestion_jobs SET status = 'queued', attempts = 0, finished_at = NULL, retry_at = NULL
+            WHERE id = %s AND status = 'failed'
+            """,
+            (job_id,),
+        )
+        conn.commit()
+        cursor.close()
+    _wakeup.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run knowledge-base ingestion workers outside the Streamlit server")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS)
+    args = parser.parse_args()
+    start_workers(args.workers)
+    try:
+        _stop.wait()
+    except KeyboardInterrupt:
+        stop_workers()
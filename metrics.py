@@ -0,0 +1,223 @@
+import bisect
+import collections
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from phi.utils.log import logger
+
+# Upper bounds, in seconds, of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Port of the Prometheus text endpoint, served at /metrics by every server process; off unless set (e.g. 9464).
+# The endpoint has no authentication and reports usernames, so it listens on loopback unless METRICS_HOST
+# names another address, e.g. one reachable only by the Prometheus server
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_NAMESPACE = "prawata"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, Labels], "Histogram"] = {}
+_errors: Dict[Tuple[str, Labels], int] = collections.Counter()
+# (user, model, kind) -> tokens, kind being "prompt" or "completion"
+_tokens: Dict[Tuple[str, str, str], int] = collections.Counter()
+# User whose request the current thread is handling, set by app.py on every rerun
+_current_user: contextvars.ContextVar = contextvars.ContextVar("metrics_user", default="")
+_server: Optional[ThreadingHTTPServer] = None
+_server_tried = False
+
+
+class Histogram:
+    """Counts of observations per latency bucket, with their sum"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """Estimate, interpolating linearly within the bucket the quantile falls in"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+
+def observe(stage: str, seconds: float, **labels: Any) -> None:
+    """Record one duration of a stage, e.g. observe("llm_call", 1.2, model="gpt-4")"""
+    key = (stage, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+@contextlib.contextmanager
+def span(stage: str, **labels: Any) -> Iterator[None]:
+    """Time the enclosed block as one observation of `stage`; failures are also counted per stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        with _lock:
+            _errors[(stage, _labels(labels))] += 1
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, **labels)
+
+
+def timed(stage: str, **labels: Any) -> Callable:
+    """Decorator timing every call of a function as a span of `stage`"""
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(stage, **labels):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_user(user: Optional[str]) -> None:
+    """Attribute the tokens used by the current thread from now on to `user`"""
+    _current_user.set(user or "")
+
+
+def add_tokens(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int], user: Optional[str] = None) -> None:
+    user = _current_user.get() if user is None else user
+    with _lock:
+        if prompt_tokens:
+            _tokens[(user or "-", model, "prompt")] += prompt_tokens
+        if completion_tokens:
+            _tokens[(user or "-", model, "completion")] += completion_tokens
+
+
+def get_stage_summary() -> List[dict]:
+    """Count, mean and estimated percentiles per stage and labels, slowest total first"""
+    with _lock:
+        snapshot = [(stage, labels, histogram.count, histogram.sum, [histogram.quantile(q) for q in (0.5, 0.95, 0.99)],
+                     _errors.get((stage, labels), 0)) for (stage, labels), histogram in _histograms.items()]
+    rows = []
+    for stage, labels, count, total, (p50, p95, p99), errors in snapshot:
+        rows.append({
+            "stage": stage,
+            "labels": ", ".join(f"{key}={value}" for key, value in labels),
+            "count": count,
+            "errors": errors,
+            "mean_ms": round(total / count * 1000, 1),
+            "p50_ms": round(p50 * 1000, 1),
+            "p95_ms": round(p95 * 1000, 1),
+            "p99_ms": round(p99 * 1000, 1),
+            "total_s": round(total, 2),
+        })
+    return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+
+def get_token_summary() -> List[dict]:
+    """Prompt and completion tokens per user and model"""
+    with _lock:
+        tokens = dict(_tokens)
+    rows: Dict[Tuple[str, str], dict] = {}
+    for (user, model, kind), count in tokens.items():
+        row = rows.setdefault((user, model), {"user": user, "model": model, "prompt": 0, "completion": 0})
+        row[kind] = count
+    return sorted(rows.values(), key=lambda row: row["prompt"] + row["completion"], reverse=True)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        histograms = [(stage, labels, list(histogram.counts), histogram.count, histogram.sum)
+                      for (stage, labels), histogram in sorted(_histograms.items())]
+        errors = sorted(_errors.items())
+        tokens = sorted(_tokens.items())
+    name = f"{METRICS_NAMESPACE}_stage_duration_seconds"
+    lines = [f"# HELP {name} Time spent per stage of a request", f"# TYPE {name} histogram"]
+    for stage, labels, counts, count, total in histograms:
+        base = _format_labels((("stage", stage),) + labels)
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{base},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{base}}} {total}")
+        lines.append(f"{name}_count{{{base}}} {count}")
+    name = f"{METRICS_NAMESPACE}_stage_errors_total"
+    lines += [f"# HELP {name} Stage executions that raised", f"# TYPE {name} counter"]
+    for (stage, labels), count in errors:
+        lines.append(f"{name}{{{_format_labels((('stage', stage),) + labels)}}} {count}")
+    name = f"{METRICS_NAMESPACE}_llm_tokens_total"
+    lines += [f"# HELP {name} Tokens used per user and model", f"# TYPE {name} counter"]
+    for (user, model, kind), count in tokens:
+        lines.append(f"{name}{{{_format_labels((('user', user), ('model', model), ('kind', kind)))}}} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on `host`:`port` from a daemon thread; only the first call in a process tries"""
+    global _server, _server_tried
+    with _lock:
+        if _server_tried or not port:
+            return _server
+        _server_tried = True
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            # E.g. another server process on this host already serves the port
+            logger.warning(f"Metrics endpoint not started on port {port}: {e}")
+            return None
+        _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return _server
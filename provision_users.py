@@ -0,0 +1,226 @@
+""" Bulk user provisioning from a CSV or JSONL file.
+
+Each row has `username` and `password` (or an existing bcrypt `password_hash`), and optionally `role`
+("admin" or "user", default "user"), `email` and `tenants` (knowledge-base tenants, separated by ";" in CSV or a
+list in JSONL). Passwords are hashed across a process pool, then all users are loaded with COPY and one upsert
+in a single transaction. Re-running with the same file is safe: existing users keep their password and only get
+their role, email and tenants updated, unless --reset-passwords is given.
+
+    python provision_users.py users.csv --workers 8
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from db_config import db_connection, init_db
+from tenants import validate_tenant
+
+ROLES = ("admin", "user")
+# bcrypt cost factor, the bcrypt library default; each step doubles the hashing time
+BCRYPT_ROUNDS = 12
+# Passwords hashed per task sent to a worker process
+HASH_CHUNK_SIZE = 64
+
+
+def hash_password(password, rounds=BCRYPT_ROUNDS):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _hash_passwords(passwords, rounds):
+    return [hash_password(password, rounds) for password in passwords]
+
+
+def read_users(path):
+    """ Rows of a .csv file as dicts, or lines of a .jsonl file as text, with their line numbers.
+
+    JSONL lines are parsed by normalize_user, so a malformed line is reported with its number like any invalid row.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_number, line
+        else:
+            # Line 1 is the header
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                yield line_number, row
+
+
+def _text(row, key):
+    """ String field of a row, "" when missing; JSONL rows can hold any JSON type """
+    value = row.get(key)
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise ValueError(f"{key} must be a string")
+    return value
+
+
+def normalize_user(row):
+    """ Validated user dict from a CSV row or a JSONL line; raises ValueError for a row that cannot be provisioned """
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError as e:
+            raise ValueError(f"invalid JSON: {e}")
+        if not isinstance(row, dict):
+            raise ValueError("must be a JSON object")
+    username = _text(row, "username").strip()
+    if not username or len(username) > 50:
+        raise ValueError("username must be 1 to 50 characters")
+    role = _text(row, "role").strip() or "user"
+    if role not in ROLES:
+        raise ValueError(f"role must be one of {', '.join(ROLES)}")
+    password, password_hash = _text(row, "password") or None, _text(row, "password_hash") or None
+    if not password and not password_hash:
+        raise ValueError("password or password_hash is required")
+    tenants = row.get("tenants") or []
+    if isinstance(tenants, str):
+        tenants = [tenant.strip() for tenant in tenants.split(";") if tenant.strip()]
+    elif not isinstance(tenants, list):
+        raise ValueError("tenants must be a list")
+    return {
+        "username": username,
+        "password": password,
+        "password_hash": password_hash,
+        "role": role,
+        "email": _text(row, "email").strip() or None,
+        "tenants": sorted({validate_tenant(tenant) for tenant in tenants}),
+    }
+
+
+def hash_passwords(passwords, workers=None, rounds=BCRYPT_ROUNDS):
+    """ bcrypt hashes of `passwords`, in order, computed across `workers` processes """
+    if not passwords:
+        return []
+    chunks = [passwords[i:i + HASH_CHUNK_SIZE] for i in range(0, len(passwords), HASH_CHUNK_SIZE)]
+    if workers == 1 or len(chunks) == 1:
+        return [hashed for chunk in chunks for hashed in _hash_passwords(chunk, rounds)]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        hashed_chunks = pool.map(_hash_passwords, chunks, [rounds] * len(chunks))
+        return [hashed for chunk in hashed_chunks for hashed in chunk]
+
+
+def _existing_usernames(cursor, usernames):
+    cursor.execute("SELECT username FROM users WHERE username = ANY(%s)", (list(usernames),))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')", buffer)
+
+
+def provision(users, workers=None, rounds=BCRYPT_ROUNDS, reset_passwords=False):
+    """ Create or update `users` (dicts as returned by normalize_user) in one transaction; returns counters """
+    # The last row wins when a username appears more than once
+    users = list({user["username"]: user for user in users}.values())
+    stats = {"rows": len(users), "hashed": 0, "inserted": 0, "updated": 0}
+    started = time.perf_counter()
+    existing = set()
+    if not reset_passwords:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            existing = _existing_usernames(cursor, (user["username"] for user in users))
+            cursor.close()
+    # Existing users keep their password, so re-runs skip the expensive part; a password_hash given for them is
+    # ignored too, and staged as NULL below
+    to_hash = [user for user in users if not user["password_hash"] and user["username"] not in existing]
+    hash_started = time.perf_counter()
+    for user, password_hash in zip(to_hash, hash_passwords([user["password"] for user in to_hash], workers, rounds)):
+        user["password_hash"] = password_hash
+    stats["hashed"] = len(to_hash)
+    stats["hash_seconds"] = time.perf_counter() - hash_started
+
+    # Hashing happens before the transaction, so no connection is held open while it runs
+    load_started = time.perf_counter()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE provision_users_stage (
+                username TEXT NOT NULL, password_hash TEXT, role TEXT NOT NULL, email TEXT
+            ) ON COMMIT DROP
+        """)
+        _copy_rows(cursor, "provision_users_stage", ("username", "password_hash", "role", "email"),
+                   ((user["username"], None if user["username"] in existing else user["password_hash"], user["role"], user["email"])
+                    for user in users))
+        # password_hash is NULL for existing users whose password is kept
+        cursor.execute("""
+            INSERT INTO users (username, password_hash, role, email)
+            SELECT username, password_hash, role, email FROM provision_users_stage
+            ON CONFLICT (username) DO UPDATE SET
+                password_hash = COALESCE(EXCLUDED.password_hash, users.password_hash),
+                role = EXCLUDED.role,
+                email = COALESCE(EXCLUDED.email, users.email),
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING (xmax = 0)
+        """)
+        inserted = sum(1 for (was_inserted,) in cursor.fetchall() if was_inserted)
+        stats["inserted"], stats["updated"] = inserted, len(users) - inserted
+
+        with_tenants = [user for user in users if user["tenants"]]
+        if with_tenants:
+            cursor.execute("""
+                CREATE TEMP TABLE provision_tenants_stage (username TEXT NOT NULL, tenant TEXT NOT NULL) ON COMMIT DROP
+            """)
+            _copy_rows(cursor, "provision_tenants_stage", ("username", "tenant"),
+                       ((user["username"], tenant) for user in with_tenants for tenant in user["tenants"]))
+            # Replace the tenants of the listed users, like set_user_tenants does
+            cursor.execute("""
+                DELETE FROM user_tenants WHERE user_id IN (
+                    SELECT u.id FROM users u JOIN provision_tenants_stage s ON s.username = u.username
+                )
+            """)
+            cursor.execute("""
+                INSERT INTO user_tenants (user_id, tenant)
+                SELECT DISTINCT u.id, s.tenant FROM provision_tenants_stage s JOIN users u ON u.username = s.username
+            """)
+        conn.commit()
+        cursor.close()
+    stats["load_seconds"] = time.perf_counter() - load_started
+    stats["total_seconds"] = time.perf_counter() - started
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="users .csv or .jsonl file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes hashing passwords")
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS, help="bcrypt cost factor")
+    parser.add_argument("--reset-passwords", action="store_true", help="also overwrite the password of existing users")
+    args = parser.parse_args()
+
+    users, errors = [], []
+    for line_number, row in read_users(args.path):
+        try:
+            users.append(normalize_user(row))
+        except ValueError as e:
+            errors.append(f"line {line_number}: {e}")
+    if errors:
+        # Nothing is written unless every row is valid
+        parser.exit(1, "\n".join(errors[:20] + ([f"... {len(errors) - 20} more"] if len(errors) > 20 else [])) + "\n")
+
+    init_db()
+    stats = provision(users, args.workers, args.rounds, args.reset_passwords)
+    print(f"{stats['rows']} users: {stats['inserted']} created, {stats['updated']} updated")
+    if stats["hashed"]:
+        print(f"hashed {stats['hashed']} passwords in {stats['hash_seconds']:.1f}s "
+              f"({stats['hashed'] / stats['hash_seconds']:.0f} rows/s, {args.workers} workers)")
+    print(f"loaded in {stats['load_seconds']:.2f}s ({stats['rows'] / max(stats['load_seconds'], 1e-9):.0f} rows/s), "
+          f"{stats['rows'] / stats['total_seconds']:.0f} rows/s overall")
+
+
+if __name__ == "__main__":
+    main()
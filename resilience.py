@@ -0,0 +1,301 @@
+import collections
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, Optional
+
+from phi.utils.log import logger
+
+# Seconds an LLM request may take from the first attempt until a response starts, retries included
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+# Pause before retry n is random between 0 and min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2**n), within the deadline
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_CAP = 4.0
+# Send a second, identical request when the first has not responded within this percentile (e.g. 0.95) of
+# recent response times, and use whichever responds first; 0 disables hedging
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+HEDGE_WORKERS = 16
+# Consecutive upstream failures that open the breaker, and seconds before it lets one trial request through
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+_registry_lock = threading.Lock()
+_breakers: Dict[str, "CircuitBreaker"] = {}
+_policies: Dict[str, "ResiliencePolicy"] = {}
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+# The one error the UI handles: the upstream failed and the policy gave up (deadline, attempts, breaker, or a
+# stream that broke off); the original error is its __cause__
+class LLMUnavailable(ConnectionError):
+    pass
+
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def status_code_of(error: BaseException) -> Optional[int]:
+    """HTTP status of an error raised by requests, httpx or the openai client, if it carries one"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error is the upstream's fault (connection, timeout, 429, 5xx) rather than the request's"""
+    status = status_code_of(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # requests, httpx and openai connection and timeout errors do not all derive from the builtin ones
+    return any(name in type(error).__name__ for name in ("Connection", "Timeout", "Transport", "ReadError", "ProtocolError"))
+
+
+class CircuitBreaker:
+    """Fails calls fast while an upstream is failing.
+
+    Closed: calls go through. After `failure_threshold` consecutive upstream failures it opens and rejects calls
+    for `reset_seconds`, then half-opens: one trial call goes through, and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> None:
+        """Raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "closed":
+                return
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return
+        _count("breaker_rejections")
+        raise CircuitOpenError(f"Circuit breaker {self.name} is {self.state}; the upstream is failing")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"Circuit breaker {self.name} closed")
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                if self.state == "closed":
+                    _count("breaker_opened")
+                logger.warning(f"Circuit breaker {self.name} opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures}
+
+
+class LatencyTracker:
+    """Response times of the most recent successful calls"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: Deque[float] = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+def _discard(future) -> None:
+    """Release the response of a hedged request that lost the race"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), "close", None)
+    if callable(close):
+        close()
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _registry_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+    return _hedge_pool
+
+
+class ResiliencePolicy:
+    """Deadline, retries, hedging and circuit breaking around calls to one upstream.
+
+    `call(request)` calls `request(timeout)`, where `timeout` is the seconds left until the deadline, and returns
+    its result. For streamed responses the result is returned once the response starts; the read timeout of
+    the client bounds stalls after that.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        breaker: CircuitBreaker,
+        deadline: float = LLM_DEADLINE,
+        max_attempts: int = LLM_MAX_ATTEMPTS,
+        hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+    ):
+        self.name = name
+        self.breaker = breaker
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker()
+
+    def _timed(self, request: Callable[[float], Any], deadline_at: float) -> Any:
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{self.name}: no time left for the request")
+        started = time.monotonic()
+        result = request(remaining)
+        self.latencies.add(time.monotonic() - started)
+        return result
+
+    def _attempt(self, request: Callable[[float], Any], deadline_at: float) -> Any:
+        hedge_after = None
+        if self.hedge_percentile and len(self.latencies) >= HEDGE_MIN_SAMPLES:
+            hedge_after = self.latencies.percentile(self.hedge_percentile)
+        if hedge_after is None or hedge_after >= deadline_at - time.monotonic():
+            return self._timed(request, deadline_at)
+
+        pool = _get_hedge_pool()
+        first = pool.submit(self._timed, request, deadline_at)
+        done, _ = wait([first], timeout=hedge_after)
+        if done:
+            return first.result()
+        _count("hedged_requests")
+        second = pool.submit(self._timed, request, deadline_at)
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        _count("hedge_wins")
+                    for loser in pending:
+                        loser.add_done_callback(_discard)
+                    return future.result()
+                error = future.exception()
+        for loser in pending:
+            loser.add_done_callback(_discard)
+        raise error or DeadlineExceeded(f"{self.name}: deadline of {self.deadline}s exceeded")
+
+    def call(self, request: Callable[[float], Any]) -> Any:
+        deadline_at = time.monotonic() + self.deadline
+        _count("calls")
+        for attempt in range(self.max_attempts):
+            self.breaker.allow()
+            try:
+                result = self._attempt(request, deadline_at)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The request itself is wrong; the upstream answered, so it is healthy
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                backoff = random.uniform(0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * 2 ** attempt))
+                out_of_time = time.monotonic() + backoff >= deadline_at
+                if out_of_time or attempt + 1 >= self.max_attempts:
+                    _count("deadline_exceeded" if out_of_time else "attempts_exhausted")
+                    raise LLMUnavailable(f"{self.name}: {e}") from e
+                logger.warning(f"{self.name}: attempt {attempt + 1} failed ({e}), retrying in {backoff:.1f}s")
+                _count("retries")
+                time.sleep(backoff)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def guard_stream(self, chunks: Iterable[Any]) -> Iterator[Any]:
+        """Yield from a streamed response `call` returned, raising LLMUnavailable if it breaks off.
+
+        The upstream accepted the request once the stream started, so any error reading it is the upstream's.
+        """
+        try:
+            yield from chunks
+        except Exception as e:
+            self.breaker.record_failure()
+            _count("streams_broken")
+            raise LLMUnavailable(f"{self.name}: the response broke off ({e})") from e
+
+    def snapshot(self) -> dict:
+        p50, p95 = self.latencies.percentile(0.5), self.latencies.percentile(0.95)
+        return {
+            "breaker": self.breaker.snapshot(),
+            "response_p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "response_p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "hedge_percentile": self.hedge_percentile or None,
+        }
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def get_policy(name: str, breaker: str = "openai") -> ResiliencePolicy:
+    """Process-wide policy for one kind of call; policies naming the same breaker share its state"""
+    breaker = get_breaker(breaker)
+    with _registry_lock:
+        if name not in _policies:
+            _policies[name] = ResiliencePolicy(name, breaker)
+        return _policies[name]
+
+
+def get_resilience_stats() -> dict:
+    """Counters of calls, retries, hedges, deadline misses and breaker rejections, with each policy's state"""
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+    with _registry_lock:
+        policies = list(_policies.values())
+    stats["policies"] = {policy.name: policy.snapshot() for policy in policies}
+    return stats
@@ -0,0 +1,92 @@
+import collections
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterable, Tuple
+
+from phi.utils.log import logger
+
+from metrics import observe
+
+# Upper bound on placeholder updates per second while an answer streams in
+STREAM_FPS = float(os.getenv("STREAM_FPS", "10"))
+# Shown at the end of a partial answer so the user sees it is still being written
+STREAM_CURSOR = "▌"
+
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+
+
+@dataclass
+class StreamStats:
+    """What rendering one streamed answer cost"""
+
+    deltas: int = 0
+    renders: int = 0
+    # Markdown sent to the browser: every render re-sends the whole answer so far
+    bytes_sent: int = 0
+    render_seconds: float = 0.0
+    first_token_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+
+def render_stream(deltas: Iterable[str], placeholder, fps: float = STREAM_FPS) -> Tuple[str, StreamStats]:
+    """Stream text deltas into one placeholder (e.g. st.empty()) and return the full text.
+
+    Deltas arriving within 1 / `fps` seconds of the last render are only buffered, so a long answer costs a
+    bounded number of re-renders instead of one per token. The final text is always rendered.
+    """
+    stats = StreamStats()
+    interval = 1.0 / fps if fps > 0 else 0.0
+    started = time.perf_counter()
+    last_render = 0.0
+    parts = []
+
+    def render(body: str) -> None:
+        render_started = time.perf_counter()
+        placeholder.markdown(body)
+        stats.render_seconds += time.perf_counter() - render_started
+        stats.renders += 1
+        stats.bytes_sent += len(body.encode())
+
+    for delta in deltas:
+        if not delta:
+            continue
+        if not parts:
+            stats.first_token_seconds = time.perf_counter() - started
+        parts.append(delta)
+        stats.deltas += 1
+        now = time.perf_counter()
+        if now - last_render >= interval:
+            render("".join(parts) + STREAM_CURSOR)
+            last_render = time.perf_counter()
+
+    response = "".join(parts)
+    render(response)
+    stats.total_seconds = time.perf_counter() - started
+    _record(stats)
+    if stats.deltas:
+        observe("answer_first_token", stats.first_token_seconds)
+    observe("answer_total", stats.total_seconds)
+    logger.debug(f"Streamed answer: {asdict(stats)}")
+    return response, stats
+
+
+def _record(stats: StreamStats) -> None:
+    with _stats_lock:
+        _stats["answers"] += 1
+        for key, value in asdict(stats).items():
+            _stats[key] += value
+
+
+def get_streaming_stats() -> dict:
+    """Process-wide totals of streamed answers, with averages per answer"""
+    with _stats_lock:
+        stats = dict(_stats)
+    answers = stats.get("answers", 0)
+    if answers:
+        stats["renders_per_answer"] = round(stats["renders"] / answers, 1)
+        stats["kb_sent_per_answer"] = round(stats["bytes_sent"] / answers / 1024, 1)
+        stats["render_ms_per_answer"] = round(stats["render_seconds"] * 1000 / answers, 1)
+    return stats
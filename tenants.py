@@ -0,0 +1,90 @@
+import re
+
+from db_config import db_connection
+
+# Tenant whose documents live in the original, unsuffixed collection; users without assignments see only it
+DEFAULT_TENANT = "umum"
+KNOWLEDGE_COLLECTION = "auto_rag_documents_openai"
+
+# Collections are named KNOWLEDGE_COLLECTION_<tenant>; 32 characters keep that, and its primary key
+# <collection>_pkey, within Postgres's 63-character identifier limit (longer derived names are shortened by
+# vector_store.postgres_identifier)
+_TENANT_RE = re.compile(r"[a-z0-9_]{1,32}")
+# Suffixes of the staging and backup tables of vector_store.migrate_storage
+_RESERVED_SUFFIXES = ("old", "migrating")
+
+def _is_valid_tenant(tenant):
+    return (isinstance(tenant, str) and bool(_TENANT_RE.fullmatch(tenant))
+            and not any(tenant == suffix or tenant.endswith(f"_{suffix}") for suffix in _RESERVED_SUFFIXES))
+
+def validate_tenant(tenant):
+    """ Tenant names become part of table names, so only lower-case letters, digits and underscores are allowed """
+    if not _is_valid_tenant(tenant):
+        raise ValueError(f"Nama tenant tidak valid: {tenant!r}")
+    return tenant
+
+def collection_name(tenant):
+    """ Knowledge-base collection (table) holding a tenant's documents """
+    validate_tenant(tenant)
+    return KNOWLEDGE_COLLECTION if tenant == DEFAULT_TENANT else f"{KNOWLEDGE_COLLECTION}_{tenant}"
+
+def get_user_tenants(user_id):
+    """ Tenants whose documents a user may search; the default tenant when none are assigned """
+    if user_id is None:
+        return [DEFAULT_TENANT]
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT tenant FROM user_tenants WHERE user_id = %s ORDER BY tenant", (int(user_id),))
+        tenants = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        cursor.close()
+    return tenants or [DEFAULT_TENANT]
+
+def set_user_tenants(user_id, tenants):
+    """ Replace the tenants a user is entitled to """
+    tenants = sorted({validate_tenant(tenant) for tenant in tenants})
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM user_tenants WHERE user_id = %s", (int(user_id),))
+        cursor.execute(
+            "INSERT INTO user_tenants (user_id, tenant) SELECT %s, unnest(%s::text[])",
+            (int(user_id), tenants)
+        )
+        conn.commit()
+        cursor.close()
+
+def list_tenants():
+    """ Every tenant that has users assigned or a knowledge-base collection, plus the default tenant """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT tenant FROM user_tenants
+            UNION
+            SELECT substring(table_name FROM %s) FROM information_schema.tables
+            WHERE table_schema = 'ai' AND table_name LIKE %s
+            """,
+            (f"^{KNOWLEDGE_COLLECTION}_(.+)$", f"{KNOWLEDGE_COLLECTION}\\_%")
+        )
+        tenants = {row[0] for row in cursor.fetchall() if _is_valid_tenant(row[0])}
+        conn.commit()
+        cursor.close()
+    return [DEFAULT_TENANT] + sorted(tenants - {DEFAULT_TENANT})
+
+def list_user_tenants():
+    """ Every user with the tenants assigned to them, for the admin page """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT u.id, u.username, COALESCE(array_agg(t.tenant ORDER BY t.tenant) FILTER (WHERE t.tenant IS NOT NULL), '{}')
+            FROM users u
+            LEFT JOIN user_tenants t ON t.user_id = u.id
+            GROUP BY u.id, u.username
+            ORDER BY u.username
+            """
+        )
+        users = [{"user_id": user_id, "username": username, "tenants": tenants} for user_id, username, tenants in cursor.fetchall()]
+        conn.commit()
+        cursor.close()
+    return users
@@ -1,36 +1,249 @@
+import collections
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
 import streamlit as st
+import streamlit.components.v1 as components
 import bcrypt
 import psycopg2
 from psycopg2 import sql
-from db_config import get_connection
+from phi.utils.log import logger
+from db_config import db_connection
+from metrics import timed
+
+# Key signing session tokens; set the same value on every server process. Without it each process uses its own
+# random key, so a refresh routed to another process, or any refresh after a restart, logs the user out
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+# Cookie holding the session token in the browser, so it never appears in URLs, history or logs
+SESSION_COOKIE = "prawata_session"
+# Hours a session token stays valid after login
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "8"))
+# Seconds a validated token is trusted from the in-process cache before it is looked up again.
+# A logout in another server process takes up to this long to reach this one.
+SESSION_CACHE_SECONDS = 60
+SESSION_CACHE_SIZE = 10000
+# Expired rows are deleted from `sessions` by a login at most once per this many seconds
+SESSION_SWEEP_INTERVAL = 300
+# bcrypt checks running at once, and logins allowed to wait for one, before new logins are turned away
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", "2"))
+AUTH_QUEUE_LIMIT = int(os.getenv("AUTH_QUEUE_LIMIT", "32"))
+# Seconds a login waits for its bcrypt check
+AUTH_TIMEOUT = 10
+
+if not SESSION_SECRET:
+    logger.warning(
+        "SESSION_SECRET is not set: session tokens are signed with a random per-process key and only resume on the "
+        "process that issued them until it restarts. Set SESSION_SECRET to the same secret on every server process."
+    )
+_signing_key = SESSION_SECRET.encode() or secrets.token_bytes(32)
+_bcrypt_pool = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="bcrypt")
+_bcrypt_slots = threading.BoundedSemaphore(AUTH_WORKERS + AUTH_QUEUE_LIMIT)
+# token -> (trusted until, user_id, username, role), least recently used first
+_session_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_last_sweep = 0.0
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+
+class LoginBusy(Exception):
+    """ Raised when too many logins are waiting for a password check """
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _sign(value):
+    return hmac.new(_signing_key, value.encode(), hashlib.sha256).hexdigest()[:32]
+
+def _verified(token):
+    """ Whether a token carries a valid signature, checked before any database lookup """
+    value, _, signature = (token or "").partition(".")
+    return bool(value and signature) and hmac.compare_digest(_sign(value), signature)
+
+def _token_key(token):
+    # Only a digest is stored, so the sessions table cannot be used to take over sessions
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def check_password(password, password_hash):
+    """ bcrypt check on the bounded worker pool, so a burst of logins cannot use up the CPU of chat reruns """
+    if not _bcrypt_slots.acquire(blocking=False):
+        _count("logins_rejected_busy")
+        raise LoginBusy("Too many logins in progress")
+    try:
+        future = _bcrypt_pool.submit(bcrypt.checkpw, password.encode(), password_hash.encode())
+    except BaseException:
+        _bcrypt_slots.release()
+        raise
+    # The slot is held until the check finishes or is cancelled, not just until this login stops waiting,
+    # so checks that timed out still count against the limit
+    future.add_done_callback(lambda _: _bcrypt_slots.release())
+    try:
+        return future.result(timeout=AUTH_TIMEOUT)
+    except FutureTimeoutError:
+        # Drops the check if it has not started yet
+        future.cancel()
+        _count("logins_rejected_busy")
+        raise LoginBusy("Password check timed out")
+
+def _sweep_expired_sessions(cursor):
+    global _last_sweep
+    now = time.monotonic()
+    if now - _last_sweep < SESSION_SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+    cursor.execute("DELETE FROM sessions WHERE expires_at <= CURRENT_TIMESTAMP")
+    _count("sessions_swept", cursor.rowcount)
+
+def create_session(user_id):
+    """ Issue a signed session token for the user, valid for SESSION_TTL_HOURS """
+    value = secrets.token_urlsafe(32)
+    token = f"{value}.{_sign(value)}"
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        _sweep_expired_sessions(cursor)
+        cursor.execute(
+            """
+            INSERT INTO sessions (user_id, session_token, expires_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 hour')
+            """,
+            (user_id, _token_key(token), SESSION_TTL_HOURS),
+        )
+        conn.commit()
+        cursor.close()
+    return token
+
+@timed("session_lookup")
+def _lookup_session(token):
+    """ (user_id, username, role) of a live session, from the in-process cache or the sessions table """
+    with _cache_lock:
+        cached = _session_cache.get(token)
+        if cached and cached[0] > time.monotonic():
+            _session_cache.move_to_end(token)
+            _count("resumes_cached")
+            return cached[1:]
+        _session_cache.pop(token, None)
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT s.user_id, u.username, u.role, EXTRACT(EPOCH FROM s.expires_at - CURRENT_TIMESTAMP)
+            FROM sessions s
+            JOIN users u ON u.id = s.user_id
+            WHERE s.session_token = %s AND s.expires_at > CURRENT_TIMESTAMP
+            """,
+            (_token_key(token),),
+        )
+        row = cursor.fetchone()
+        cursor.close()
+    if row is None:
+        return None
+    _count("resumes_db")
+    user_id, username, role, seconds_left = row
+    trusted_until = time.monotonic() + min(SESSION_CACHE_SECONDS, float(seconds_left))
+    with _cache_lock:
+        _session_cache[token] = (trusted_until, user_id, username, role)
+        while len(_session_cache) > SESSION_CACHE_SIZE:
+            _session_cache.popitem(last=False)
+    return user_id, username, role
+
+def _start_session(user_id, username, role, token):
+    st.session_state['username'] = username
+    st.session_state['role'] = role
+    st.session_state['logged_in'] = True
+    st.session_state['user_id'] = user_id
+    st.session_state['session_token'] = token
 
 # Function to handle login
 
+@timed("login")
 def login(username, password):
-    conn = get_connection()
-    cursor = conn.cursor()
-    query = sql.SQL("""
-        SELECT id, username, password_hash, role
-        FROM users
-        WHERE username = %s
-    """)
-    cursor.execute(query, (username,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
-
-    if user and bcrypt.checkpw(password.encode(), user[2].encode()):
-        st.session_state['username'] = user[1]
-        st.session_state['role'] = user[3]
-        st.session_state['logged_in'] = True
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        query = sql.SQL("""
+            SELECT id, username, password_hash, role
+            FROM users
+            WHERE username = %s
+        """)
+        cursor.execute(query, (username,))
+        user = cursor.fetchone()
+        cursor.close()
+
+    if user and check_password(password, user[2]):
+        _count("logins")
+        _start_session(user[0], user[1], user[3], create_session(user[0]))
         return user[0]  # Return user_id
+    _count("login_failures")
     return None
 
+def resume_session(token):
+    """ Log the browser back in from a session token, e.g. after a refresh; returns the user_id or None """
+    if not _verified(token):
+        return None
+    try:
+        session = _lookup_session(token)
+    except psycopg2.Error as e:
+        logger.warning(f"Could not resume session: {e}")
+        return None
+    if session is None:
+        return None
+    user_id, username, role = session
+    _start_session(user_id, username, role, token)
+    return user_id
+
+def resume_from_cookie():
+    """ Log the browser back in from its session cookie after a refresh; returns the user_id or None """
+    token = st.context.cookies.get(SESSION_COOKIE)
+    # A token that failed, or was logged out, is not looked up again on every rerun
+    if not token or token == st.session_state.get('rejected_session_token'):
+        return None
+    user_id = resume_session(token)
+    if user_id is None:
+        st.session_state['rejected_session_token'] = token
+    return user_id
+
+def sync_session_cookie():
+    """ Set the session cookie after a login and clear it after a logout.
+
+    Streamlit cannot set cookies from the server, so a hidden component sets it from the page. st.context.cookies
+    holds the cookies sent when the page was loaded, so until the next load the script is rendered on each rerun.
+    """
+    token = st.session_state.get('session_token')
+    if st.context.cookies.get(SESSION_COOKIE) == token:
+        return
+    if token:
+        cookie = f"{SESSION_COOKIE}={token}; path=/; max-age={int(SESSION_TTL_HOURS * 3600)}; SameSite=Strict"
+    else:
+        cookie = f"{SESSION_COOKIE}=; path=/; max-age=0; SameSite=Strict"
+    components.html(
+        "<script>"
+        f"window.parent.document.cookie = {json.dumps(cookie)} + (window.parent.location.protocol === 'https:' ? '; Secure' : '');"
+        "</script>",
+        height=0,
+    )
+
 # Function to handle logout
 def logout():
+    token = st.session_state.get('session_token')
+    if token:
+        st.session_state['rejected_session_token'] = token
+        with _cache_lock:
+            _session_cache.pop(token, None)
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM sessions WHERE session_token = %s", (_token_key(token),))
+            conn.commit()
+            cursor.close()
     st.session_state['logged_in'] = False
     st.session_state['username'] = None
     st.session_state['role'] = None
+    st.session_state['session_token'] = None
 
 # Function to check authentication status
 def is_authenticated():
@@ -40,3 +253,11 @@ def is_authenticated():
 def is_admin():
     return st.session_state.get('role') == 'admin'
 
+def get_auth_stats():
+    """ Login and session-resume counters with the size of the session cache """
+    with _stats_lock:
+        stats = dict(_stats)
+    with _cache_lock:
+        stats["cached_sessions"] = len(_session_cache)
+    stats["bcrypt_workers"] = AUTH_WORKERS
+    return stats
@@ -1,18 +1,14 @@
 import streamlit as st
-from phi.assistant import Assistant
-from phi.utils.log import logger
-import json
-from db_config import get_connection, DB_NAME, DB_USER, DB_HOST, DB_PORT
-from openai import OpenAI
-import psycopg2
+from db_config import db_connection, DB_NAME, DB_USER, DB_HOST, DB_PORT
 import os
 import time
-from assistant import get_auto_rag_assistant
-from db_chat.utils.chat_functions import run_chat_sequence, get_final_system_prompt, prepare_sidebar_data
-from db_chat.utils.database_functions import get_database_info, get_schema_names, ask_postgres_database
+from chat_history import append_messages
+from chat_view import clear_window, open_window, show_window
+from streaming import render_stream
+from resilience import LLMUnavailable
 
-# Initialize OpenAI client
-client = OpenAI()
+# phi/OpenAI (document chat) and db_chat (database chat) are imported inside the page
+# that uses them, so only the selected page pays for its imports.
 
 # Constants
 MAX_TOKENS_ALLOWED = 4000
@@ -27,44 +23,40 @@ db_credentials = {
     "port": DB_PORT
 }
 
-def load_chat_from_db(user_id: str, run_id: str, chat_type: str):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT messages FROM user_chat_sessions WHERE user_id = %s AND run_id = %s AND %s = ANY(chat_type)",
-        (user_id, run_id, chat_type)
-    )
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return json.loads(result[0]) if result else None
-
 def save_chat_to_db(user_id: str, run_id: str, messages: list, chat_type: str):
-    conn = get_connection()
-    cursor = conn.cursor()
-    messages_json = json.dumps(messages)
-    cursor.execute(
-        """
-        INSERT INTO user_chat_sessions (user_id, run_id, messages, chat_type)
-        VALUES (%s, %s, %s, ARRAY[%s])
-        ON CONFLICT (user_id, run_id)
-        DO UPDATE SET messages = %s, chat_type = array_append(user_chat_sessions.chat_type, %s)
-        """,
-        (user_id, run_id, messages_json, chat_type, messages_json, chat_type)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    """ Append new messages to the stored conversation """
+    append_messages(user_id, run_id, messages, chat_type)
 
 def clear_chat_history():
-    if "document_chat_history" in st.session_state:
-        st.session_state["document_chat_history"] = []
-    if "db_chat_history" in st.session_state:
-        st.session_state["db_chat_history"] = []
+    # Dropped rather than emptied, so the next rerun starts over with the greeting and the system prompt
+    st.session_state.pop("document_chat_history", None)
+    st.session_state.pop("db_chat_history", None)
+    clear_window("document_chat_window")
+    clear_window("db_chat_window")
 
 def count_tokens(text):
     return len(text.split())
 
+def trim_to_token_budget(chat_history):
+    """ Copy of the history without its oldest messages, keeping the system prompt and the last one, until it fits MAX_TOKENS_ALLOWED """
+    trimmed = list(chat_history)
+    total_tokens = sum(count_tokens(message["content"]) for message in trimmed)
+    prompt_tokens = count_tokens(trimmed[-1]["content"])
+    while len(trimmed) > 2 and total_tokens + prompt_tokens + TOKEN_BUFFER > MAX_TOKENS_ALLOWED:
+        removed_message = trimmed.pop(1)  # Keep the system message
+        total_tokens -= count_tokens(removed_message["content"])
+    return trimmed
+
+def render_document_message(message):
+    with st.chat_message(message["role"]):
+        st.write(message["content"])
+
+def render_database_message(message):
+    if message["role"] == "user":
+        st.chat_message("user", avatar='🧑‍💻').write(message["content"])
+    elif message["role"] == "assistant":
+        st.chat_message("assistant", avatar='🤖').write(message["content"])
+
 def save_conversation(chat_history, chat_type):
     os.makedirs("conversations", exist_ok=True)
     filename = f"conversations/{chat_type}_conversation_{st.session_state.get('user_id', 'anonymous')}_{int(time.time())}.txt"
@@ -74,20 +66,30 @@ def save_conversation(chat_history, chat_type):
     return filename
 
 def show_document_chat():
-    auto_rag_assistant: Assistant = get_auto_rag_assistant(
-        user_id=str(st.session_state.get("user_id")),  # Convert user_id to string
-        run_id=st.session_state.get("document_chat_run_id")
-    )
+    from phi.assistant import Assistant
+    from assistant import get_auto_rag_assistant
+    from answer_cache import run_with_answer_cache
+
+    # Reuse this user's Assistant across reruns; its heavy resources are shared process-wide
+    user_id = str(st.session_state.get("user_id"))  # Convert user_id to string
+    auto_rag_assistant: Assistant = st.session_state.get("document_chat_assistant")
+    if auto_rag_assistant is None or auto_rag_assistant.user_id != user_id:
+        auto_rag_assistant = get_auto_rag_assistant(
+            user_id=user_id,
+            run_id=st.session_state.get("document_chat_run_id")
+        )
+        st.session_state["document_chat_assistant"] = auto_rag_assistant
 
     if "document_chat_run_id" not in st.session_state:
         st.session_state["document_chat_run_id"] = auto_rag_assistant.create_run()
 
+    st.sidebar.toggle("Gunakan cache jawaban", value=False, key="use_answer_cache", help="Jawab pertanyaan yang mirip dengan jawaban sebelumnya")
+
     if "document_chat_history" not in st.session_state:
         st.session_state["document_chat_history"] = [{"role": "assistant", "content": "Halo, ada yang bisa saya bantu?"}]
 
-    for message in st.session_state["document_chat_history"]:
-        with st.chat_message(message["role"]):
-            st.write(message["content"])
+    # Only the last messages are rendered; older ones are shown on request
+    show_window("document_chat_window", st.session_state["document_chat_history"], render_document_message)
 
     if prompt := st.chat_input():
         st.session_state["document_chat_history"].append({"role": "user", "content": prompt})
@@ -95,22 +97,30 @@ def show_document_chat():
             st.write(prompt)
 
         with st.chat_message("assistant"):
-            response = ""
-            for chunk in auto_rag_assistant.run(prompt):
-                response += chunk
-                st.write(response)
+            use_answer_cache = st.session_state.get("use_answer_cache", False)
+            answer_stream = run_with_answer_cache(auto_rag_assistant, prompt) if use_answer_cache else auto_rag_assistant.run(prompt)
+            try:
+                # One placeholder updated at a bounded rate, instead of a new element per token
+                response, _ = render_stream(answer_stream, st.empty())
+            except LLMUnavailable as e:
+                # Deadline exceeded, circuit breaker open or the answer broke off: let the user ask again instead of waiting
+                st.session_state["document_chat_history"].pop()
+                st.error(f"Layanan AI sedang tidak tersedia, silakan coba lagi nanti. ({e})")
+                return
 
         st.session_state["document_chat_history"].append({"role": "assistant", "content": response})
-        save_chat_to_db(str(st.session_state["user_id"]), st.session_state["document_chat_run_id"], st.session_state["document_chat_history"], "document")
+        save_chat_to_db(user_id, st.session_state["document_chat_run_id"], st.session_state["document_chat_history"][-2:], "document")
 
 def show_database_chat():
+    from db_chat.utils.chat_functions import stream_chat_sequence, get_final_system_prompt, prepare_sidebar_data
+    from db_chat.utils.database_functions import get_database_info, get_schema_names
+
     st.title("🤖 Penelusuran Database Auditor")
 
     # Get database schema information
-    conn = get_connection()
-    schemas = get_schema_names(conn)
-    database_schema_dict = get_database_info(conn, schemas)
-    conn.close()
+    with db_connection() as conn:
+        schemas = get_schema_names(conn)
+        database_schema_dict = get_database_info(conn, schemas)
 
     # Prepare data for the sidebar dropdowns
     sidebar_data = prepare_sidebar_data(database_schema_dict)
@@ -134,42 +144,46 @@ def show_database_chat():
     user_id = str(st.session_state["user_id"])  # Convert user_id to string
     run_id = st.session_state.get("db_chat_run_id", "default_db_run")
 
-    # Load chat history from database
-    db_chat_history = load_chat_from_db(user_id, run_id, "database")
+    # Load the last messages from the database once per conversation; the system prompt is not stored, so keep the current one in front
+    db_chat_history = open_window("db_chat_window", user_id, run_id, "database")
     if db_chat_history:
-        st.session_state["db_chat_history"] = db_chat_history
+        st.session_state["db_chat_history"] = st.session_state["db_chat_history"][:1] + db_chat_history
 
     # Chat input and processing
     if (prompt := st.chat_input("apa yang anda ingin tahu?")) is not None:
-        st.session_state.db_chat_history.append({"role": "user", "content": prompt})
-        save_chat_to_db(user_id, run_id, st.session_state["db_chat_history"], "database")
+        user_message = {"role": "user", "content": prompt}
+        st.session_state.db_chat_history.append(user_message)
+        save_chat_to_db(user_id, run_id, [user_message], "database")
 
-        total_tokens = sum(count_tokens(message["content"]) for message in st.session_state["db_chat_history"])
-        while total_tokens + count_tokens(prompt) + TOKEN_BUFFER > MAX_TOKENS_ALLOWED:
-            removed_message = st.session_state["db_chat_history"].pop(1)  # Keep the system message
-            total_tokens -= count_tokens(removed_message["content"])
-
-    # Display chat messages
-    for message in st.session_state["db_chat_history"][1:]:
-        if message["role"] == "user":
-            st.chat_message("user", avatar='🧑‍💻').write(message["content"])
-        elif message["role"] == "assistant":
-            st.chat_message("assistant", avatar='🤖').write(message["content"])
+    # Display chat messages; only the last ones are rendered, older ones on request
+    show_window("db_chat_window", st.session_state["db_chat_history"][1:], render_database_message)
 
     # Generate and display AI response
     if st.session_state["db_chat_history"] and st.session_state["db_chat_history"][-1]["role"] != "assistant":
-        with st.spinner("⌛Connecting to AI model..."):
-            recent_messages = st.session_state["db_chat_history"][-MAX_MESSAGES_TO_OPENAI:]
-            new_message = run_chat_sequence(recent_messages, [], selected_tables, selected_schema)
-
+        with st.chat_message("assistant", avatar='🤖'):
+            placeholder = st.empty()
+            placeholder.markdown("⌛Connecting to AI model...")
+            # The oldest messages are left out of the request, not out of the history shown
+            context = trim_to_token_budget(st.session_state["db_chat_history"])
+            recent_messages = context[-MAX_MESSAGES_TO_OPENAI:]
+            try:
+                # The answer renders as it streams in. No functions are offered, so users cannot have
+                # generated SQL run against the database.
+                content, _ = render_stream(stream_chat_sequence(recent_messages, [], selected_tables, selected_schema), placeholder)
+            except LLMUnavailable as e:
+                # Deadline exceeded, circuit breaker open or the answer broke off; the question is answered on the next attempt
+                placeholder.error(f"Layanan AI sedang tidak tersedia, silakan coba lagi nanti. ({e})")
+                content = None
+
+        if content is not None:
+            new_message = {"role": "assistant", "content": content}
             st.session_state["db_chat_history"].append(new_message)
-            save_chat_to_db(user_id, run_id, st.session_state["db_chat_history"], "database")
-
-            st.chat_message("assistant", avatar='🤖').write(new_message["content"])
+            save_chat_to_db(user_id, run_id, [new_message], "database")
+            context.append(new_message)
 
         # Display token usage
         max_tokens = MAX_TOKENS_ALLOWED
-        current_tokens = sum(count_tokens(message["content"]) for message in st.session_state["db_chat_history"])
+        current_tokens = sum(count_tokens(message["content"]) for message in context)
         progress = min(1.0, max(0.0, current_tokens / max_tokens))
         st.progress(progress)
         st.write(f"Tokens Used: {current_tokens}/{max_tokens}")
@@ -0,0 +1,791 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from math import sqrt
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pgvector.sqlalchemy import HALFVEC, Vector
+from phi.document import Document
+from phi.utils.log import logger
+from phi.vectordb.distance import Distance
+from phi.vectordb.base import VectorDb
+from phi.vectordb.pgvector import PgVector2
+from phi.vectordb.pgvector.index import HNSW, Ivfflat
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import Column, Computed, Table
+from sqlalchemy.sql.expression import text
+from sqlalchemy.types import DateTime, String
+
+from metrics import timed
+
+# ANN index of the knowledge base: "hnsw", "ivfflat" or "none" (exact sequential scan)
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "hnsw")
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+# Candidates kept per HNSW search; must be at least the number of documents retrieved
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+# IVFFlat lists; 0 picks rows / 1000 (up to 1M rows) or sqrt(rows) when the index is built
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "0"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+# IVFFlat clusters are trained on existing rows, so it is not built on smaller tables; smaller tables are
+# also not worth rebuilding an index for
+INDEX_MIN_ROWS = 1000
+# Rebuild the index once the table has grown this many times past the row count it was built on
+INDEX_REBUILD_GROWTH = 2.0
+INDEX_MAINTENANCE_WORK_MEM = os.getenv("VECTOR_INDEX_MAINTENANCE_WORK_MEM", "512MB")
+
+# How embeddings are stored and searched: "vector" (float32), "halfvec" (float16, half the space) or "binary"
+# (float32 rows, searched through a binary-quantized index and re-ranked exactly)
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "vector")
+# Embedding dimensions; text-embedding-3 models can be shortened, e.g. to 512, at a small cost in recall
+VECTOR_DIMENSIONS = int(os.getenv("VECTOR_DIMENSIONS", "1536"))
+# Candidates fetched from the binary index and re-ranked with exact distances
+RERANK_CANDIDATES = int(os.getenv("VECTOR_RERANK_CANDIDATES", "40"))
+# Collections searched in parallel by RoutedVectorDb
+ROUTED_SEARCH_WORKERS = 8
+
+# How the knowledge base is searched: "hybrid" fuses full-text and vector rankings, "vector" uses similarity only
+RETRIEVAL_MODE = os.getenv("KNOWLEDGE_RETRIEVAL", "hybrid")
+# Text search configuration of the full-text column; "simple" keeps regulation numbers and account codes as written
+FULLTEXT_CONFIG = os.getenv("FULLTEXT_CONFIG", "simple")
+# Candidates taken from each ranking before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Reciprocal-rank fusion constant: a document scores the sum of 1 / (RRF_K + rank) over the rankings it appears in
+RRF_K = 60
+# Query words too common to be worth a full-text match
+FULLTEXT_STOPWORDS = (
+    "ada", "adalah", "akan", "apa", "apakah", "atau", "bagaimana", "berapa", "dalam", "dan", "dari", "dengan", "di",
+    "ini", "itu", "jelaskan", "juga", "ke", "kapan", "mengapa", "oleh", "pada", "saja", "sebagai", "siapa", "tentang",
+    "tersebut", "tidak", "untuk", "yang", "a", "and", "is", "of", "the", "what",
+)
+
+# Longer identifiers are silently truncated by Postgres, so derived table and index names are kept within it
+MAX_IDENTIFIER_LENGTH = 63
+
+STORAGE_MODES = ("vector", "halfvec", "binary")
+RETRIEVAL_MODES = ("vector", "hybrid")
+_DISTANCE_OPERATORS = {Distance.cosine: "<=>", Distance.l2: "<->", Distance.max_inner_product: "<#>"}
+_DISTANCE_OPS = {Distance.cosine: "cosine_ops", Distance.l2: "l2_ops", Distance.max_inner_product: "ip_ops"}
+# Full-text and metadata-filter indexes created with every collection, by name suffix
+_SEARCH_INDEXES = {
+    "content_tsv_idx": "USING gin (content_tsv)",
+    "name_idx": "(name)",
+    "url_idx": "((meta_data ->> 'url'))",
+    "created_at_idx": "(created_at)",
+}
+
+
+def get_index_config(kind: str = VECTOR_INDEX) -> Optional[Union[HNSW, Ivfflat]]:
+    """ANN index settings for the knowledge base, from the VECTOR_INDEX / HNSW_* / IVFFLAT_* settings"""
+    if kind == "hnsw":
+        return HNSW(m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH,
+                    configuration={"maintenance_work_mem": INDEX_MAINTENANCE_WORK_MEM})
+    if kind == "ivfflat":
+        return Ivfflat(lists=IVFFLAT_LISTS or 100, probes=IVFFLAT_PROBES, dynamic_lists=IVFFLAT_LISTS == 0,
+                       configuration={"maintenance_work_mem": INDEX_MAINTENANCE_WORK_MEM})
+    if kind == "none":
+        return None
+    raise ValueError(f"Unknown vector index type: {kind}")
+
+
+def postgres_identifier(name: str) -> str:
+    """`name`, or if it is too long for Postgres a prefix of it with a hash of the whole name, so it stays unique"""
+    if len(name) <= MAX_IDENTIFIER_LENGTH:
+        return name
+    digest = hashlib.md5(name.encode()).hexdigest()[:8]
+    return f"{name[:MAX_IDENTIFIER_LENGTH - len(digest) - 1]}_{digest}"
+
+
+def ivfflat_lists(rows: int) -> int:
+    return max(1, int(rows / 1000) if rows <= 1_000_000 else int(sqrt(rows)))
+
+
+def reciprocal_rank_fusion(rankings: List[list], k: int = RRF_K) -> List[Tuple[float, Any]]:
+    """Fuse rankings of rows with an `id` into (score, row) pairs, best first"""
+    scores: Dict[str, float] = {}
+    rows: Dict[str, Any] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row.id] = scores.get(row.id, 0.0) + 1.0 / (k + rank)
+            rows.setdefault(row.id, row)
+    return sorted(((score, rows[row_id]) for row_id, score in scores.items()), key=lambda pair: pair[0], reverse=True)
+
+
+class ManagedPgVector(PgVector2):
+    """PgVector2 that creates and maintains its ANN index and supports compact storage modes.
+
+    The index is created with the table (HNSW) or once there is enough data to train it (IVFFlat), and rebuilt
+    without blocking searches after bulk loads have grown the table past INDEX_REBUILD_GROWTH times the size it
+    was built on. The row count at build time is kept in the index comment.
+
+    `storage` is one of STORAGE_MODES; with "binary", searches take `rerank_candidates` rows from the Hamming
+    index and order them by exact distance.
+
+    Every collection also has a generated `content_tsv` column with a GIN index and indexes on the metadata that
+    searches filter on. With `retrieval="hybrid"`, the full-text and vector rankings are fused with reciprocal-rank
+    fusion, so chunks quoting an exact regulation number or account code are found even when their embedding is
+    not among the nearest. Adding the column to a collection created before it rewrites the table, so that is
+    left to `add_search_columns` (the --add-search-columns command); until then such a collection is searched by
+    vector only.
+    """
+
+    def __init__(
+        self,
+        *args,
+        storage: str = "vector",
+        rerank_candidates: int = RERANK_CANDIDATES,
+        retrieval: str = RETRIEVAL_MODE,
+        fulltext_config: str = FULLTEXT_CONFIG,
+        hybrid_candidates: int = HYBRID_CANDIDATES,
+        **kwargs,
+    ):
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Unknown vector storage mode: {storage}")
+        if retrieval not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval}")
+        if not re.fullmatch(r"\w+", fulltext_config):
+            raise ValueError(f"Invalid text search configuration: {fulltext_config}")
+        # Set before PgVector2.__init__, which builds the table definition
+        self.storage = storage
+        self.rerank_candidates = rerank_candidates
+        self.retrieval = retrieval
+        self.fulltext_config = fulltext_config
+        self.hybrid_candidates = hybrid_candidates
+        # Full-text and filter indexes known to exist and be valid
+        self._valid_search_indexes: set = set()
+        self._has_fulltext = False
+        self._iterative_scan: Optional[bool] = None
+        super().__init__(*args, **kwargs)
+
+    def get_table(self) -> Table:
+        return Table(
+            self.collection,
+            self.metadata,
+            Column("id", String, primary_key=True),
+            Column("name", String),
+            Column("meta_data", postgresql.JSONB, server_default=text("'{}'::jsonb")),
+            Column("content", postgresql.TEXT),
+            Column("embedding", HALFVEC(self.dimensions) if self.storage == "halfvec" else Vector(self.dimensions)),
+            Column("usage", postgresql.JSONB),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            Column("updated_at", DateTime(timezone=True), onupdate=text("now()")),
+            Column("content_hash", String),
+            Column("content_tsv", postgresql.TSVECTOR, Computed(self.tsvector_expression, persisted=True)),
+            extend_existing=True,
+        )
+
+    @property
+    def tsvector_expression(self) -> str:
+        """Full-text document of a chunk: its source name (file name or URL) and content"""
+        return f"to_tsvector('{self.fulltext_config}'::regconfig, coalesce(name, '') || ' ' || coalesce(content, ''))"
+
+    @property
+    def index_expression(self) -> str:
+        """Indexed expression and operator class for the storage mode"""
+        if self.storage == "binary":
+            return f"(binary_quantize(embedding)::bit({self.dimensions})) bit_hamming_ops"
+        return f"embedding {self.storage}_{_DISTANCE_OPS[self.distance]}"
+
+    @property
+    def index_name(self) -> Optional[str]:
+        if self.index is None:
+            return None
+        kind = "ivfflat" if isinstance(self.index, Ivfflat) else "hnsw"
+        return self.index.name or postgres_identifier(f"{self.collection}_{kind}_index")
+
+    def search_index_name(self, suffix: str) -> str:
+        """Name of one of the full-text and filter indexes of _SEARCH_INDEXES"""
+        return postgres_identifier(f"{self.collection}_{suffix}")
+
+    def _qualify(self, name: str) -> str:
+        return f"{self.schema}.{name}" if self.schema else name
+
+    @property
+    def qualified_table(self) -> str:
+        return self._qualify(self.collection)
+
+    def create(self) -> None:
+        super().create()
+        self._create_search_indexes()
+        if isinstance(self.index, HNSW):
+            info = self.get_index_info()
+            if info is None or info["state"] == "invalid":
+                self.optimize()
+
+    @property
+    def has_fulltext(self) -> bool:
+        """Whether the collection has its `content_tsv` column; collections created before it lack it until migrated"""
+        # Only a positive answer is kept, so a collection migrated while the app runs is picked up
+        if not self._has_fulltext:
+            with self.Session() as sess, sess.begin():
+                self._has_fulltext = bool(sess.execute(
+                    text(
+                        """
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_schema = :schema AND table_name = :table AND column_name = 'content_tsv'
+                        """
+                    ),
+                    {"schema": self.schema or "public", "table": self.collection},
+                ).scalar())
+        return self._has_fulltext
+
+    def _create_search_indexes(self) -> None:
+        """Create missing full-text and filter indexes without blocking writes; the column itself is never added here.
+
+        An index left invalid by an interrupted concurrent build is dropped and rebuilt, since IF NOT EXISTS would
+        keep skipping it while the planner never uses it.
+        """
+        if len(self._valid_search_indexes) == len(_SEARCH_INDEXES):
+            return
+        has_fulltext = self.has_fulltext
+        if not has_fulltext:
+            logger.warning(
+                f"{self.qualified_table} has no full-text column and is searched by vector only; "
+                f"run `python vector_store.py --add-search-columns --collection {self.collection}`"
+            )
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        with self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for suffix, definition in _SEARCH_INDEXES.items():
+                name = self.search_index_name(suffix)
+                if name in self._valid_search_indexes or (suffix == "content_tsv_idx" and not has_fulltext):
+                    continue
+                try:
+                    state = _index_state(conn, self._qualify(name))
+                    if state == "building":
+                        # Another process is creating it; checked again on the next create()
+                        continue
+                    if state == "invalid":
+                        logger.warning(f"Index {name} was left invalid by an interrupted build; rebuilding it")
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self._qualify(name)}"))
+                    if state != "valid":
+                        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {self.qualified_table} {definition}"))
+                    self._valid_search_indexes.add(name)
+                except Exception as e:
+                    logger.warning(f"Could not create index {name}: {e}")
+
+    def add_search_columns(self) -> None:
+        """Add the full-text column to a collection created before it existed, then its indexes.
+
+        The generated column is computed for every row, rewriting the table under an exclusive lock, so this runs
+        from the command line during a maintenance window rather than on a request.
+        """
+        if not self.has_fulltext:
+            logger.info(f"Adding full-text column to {self.qualified_table}")
+            with self.Session() as sess, sess.begin():
+                sess.execute(
+                    text(
+                        f"ALTER TABLE {self.qualified_table} ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+                        f"GENERATED ALWAYS AS ({self.tsvector_expression}) STORED"
+                    )
+                )
+        self._create_search_indexes()
+
+    def get_index_info(self) -> Optional[dict]:
+        """Name, definition, size, build-time row count and state of the collection's ANN index, or None.
+
+        `state` is "valid", "building" while a concurrent build runs, or "invalid" when a build was interrupted;
+        the planner only uses a valid index.
+        """
+        if self.index is None:
+            return None
+        with self.Session() as sess, sess.begin():
+            row = sess.execute(
+                text(
+                    """
+                    SELECT i.indexname, i.indexdef, pg_relation_size(c.oid), obj_description(c.oid, 'pg_class'),
+                           x.indisvalid,
+                           EXISTS (SELECT 1 FROM pg_stat_progress_create_index p WHERE p.index_relid = c.oid)
+                    FROM pg_indexes i
+                    JOIN pg_class c ON c.relname = i.indexname
+                    JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = i.schemaname
+                    JOIN pg_index x ON x.indexrelid = c.oid
+                    WHERE i.schemaname = :schema AND i.indexname = :name
+                    """
+                ),
+                {"schema": self.schema or "public", "name": self.index_name},
+            ).fetchone()
+        if row is None:
+            return None
+        built_rows = re.search(r"rows=(\d+)", row[3] or "")
+        return {
+            "name": row[0],
+            "definition": row[1],
+            "size_bytes": row[2],
+            "built_rows": int(built_rows.group(1)) if built_rows else None,
+            "state": "valid" if row[4] else "building" if row[5] else "invalid",
+        }
+
+    def _index_sql(self, name: str, rows: int) -> str:
+        if isinstance(self.index, Ivfflat):
+            lists = ivfflat_lists(rows) if self.index.dynamic_lists else self.index.lists
+            return (
+                f"CREATE INDEX CONCURRENTLY {name} ON {self.qualified_table} "
+                f"USING ivfflat ({self.index_expression}) WITH (lists = {lists})"
+            )
+        return (
+            f"CREATE INDEX CONCURRENTLY {name} ON {self.qualified_table} USING hnsw ({self.index_expression}) "
+            f"WITH (m = {self.index.m}, ef_construction = {self.index.ef_construction})"
+        )
+
+    def search_sql(self, limit: int, where: str = "") -> str:
+        """Nearest-neighbour query for the storage mode, taking the query embedding as :query; rows carry `distance`"""
+        operator = _DISTANCE_OPERATORS[self.distance]
+        columns = "id, name, meta_data, content, usage"
+        if self.storage == "binary":
+            candidates = max(self.rerank_candidates, limit)
+            return f"""
+                SELECT {columns}, embedding {operator} CAST(:query AS vector({self.dimensions})) AS distance FROM (
+                    SELECT {columns}, embedding FROM {self.qualified_table} {where}
+                    ORDER BY binary_quantize(embedding)::bit({self.dimensions})
+                        <~> binary_quantize(CAST(:query AS vector({self.dimensions})))
+                    LIMIT {candidates}
+                ) AS candidates
+                ORDER BY distance
+                LIMIT {limit}
+            """
+        return f"""
+            SELECT {columns}, embedding {operator} CAST(:query AS {self.storage}({self.dimensions})) AS distance
+            FROM {self.qualified_table} {where}
+            ORDER BY distance
+            LIMIT {limit}
+        """
+
+    def fulltext_sql(self, limit: int, where: str = "") -> str:
+        """Full-text query taking the search text as :text; any non-stopword of it matches, rows carry `rank`"""
+        condition = f"AND {where[len('WHERE '):]}" if where else ""
+        return f"""
+            WITH query AS (
+                SELECT to_tsquery(CAST(:config AS regconfig), coalesce(string_agg(quote_literal(lexeme), ' | '), '')) AS tsquery
+                FROM unnest(to_tsvector(CAST(:config AS regconfig), :text))
+                WHERE lexeme <> ALL(CAST(:stopwords AS text[]))
+            )
+            SELECT id, name, meta_data, content, usage, ts_rank_cd(content_tsv, query.tsquery) AS rank
+            FROM {self.qualified_table}, query
+            WHERE content_tsv @@ query.tsquery {condition}
+            ORDER BY rank DESC
+            LIMIT {limit}
+        """
+
+    def filter_clause(self, filters: Optional[Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+        """WHERE clause and bind parameters for search filters.
+
+        `name` (source file name or crawled site) and `url` match exactly and accept a list of values;
+        `uploaded_after` / `uploaded_before` bound the upload time; other table columns match exactly and any
+        remaining keys must be contained in `meta_data`.
+        """
+        conditions: List[str] = []
+        params: Dict[str, Any] = {}
+        meta_data: Dict[str, Any] = {}
+        for key, value in (filters or {}).items():
+            if value is None or value == "":
+                continue
+            if key in ("name", "url"):
+                column = "name" if key == "name" else "meta_data ->> 'url'"
+                if isinstance(value, (list, tuple, set)):
+                    conditions.append(f"{column} = ANY(CAST(:filter_{key} AS text[]))")
+                    value = list(value)
+                else:
+                    conditions.append(f"{column} = :filter_{key}")
+            elif key == "uploaded_after":
+                conditions.append("created_at >= CAST(:filter_uploaded_after AS timestamptz)")
+            elif key == "uploaded_before":
+                conditions.append("created_at < CAST(:filter_uploaded_before AS timestamptz)")
+            elif hasattr(self.table.c, key) and key != "content_tsv":
+                conditions.append(f"{key} = :filter_{key}")
+            else:
+                meta_data[key] = value
+                continue
+            params[f"filter_{key}"] = value
+        if meta_data:
+            conditions.append("meta_data @> CAST(:filter_meta_data AS jsonb)")
+            params["filter_meta_data"] = json.dumps(meta_data)
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+    @property
+    def supports_iterative_scan(self) -> bool:
+        """Whether the server's pgvector (>= 0.8) can keep scanning the ANN index until filtered results fill the limit"""
+        if self._iterative_scan is None:
+            with self.Session() as sess, sess.begin():
+                version = sess.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+            self._iterative_scan = version is not None and tuple(int(part) for part in version.split(".")[:2]) >= (0, 8)
+        return self._iterative_scan
+
+    def search_settings(self, limit: int, filtered: bool = False) -> Dict[str, Any]:
+        settings: Dict[str, Any] = {}
+        if isinstance(self.index, Ivfflat):
+            settings["ivfflat.probes"] = self.index.probes
+        elif isinstance(self.index, HNSW):
+            candidates = max(self.rerank_candidates, limit) if self.storage == "binary" else limit
+            settings["hnsw.ef_search"] = max(self.index.ef_search, candidates)
+        else:
+            return settings
+        # Without iterative scans, filters are applied to the ef_search / probes candidates only and can leave
+        # fewer results than the limit
+        if filtered and self.supports_iterative_scan:
+            settings["ivfflat.iterative_scan" if isinstance(self.index, Ivfflat) else "hnsw.iterative_scan"] = "relaxed_order"
+        return settings
+
+    def _document(self, row) -> Document:
+        return Document(id=row.id, name=row.name, meta_data=row.meta_data, content=row.content, embedder=self.embedder, usage=row.usage)
+
+    def _run_search(self, queries: List[Tuple[str, Dict[str, Any]]], limit: int, filtered: bool) -> Optional[list]:
+        """Run search queries in one transaction with the index search settings, or None if the table is missing"""
+        try:
+            with self.Session() as sess, sess.begin():
+                for key, value in self.search_settings(limit, filtered).items():
+                    sess.execute(text(f"SET LOCAL {key} = {value}"))
+                return [sess.execute(text(sql), params).fetchall() for sql, params in queries]
+        except Exception as e:
+            logger.error(f"Error searching for documents: {e}")
+            logger.error("Table might not exist, creating for future use")
+            self.create()
+            return None
+
+    @staticmethod
+    def _vector_literal(embedding: List[float]) -> str:
+        return "[" + ",".join(repr(float(value)) for value in embedding) + "]"
+
+    def search_by_embedding(
+        self, query_embedding: List[float], limit: int = 5, filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[float, Document]]:
+        """(distance, document) pairs nearest to an already computed query embedding, closest first"""
+        where, params = self.filter_clause(filters)
+        params["query"] = self._vector_literal(query_embedding)
+        results = self._run_search([(self.search_sql(limit, where), params)], limit, bool(where))
+        if results is None:
+            return []
+        # Iterative scans return rows in relaxed order
+        return sorted(((row.distance, self._document(row)) for row in results[0]), key=lambda pair: pair[0])
+
+    def hybrid_search_by_embedding(
+        self, query: str, query_embedding: List[float], limit: int = 5, filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[float, Document]]:
+        """(fused score, document) pairs from the full-text and vector rankings of `query`, best first"""
+        candidates = max(self.hybrid_candidates, limit)
+        where, params = self.filter_clause(filters)
+        params.update(
+            query=self._vector_literal(query_embedding),
+            text=query,
+            config=self.fulltext_config,
+            stopwords=list(FULLTEXT_STOPWORDS),
+        )
+        queries = [(self.search_sql(candidates, where), params)]
+        try:
+            has_fulltext = self.has_fulltext
+        except Exception as e:
+            logger.error(f"Error checking the full-text column of {self.qualified_table}: {e}")
+            has_fulltext = False
+        if has_fulltext:
+            queries.append((self.fulltext_sql(candidates, where), params))
+        results = self._run_search(queries, candidates, bool(where))
+        if results is None:
+            return []
+        # Without the full-text column the vector ranking is fused alone, so scores stay comparable across collections
+        fused = reciprocal_rank_fusion([sorted(results[0], key=lambda row: row.distance), *results[1:]])
+        return [(score, self._document(row)) for score, row in fused[:limit]]
+
+    @timed("knowledge_search")
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        query_embedding = self.embedder.get_embedding(query)
+        if query_embedding is None:
+            logger.error(f"Error getting embedding for Query: {query}")
+            return []
+        if self.retrieval == "hybrid":
+            return [document for _, document in self.hybrid_search_by_embedding(query, query_embedding, limit, filters)]
+        return [document for _, document in self.search_by_embedding(query_embedding, limit, filters)]
+
+    @property
+    def qualified_tables(self) -> List[str]:
+        return [self.qualified_table]
+
+    def optimize(self, force: bool = False) -> None:
+        """Build the ANN index, or rebuild it when `force` is set, swapping it in without blocking searches"""
+        if self.index is None:
+            return
+        rows = self.get_count()
+        if isinstance(self.index, Ivfflat) and rows < INDEX_MIN_ROWS:
+            logger.debug(f"Not building IVFFlat index on {rows} rows")
+            return
+        existing = self.get_index_info()
+        if existing is not None and existing["state"] == "building":
+            logger.info(f"Index {existing['name']} is being built by another session")
+            return
+        invalid = existing is not None and existing["state"] == "invalid"
+        if invalid:
+            # Left by an interrupted build; searches fall back to a sequential scan until it is rebuilt
+            logger.warning(f"Index {existing['name']} is invalid; rebuilding it")
+            existing = None
+        elif existing is not None and not force:
+            return
+
+        name = self.index_name
+        build_name = postgres_identifier(f"{name}_new") if existing is not None else name
+        logger.info(f"Building {type(self.index).__name__} index {build_name} on {rows} rows")
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        with self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for key, value in self.index.configuration.items():
+                conn.execute(text(f"SET {key} = '{value}'"))
+            if invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self._qualify(name)}"))
+            if existing is not None:
+                # Leftover of an interrupted rebuild
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self._qualify(build_name)}"))
+            conn.execute(text(self._index_sql(build_name, rows)))
+            if existing is not None:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self._qualify(name)}"))
+                conn.execute(text(f"ALTER INDEX {self._qualify(build_name)} RENAME TO {name}"))
+            conn.execute(text(f"COMMENT ON INDEX {self._qualify(name)} IS 'rows={rows}'"))
+
+    def after_bulk_load(self) -> bool:
+        """Build or rebuild the index if the table outgrew it; returns whether an index was built"""
+        if self.index is None:
+            return False
+        info = self.get_index_info()
+        rows = self.get_count()
+        if info is not None and info["state"] == "building":
+            return False
+        if info is None or info["state"] == "invalid":
+            self.optimize()
+            info = self.get_index_info()
+            return info is not None and info["state"] == "valid"
+        built_rows = info["built_rows"] or 0
+        if rows >= INDEX_MIN_ROWS and rows >= max(built_rows, INDEX_MIN_ROWS / INDEX_REBUILD_GROWTH) * INDEX_REBUILD_GROWTH:
+            self.optimize(force=True)
+            return True
+        return False
+
+
+class RoutedVectorDb(VectorDb):
+    """View over several collections (one per tenant) that searches only those collections.
+
+    The query is embedded once; each collection is searched through its own indexes and the results are merged
+    by distance, or by fused score with hybrid retrieval. Inserts, upserts, delete and clear go to `write_db`, the
+    collection of one named tenant; a router built without one refuses writes rather than guess a tenant.
+    """
+
+    def __init__(self, vector_dbs: List[ManagedPgVector], write_db: Optional[ManagedPgVector] = None):
+        if not vector_dbs:
+            raise ValueError("RoutedVectorDb needs at least one collection")
+        if write_db is not None and write_db not in vector_dbs:
+            raise ValueError("The collection written to must be one of the routed collections")
+        self.vector_dbs = vector_dbs
+        self.write_db = write_db
+        self.embedder = vector_dbs[0].embedder
+        self.retrieval = vector_dbs[0].retrieval
+
+    def _writer(self) -> ManagedPgVector:
+        if self.write_db is None:
+            raise ValueError("This knowledge base spans several tenants; write to a tenant collection (assistant.get_vector_db)")
+        return self.write_db
+
+    @property
+    def qualified_tables(self) -> List[str]:
+        return [vector_db.qualified_table for vector_db in self.vector_dbs]
+
+    @timed("knowledge_search")
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        query_embedding = self.embedder.get_embedding(query)
+        if query_embedding is None:
+            logger.error(f"Error getting embedding for Query: {query}")
+            return []
+        hybrid = self.retrieval == "hybrid"
+
+        def search_collection(vector_db: ManagedPgVector) -> List[Tuple[float, Document]]:
+            if hybrid:
+                return vector_db.hybrid_search_by_embedding(query, query_embedding, limit, filters)
+            return vector_db.search_by_embedding(query_embedding, limit, filters)
+
+        if len(self.vector_dbs) == 1:
+            return [document for _, document in search_collection(self.vector_dbs[0])]
+        with ThreadPoolExecutor(max_workers=min(len(self.vector_dbs), ROUTED_SEARCH_WORKERS)) as pool:
+            results = pool.map(search_collection, self.vector_dbs)
+            # Distances rank ascending, fused scores descending
+            merged = sorted((pair for pairs in results for pair in pairs), key=lambda pair: pair[0], reverse=hybrid)
+        return [document for _, document in merged[:limit]]
+
+    def create(self) -> None:
+        for vector_db in self.vector_dbs:
+            vector_db.create()
+
+    def exists(self) -> bool:
+        return all(vector_db.exists() for vector_db in self.vector_dbs)
+
+    def optimize(self) -> None:
+        for vector_db in self.vector_dbs:
+            vector_db.optimize()
+
+    def get_count(self) -> int:
+        return sum(vector_db.get_count() for vector_db in self.vector_dbs)
+
+    def doc_exists(self, document: Document) -> bool:
+        return any(vector_db.doc_exists(document) for vector_db in self.vector_dbs)
+
+    def name_exists(self, name: str) -> bool:
+        return any(vector_db.name_exists(name) for vector_db in self.vector_dbs)
+
+    def insert(self, documents: List[Document]) -> None:
+        self._writer().insert(documents)
+
+    def upsert_available(self) -> bool:
+        return self._writer().upsert_available()
+
+    def upsert(self, documents: List[Document]) -> None:
+        self._writer().upsert(documents)
+
+    def delete(self) -> None:
+        self._writer().delete()
+
+    def clear(self) -> bool:
+        return self._writer().clear()
+
+
+def _index_state(conn, index: str) -> Optional[str]:
+    """"valid", "building" (a concurrent build is running), "invalid" (left by an interrupted build) or None"""
+    row = conn.execute(
+        text(
+            """
+            SELECT i.indisvalid, EXISTS (SELECT 1 FROM pg_stat_progress_create_index p WHERE p.index_relid = i.indexrelid)
+            FROM pg_index i WHERE i.indexrelid = to_regclass(:index)
+            """
+        ),
+        {"index": index},
+    ).fetchone()
+    if row is None:
+        return None
+    valid, building = row
+    return "valid" if valid else "building" if building else "invalid"
+
+
+def _primary_key_name(conn, table: str) -> Optional[str]:
+    return conn.execute(
+        text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p'"), {"table": table}
+    ).scalar()
+
+
+def migrate_storage(
+    collection: str, storage: str, dimensions: int, schema: str = "ai", drop_old: bool = False
+) -> ManagedPgVector:
+    """Rewrite a collection with another storage mode and/or fewer dimensions, then swap it in.
+
+    Rows are copied into a new table, which gets its index before the swap, so searches keep working on the old
+    table until the rename. Shortened embeddings keep the leading dimensions and are re-normalized, which matches
+    what text-embedding-3 returns for the shorter size. Pause ingestion while this runs; writes made during the
+    copy stay in the old table, kept as <collection>_old unless `drop_old` is set.
+    """
+    from phi.embedder.base import Embedder
+
+    from db_config import get_engine
+
+    engine = get_engine()
+    with engine.begin() as conn:
+        source_type = conn.execute(
+            text(
+                """
+                SELECT format_type(a.atttypid, a.atttypmod) FROM pg_attribute a
+                WHERE a.attrelid = to_regclass(:table) AND a.attname = 'embedding'
+                """
+            ),
+            {"table": f"{schema}.{collection}"},
+        ).scalar()
+    if source_type is None:
+        raise ValueError(f"Collection {schema}.{collection} does not exist")
+    source_kind, source_dimensions = re.match(r"(\w+)\((\d+)\)", source_type).groups()
+    if dimensions > int(source_dimensions):
+        raise ValueError(f"Cannot grow {source_type} to {dimensions} dimensions; re-ingest the documents instead")
+
+    staging = ManagedPgVector(
+        collection=postgres_identifier(f"{collection}_migrating"), schema=schema, db_engine=engine, embedder=Embedder(dimensions=dimensions),
+        storage=storage, index=None,
+    )
+    staging.delete()
+    staging.create()
+
+    embedding = "embedding::vector" if source_kind == "halfvec" else "embedding"
+    if dimensions < int(source_dimensions):
+        embedding = f"l2_normalize(subvector({embedding}, 1, {dimensions}))"
+    embedding = f"({embedding})::{'halfvec' if storage == 'halfvec' else 'vector'}({dimensions})"
+    logger.info(f"Copying {schema}.{collection} ({source_type}) into {staging.qualified_table} as {storage}({dimensions})")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"""
+                INSERT INTO {staging.qualified_table}
+                    (id, name, meta_data, content, embedding, usage, created_at, updated_at, content_hash)
+                SELECT id, name, meta_data, content, {embedding}, usage, created_at, updated_at, content_hash
+                FROM {schema}.{collection}
+                """
+            )
+        )
+
+    staging.index = get_index_config()
+    staging.optimize()
+    target = ManagedPgVector(
+        collection=collection, schema=schema, db_engine=engine, embedder=Embedder(dimensions=dimensions),
+        storage=storage, index=get_index_config(),
+    )
+    with engine.begin() as conn:
+        # Index names are unique per schema, so the old table's index and key move aside first
+        old = postgres_identifier(f"{collection}_old")
+        conn.execute(text(f"DROP TABLE IF EXISTS {schema}.{old}"))
+        # Postgres names primary keys itself, shortening long table names its own way, so they are looked up
+        source_key = _primary_key_name(conn, f"{schema}.{collection}")
+        conn.execute(text(f"ALTER TABLE {schema}.{collection} RENAME TO {old}"))
+        if source_key:
+            conn.execute(text(f"ALTER INDEX {schema}.{source_key} RENAME TO {postgres_identifier(f'{old}_pkey')}"))
+        for suffix in _SEARCH_INDEXES:
+            conn.execute(text(
+                f"ALTER INDEX IF EXISTS {schema}.{postgres_identifier(f'{collection}_{suffix}')} "
+                f"RENAME TO {postgres_identifier(f'{old}_{suffix}')}"
+            ))
+        if target.index_name:
+            conn.execute(text(
+                f"ALTER INDEX IF EXISTS {schema}.{target.index_name} RENAME TO {postgres_identifier(f'{old}_ann_index')}"
+            ))
+        staging_key = _primary_key_name(conn, staging.qualified_table)
+        conn.execute(text(f"ALTER TABLE {staging.qualified_table} RENAME TO {collection}"))
+        if staging_key:
+            conn.execute(text(f"ALTER INDEX {schema}.{staging_key} RENAME TO {postgres_identifier(f'{collection}_pkey')}"))
+        for suffix in _SEARCH_INDEXES:
+            conn.execute(text(
+                f"ALTER INDEX IF EXISTS {schema}.{staging.search_index_name(suffix)} "
+                f"RENAME TO {target.search_index_name(suffix)}"
+            ))
+        if staging.index_name and target.index_name:
+            conn.execute(text(f"ALTER INDEX IF EXISTS {schema}.{staging.index_name} RENAME TO {target.index_name}"))
+        if drop_old:
+            conn.execute(text(f"DROP TABLE {schema}.{old}"))
+    return target
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate the knowledge-base vectors to another storage mode, or add the full-text search column"
+    )
+    parser.add_argument("--collection", default="auto_rag_documents_openai")
+    parser.add_argument("--schema", default="ai")
+    parser.add_argument("--storage", choices=STORAGE_MODES)
+    parser.add_argument("--dimensions", type=int, default=VECTOR_DIMENSIONS)
+    parser.add_argument("--drop-old", action="store_true", help="drop the previous table instead of keeping <collection>_old")
+    parser.add_argument("--add-search-columns", action="store_true",
+                        help="add the full-text column and search indexes to a collection created before them; rewrites the table")
+    args = parser.parse_args()
+    if args.add_search_columns:
+        from phi.embedder.base import Embedder
+
+        from db_config import get_engine
+
+        collection = ManagedPgVector(
+            collection=args.collection, schema=args.schema, db_engine=get_engine(),
+            embedder=Embedder(dimensions=args.dimensions), index=None,
+        )
+        collection.add_search_columns()
+        print(f"{collection.qualified_table} has its full-text column and search indexes")
+        raise SystemExit(0)
+    if args.storage is None:
+        parser.error("--storage or --add-search-columns is required")
+    migrated = migrate_storage(args.collection, args.storage, args.dimensions, schema=args.schema, drop_old=args.drop_old)
+    print(f"Migrated {migrated.qualified_table}: {migrated.get_count()} rows, index {migrated.get_index_info()}")
+    print(f"Run the app with VECTOR_STORAGE={args.storage} VECTOR_DIMENSIONS={args.dimensions}")
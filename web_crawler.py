@@ -0,0 +1,334 @@
+import asyncio
+import collections
+import hashlib
+import ipaddress
+import posixpath
+import time
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import httpx
+from bs4 import BeautifulSoup
+from phi.document import Document
+from phi.document.reader.website import WebsiteReader
+from phi.utils.log import logger
+
+CRAWL_STATE_TABLE = "ai.crawl_pages"
+# Extensions that are never HTML pages
+SKIPPED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".zip", ".doc", ".docx", ".xls", ".xlsx", ".mp4")
+# Query parameters that only track the visitor and never change the page
+TRACKING_PARAMS = ("utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content", "fbclid", "gclid")
+USER_AGENT = "Mozilla/5.0 (compatible; RagMultiUserCrawler/1.0)"
+
+
+def normalize_url(url: str) -> Optional[str]:
+    """Canonical form of an http(s) URL used for dedupe, or None for other schemes.
+
+    Lower-cases scheme and host, drops default ports, fragments and tracking parameters, resolves dot segments
+    and sorts the query string.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    if parts.port and not (scheme == "http" and parts.port == 80 or scheme == "https" and parts.port == 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    trailing_slash = path.endswith("/")
+    path = posixpath.normpath(path)
+    if path in (".", "//"):
+        path = "/"
+    if trailing_slash and not path.endswith("/"):
+        path += "/"
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if key.lower() not in TRACKING_PARAMS))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def site_of(url: str) -> str:
+    """Primary domain of a URL (example.go.id for www.jdih.example.go.id); IPs and single-label hosts as-is"""
+    hostname = urlsplit(url).hostname or ""
+    try:
+        ipaddress.ip_address(hostname)
+        return hostname
+    except ValueError:
+        pass
+    labels = hostname.split(".")
+    # Keep one more label for second-level public suffixes such as go.id or co.uk
+    keep = 3 if len(labels) >= 3 and len(labels[-2]) <= 3 and len(labels[-1]) == 2 else 2
+    return ".".join(labels[-keep:])
+
+
+class CrawlStateStore:
+    """Validators (ETag, Last-Modified, content hash) and outgoing links of crawled pages, kept in memory"""
+
+    def __init__(self):
+        self._pages: Dict[str, dict] = {}
+
+    def load(self, site: str) -> Dict[str, dict]:
+        return {url: state for url, state in self._pages.items() if state["site"] == site}
+
+    def save(self, states: Dict[str, dict]) -> None:
+        self._pages.update(states)
+
+    def clear(self) -> None:
+        """Forget every page, e.g. when the documents they were ingested into are deleted"""
+        self._pages.clear()
+
+
+class PostgresCrawlStateStore(CrawlStateStore):
+    """CrawlStateStore persisted in Postgres, so validators survive restarts and are shared by all workers.
+
+    States are kept per `namespace` (the knowledge-base tenant), so crawling a site into one tenant does not make
+    it look unchanged for another.
+    """
+
+    _table_ready = False
+
+    def __init__(self, namespace: str = ""):
+        super().__init__()
+        self.namespace = namespace
+
+    def _ensure_table(self, cursor) -> None:
+        if PostgresCrawlStateStore._table_ready:
+            return
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS ai")
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {CRAWL_STATE_TABLE} (
+                namespace TEXT NOT NULL DEFAULT '',
+                url TEXT NOT NULL,
+                site TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                links TEXT[] NOT NULL DEFAULT '{{}}',
+                fetched_at TIMESTAMPTZ DEFAULT now(),
+                PRIMARY KEY (namespace, url)
+            )
+            """
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS crawl_pages_site_idx ON {CRAWL_STATE_TABLE} (namespace, site)")
+        PostgresCrawlStateStore._table_ready = True
+
+    def load(self, site: str) -> Dict[str, dict]:
+        from db_config import db_connection
+
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            cursor.execute(
+                f"SELECT url, etag, last_modified, content_hash, links FROM {CRAWL_STATE_TABLE} WHERE namespace = %s AND site = %s",
+                (self.namespace, site),
+            )
+            rows = cursor.fetchall()
+            conn.commit()
+            cursor.close()
+        return {
+            url: {"site": site, "etag": etag, "last_modified": last_modified, "content_hash": content_hash, "links": links}
+            for url, etag, last_modified, content_hash, links in rows
+        }
+
+    def save(self, states: Dict[str, dict]) -> None:
+        if not states:
+            return
+        import psycopg2.extras
+        from db_config import db_connection
+
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            psycopg2.extras.execute_values(
+                cursor,
+                f"""
+                INSERT INTO {CRAWL_STATE_TABLE} (namespace, url, site, etag, last_modified, content_hash, links)
+                VALUES %s
+                ON CONFLICT (namespace, url) DO UPDATE SET
+                    site = EXCLUDED.site, etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified,
+                    content_hash = EXCLUDED.content_hash, links = EXCLUDED.links, fetched_at = now()
+                """,
+                [
+                    (self.namespace, url, state["site"], state["etag"], state["last_modified"], state["content_hash"], state["links"])
+                    for url, state in states.items()
+                ],
+            )
+            conn.commit()
+            cursor.close()
+
+    def clear(self) -> None:
+        """Forget the pages of this namespace, so a cleared knowledge base is re-ingested on the next crawl"""
+        from db_config import db_connection
+
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            self._ensure_table(cursor)
+            cursor.execute(f"DELETE FROM {CRAWL_STATE_TABLE} WHERE namespace = %s", (self.namespace,))
+            conn.commit()
+            cursor.close()
+
+
+class AsyncWebsiteReader(WebsiteReader):
+    """WebsiteReader that crawls concurrently over one keep-alive connection pool.
+
+    Pages are fetched with at most `max_connections` requests in flight and `max_per_host` per host. URLs are
+    normalized before dedupe. With a `state_store`, pages are re-fetched conditionally (ETag / Last-Modified)
+    and `read` only returns documents for pages whose content changed since the previous crawl. The validators of
+    a crawl are only stored by `save_states`, which callers run once its pages are safely ingested: stored
+    earlier, a failed ingestion would leave changed pages looking unchanged to the next crawl.
+    """
+
+    max_depth: int = 2
+    max_links: int = 20
+    # Upper bound on requests, since pages without main content do not count towards max_links
+    max_requests: Optional[int] = None
+    max_connections: int = 20
+    max_per_host: int = 4
+    timeout: float = 10.0
+    state_store: Any = None
+
+    _last_stats: Optional[dict] = None
+    _last_states: Optional[Dict[str, dict]] = None
+
+    @property
+    def last_stats(self) -> Optional[dict]:
+        """Counters of the most recent crawl: fetched, changed, unchanged, not_modified, errors, seconds"""
+        return self._last_stats
+
+    @property
+    def last_states(self) -> Optional[Dict[str, dict]]:
+        """{url: validators and links} of the pages fetched by the most recent crawl, not yet stored"""
+        return self._last_states
+
+    def save_states(self) -> None:
+        """Store the validators of the most recent crawl, so the next crawl re-fetches its pages conditionally"""
+        if self.state_store is not None and self._last_states:
+            self.state_store.save(self._last_states)
+        self._last_states = None
+
+    def _parse(self, html: bytes, url: str):
+        soup = BeautifulSoup(html, "html.parser")
+        links = []
+        for link in soup.find_all("a", href=True):
+            normalized = normalize_url(urljoin(url, link["href"]))
+            if normalized and not urlsplit(normalized).path.lower().endswith(SKIPPED_EXTENSIONS):
+                links.append(normalized)
+        return self._extract_main_content(soup), list(dict.fromkeys(links))
+
+    async def _fetch(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, url: str, previous: Optional[dict]):
+        headers = {}
+        if previous and previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous and previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+        async with semaphore:
+            logger.debug(f"Crawling: {url}")
+            response = await client.get(url, headers=headers)
+        if response.status_code == 304 and previous:
+            return "not_modified", None, previous
+        if response.status_code >= 400 or "html" not in response.headers.get("content-type", "text/html"):
+            return "error", None, None
+        # Parsing is CPU work; keep it off the event loop so other responses keep streaming in
+        content, links = await asyncio.to_thread(self._parse, response.content, str(response.url))
+        content_hash = hashlib.sha256(content.encode()).hexdigest() if content else None
+        state = {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "content_hash": content_hash,
+            "links": links,
+        }
+        unchanged = previous is not None and content_hash is not None and previous.get("content_hash") == content_hash
+        return ("unchanged" if unchanged else "changed"), content, state
+
+    async def crawl_async(self, url: str) -> Dict[str, str]:
+        """Crawl from `url` and return {url: main content} for pages that are new or changed"""
+        started = time.perf_counter()
+        start_url = normalize_url(url)
+        if start_url is None:
+            raise ValueError(f"Not an http(s) URL: {url}")
+        site = site_of(start_url)
+        store = self.state_store
+        previous_states = await asyncio.to_thread(store.load, site) if store is not None else {}
+        max_requests = self.max_requests or self.max_links * 10
+
+        stats = collections.Counter()
+        result: Dict[str, str] = {}
+        new_states: Dict[str, dict] = {}
+        seen: Set[str] = {start_url}
+        queue: asyncio.Queue = asyncio.Queue()
+        queue.put_nowait((start_url, 1))
+        host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        pages_with_content = 0
+        in_flight = 0
+
+        def budget_left() -> bool:
+            return pages_with_content + in_flight < self.max_links and stats["requests"] < max_requests
+
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        async with httpx.AsyncClient(
+            limits=limits, timeout=self.timeout, follow_redirects=True, headers={"User-Agent": USER_AGENT}
+        ) as client:
+
+            async def worker() -> None:
+                nonlocal pages_with_content, in_flight
+                while True:
+                    current_url, depth = await queue.get()
+                    try:
+                        if not budget_left():
+                            continue
+                        in_flight += 1
+                        stats["requests"] += 1
+                        host = urlsplit(current_url).netloc
+                        semaphore = host_semaphores.setdefault(host, asyncio.Semaphore(self.max_per_host))
+                        try:
+                            status, content, state = await self._fetch(client, semaphore, current_url, previous_states.get(current_url))
+                        except Exception as e:
+                            logger.debug(f"Failed to crawl: {current_url}: {e}")
+                            status, content, state = "error", None, None
+                        finally:
+                            in_flight -= 1
+                        stats[status] += 1
+                        if state is None:
+                            continue
+                        new_states[current_url] = dict(state, site=site)
+                        if state["content_hash"] is not None and pages_with_content < self.max_links:
+                            pages_with_content += 1
+                            if status == "changed":
+                                result[current_url] = content
+                        if depth < self.max_depth:
+                            for link in state["links"]:
+                                if link not in seen and site_of(link) == site:
+                                    seen.add(link)
+                                    queue.put_nowait((link, depth + 1))
+                    finally:
+                        queue.task_done()
+
+            workers = [asyncio.create_task(worker()) for _ in range(self.max_connections)]
+            await queue.join()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        self._last_states = new_states
+        stats.pop("requests", None)
+        self._last_stats = {
+            "fetched": sum(stats.values()),
+            "changed": stats["changed"],
+            "unchanged": stats["unchanged"],
+            "not_modified": stats["not_modified"],
+            "errors": stats["error"],
+            "seconds": round(time.perf_counter() - started, 2),
+        }
+        logger.info(f"Crawled {start_url}: {self._last_stats}")
+        return result
+
+    def crawl(self, url: str, starting_depth: int = 1) -> Dict[str, str]:
+        return asyncio.run(self.crawl_async(url))
+
+    def read(self, url: str) -> List[Document]:
+        """Documents for the new or changed pages reachable from `url`, chunked like WebsiteReader"""
+        documents: List[Document] = []
+        for crawled_url, crawled_content in self.crawl(url).items():
+            document = Document(name=url, id=crawled_url, meta_data={"url": crawled_url}, content=crawled_content)
+            documents.extend(self.chunk_document(document) if self.chunk else [document])
+        return documents